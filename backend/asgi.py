@@ -2,6 +2,9 @@
 ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Requests are resolved against ``backend.asgi_urls``, which serves the hot read
+endpoints from the async views in ``spyne.async_views``. Streaming responses
+(NDJSON exports, long lists) are read on the async views' database threads.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -9,8 +12,46 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+
+class AsyncReadHandler(ASGIHandler):
+    urlconf = 'backend.asgi_urls'
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None:
+            request.urlconf = self.urlconf
+        return request, error_response
+
+    async def send_response(self, response, send):
+        # Django 3.2 iterates streaming responses on the event loop, where the
+        # ORM refuses to run, and exports query as they stream. Each part is
+        # read on the database threads instead and sent before Django's final
+        # (empty) body message; Django still sends the headers and closes the
+        # response.
+        if not response.streaming:
+            return await super().send_response(response, send)
+        from spyne.async_views import db
+
+        parts = iter(response)
+        response.streaming_content = []
+
+        async def send_parts(message):
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                while True:
+                    part = await db(next, parts, None)
+                    if part is None:
+                        break
+                    for chunk, last in self.chunk_bytes(part):
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send(message)
+
+        await super().send_response(response, send_parts)
+
+
+django.setup(set_prefix=False)
+application = AsyncReadHandler()
@@ -0,0 +1,12 @@
+# URL configuration of the ASGI application.
+#
+# The async read views of spyne.async_urls come first, so they serve their
+# URLs in place of the synchronous views; everything else is backend.urls.
+
+from django.urls import include, path
+
+from .urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/v1/', include('spyne.async_urls')),
+] + sync_urlpatterns
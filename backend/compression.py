@@ -0,0 +1,128 @@
+# Response compression negotiated with Accept-Encoding.
+#
+# CompressionMiddleware compresses text and JSON bodies of at least
+# COMPRESS_MIN_SIZE bytes, and every streamed one (e.g. long lists, see
+# spyne.renderers.streamed, and NDJSON exports) chunk by chunk. It uses
+# brotli when the client prefers or equally accepts it and the brotli
+# package is installed, else gzip. Like Django's GZipMiddleware, it adds
+# Vary: Accept-Encoding and weakens the ETag of compressed responses, which
+# spyne.response_cache compares weakly.
+
+import asyncio
+import re
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses are compressed on every request, so speed beats ratio: on a page
+# of discussions level 1 saves 70% of the bytes at under a third of the CPU
+# time of level 6, which saves 73%.
+GZIP_LEVEL = 1
+BROTLI_QUALITY = 4
+
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+COMPRESSIBLE_SUBTYPES = {'json', 'x-ndjson', 'javascript', 'xml'}
+
+
+def accepted_encoding(header):
+    # The supported coding with the highest q-value in an Accept-Encoding
+    # header, brotli on ties, or None.
+    weights = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding.strip():
+            weights[coding.strip().lower()] = weight
+    best = max(ENCODINGS, key=lambda coding: (weights.get(coding, weights.get('*', 0.0)), coding == 'br'))
+    return best if weights.get(best, weights.get('*', 0.0)) > 0 else None
+
+
+def compressible(content_type):
+    media_type = content_type.split(';')[0].strip().lower()
+    main, _, subtype = media_type.partition('/')
+    return main == 'text' or subtype in COMPRESSIBLE_SUBTYPES or subtype.endswith(('+json', '+xml'))
+
+
+def compress(coding, data):
+    if coding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(coding, chunks):
+    # Flushes after every chunk, so each is sent as soon as it's produced.
+    if coding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class CompressionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESS_MIN_SIZE', 1024)
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Lets Django call the middleware as a coroutine, like MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if (
+            response.has_header('Content-Encoding')
+            or not compressible(response.get('Content-Type', ''))
+            or (not response.streaming and len(response.content) < self.min_size)
+        ):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(coding, response.streaming_content)
+            if response.has_header('Content-Length'):
+                del response['Content-Length']
+        else:
+            compressed = compress(coding, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+        if response.has_header('ETag'):
+            response['ETag'] = re.sub(r'^"', 'W/"', response['ETag'])
+        response['Content-Encoding'] = coding
+        return response
@@ -0,0 +1,235 @@
+# Per-endpoint request instrumentation.
+#
+# MetricsMiddleware records, for every request, the wall-clock latency, the
+# number of SQL queries and the time spent in them, and the time spent building
+# the output of serializers using TimedSerializerMixin, labelled by the
+# resolved URL name. The aggregates are exposed in the Prometheus text format by
+# metrics_view.
+#
+# Settings:
+#
+# * METRICS_QUERY_COUNT_HEADER: add an X-Query-Count header to responses.
+# * METRICS_SLOW_REQUEST_SECONDS: log requests slower than this, along with
+#   the SQL they ran, to the backend.metrics logger. None disables it.
+# * METRICS_ALLOWED_IPS: client addresses that may read /metrics.
+# * METRICS_TOKEN: a token that also lets other clients read it, sent as
+#   Authorization: Bearer <token>. None allows none.
+#
+# The middleware works under WSGI and ASGI. Queries are attributed to the
+# request whose context they run in, so those an async view runs on other
+# threads (see spyne.async_views.db) are counted too.
+
+import asyncio
+import contextvars
+import hmac
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Statements kept per request for the slow request log.
+MAX_CAPTURED_QUERIES = 200
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+# Set while a serializer's output is being timed, so nested ones aren't again.
+_serializing = contextvars.ContextVar('serializing', default=False)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+class Registry:
+    HISTOGRAMS = [
+        ('request_duration_seconds', 'Wall-clock time to handle a request.', LATENCY_BUCKETS),
+        ('request_db_queries', 'SQL queries run per request.', QUERY_BUCKETS),
+        ('request_db_seconds', 'Time spent in SQL queries per request.', LATENCY_BUCKETS),
+        ('request_serializer_seconds', 'Time spent building serializer output per request.', LATENCY_BUCKETS),
+    ]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.requests = {}
+
+    def record(self, view, method, status, observations):
+        with self.lock:
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name, help_text, buckets in self.HISTOGRAMS:
+                histogram = self.histograms.setdefault((name, view, method), Histogram(buckets))
+                histogram.observe(observations[name])
+
+    def render(self):
+        lines = [
+            '# HELP spyne_requests_total Requests handled.',
+            '# TYPE spyne_requests_total counter',
+        ]
+        with self.lock:
+            for (view, method, status), count in sorted(self.requests.items()):
+                lines.append(f'spyne_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+            for name, help_text, buckets in self.HISTOGRAMS:
+                lines.append(f'# HELP spyne_{name} {help_text}')
+                lines.append(f'# TYPE spyne_{name} histogram')
+                for (metric, view, method), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if metric != name:
+                        continue
+                    labels = f'view="{view}",method="{method}"'
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f'spyne_{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'spyne_{name}_bucket{{{labels},le="+Inf"}} {histogram.total}')
+                    lines.append(f'spyne_{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'spyne_{name}_count{{{labels}}} {histogram.total}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = []
+        self.query_count = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        # Async views run queries for one request on several threads at once.
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.query_count += 1
+                self.db_seconds += duration
+                if len(self.queries) < MAX_CAPTURED_QUERIES:
+                    self.queries.append((duration, sql))
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(instrument_connection)
+
+
+class TimedSerializerMixin:
+    # Adds the time a serializer spends turning instances into data to the
+    # current request's metrics. Only the outermost serializer is timed;
+    # nested ones are part of it, and a list is the sum of its items.
+    def to_representation(self, instance):
+        metrics = _current.get()
+        if metrics is None or _serializing.get():
+            return super().to_representation(instance)
+        token = _serializing.set(True)
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            _serializing.reset(token)
+            with metrics.lock:
+                metrics.serializer_seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.query_count_header = getattr(settings, 'METRICS_QUERY_COUNT_HEADER', False)
+        self.slow_request_seconds = getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', None)
+        # Connections opened before this module was loaded.
+        for connection in connections.all():
+            instrument_connection(None, connection)
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Lets Django call the middleware as a coroutine, like MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, metrics, time.perf_counter() - start)
+
+    def record(self, request, response, metrics, duration):
+        view = self.view_name(request)
+        registry.record(view, request.method, response.status_code, {
+            'request_duration_seconds': duration,
+            'request_db_queries': metrics.query_count,
+            'request_db_seconds': metrics.db_seconds,
+            'request_serializer_seconds': metrics.serializer_seconds,
+        })
+        if self.query_count_header:
+            response['X-Query-Count'] = str(metrics.query_count)
+        if self.slow_request_seconds is not None and duration >= self.slow_request_seconds:
+            logger.warning(
+                'Slow request %s %s (%s): %.3fs, %d queries in %.3fs, serializers %.3fs\n%s',
+                request.method, request.path, view, duration, metrics.query_count,
+                metrics.db_seconds, metrics.serializer_seconds,
+                '\n'.join(f'  [{query_duration * 1000:.1f}ms] {sql}' for query_duration, sql in metrics.queries),
+            )
+        return response
+
+    def view_name(self, request):
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return 'unresolved'
+        return match.view_name or match.route or 'unnamed'
+
+
+def metrics_view(request):
+    allowed_ips = getattr(settings, 'METRICS_ALLOWED_IPS', ['127.0.0.1', '::1'])
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if request.META.get('REMOTE_ADDR') not in allowed_ips and not (
+        token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+    ):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
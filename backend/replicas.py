@@ -0,0 +1,265 @@
+# Read-replica routing.
+#
+# ReplicaRouter sends reads to one of the aliases in DATABASE_REPLICAS while
+# ReplicaMiddleware has marked the current request as safe to serve from a
+# replica, and everything else to default. A request is served from the
+# primary when:
+#
+# * it uses an unsafe method, or has already written to the database;
+# * the client wrote within the last REPLICA_STICKY_SECONDS, so it reads its
+#   own writes (clients are identified by the user id in their JWT and remembered
+#   in the REPLICA_PIN_CACHE_ALIAS cache, which must be shared between worker
+#   processes: with a process-local one a client's next request may land on
+#   another worker that doesn't know it wrote);
+# * the view is marked with use_primary;
+# * the read happens inside a transaction on the primary;
+# * no replica is healthy.
+#
+# Replicas are probed at most every REPLICA_HEALTH_CHECK_INTERVAL seconds
+# per process, on a background thread so no request waits for a probe; requests
+# use the result of the last one (a replica not probed yet counts as healthy).
+# They are ejected until the next probe when the probe fails, when
+# their lag exceeds REPLICA_MAX_LAG_SECONDS (MySQL only, None disables
+# the check) or when a request fails with a database error while using them.
+# Outside of a request (management commands, background threads) everything
+# goes to the primary. Under ASGI the routing follows the request's context onto
+# the threads its queries run on. Responses built from replica reads are not
+# stored in the response cache (see read_from_replica).
+
+import asyncio
+import base64
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, InterfaceError, OperationalError, connections
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_current = contextvars.ContextVar('replica_routing', default=None)
+
+PIN_CACHE_ALIAS = getattr(settings, 'REPLICA_PIN_CACHE_ALIAS', 'default')
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'spyne.cache.LRUCache',
+)
+
+
+def use_primary(view):
+    # Serve every request to `view` (a function or class based view) from the
+    # primary database.
+    view.read_from_primary = True
+    return view
+
+
+def read_from_replica():
+    # Whether the current request has read from a replica, which may not have
+    # replayed writes whose effects other clients already read back.
+    routing = _current.get()
+    return routing is not None and routing.replica is not None
+
+
+class RequestRouting:
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+        self.replica = None
+
+
+class ReplicaPool:
+    def __init__(self, aliases, check_interval, max_lag):
+        self.aliases = list(aliases)
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.lock = threading.Lock()
+        # alias -> (healthy, time of the next check)
+        self.health = {}
+        self.prober = ThreadPoolExecutor(1, thread_name_prefix='replica-health')
+
+    def choose(self):
+        healthy = [alias for alias in self.aliases if self.is_healthy(alias)]
+        return random.choice(healthy) if healthy else None
+
+    def is_healthy(self, alias):
+        # The last probe's result; starts the next probe when it's due.
+        now = time.monotonic()
+        with self.lock:
+            healthy, next_check = self.health.get(alias, (True, 0))
+            if now < next_check:
+                return healthy
+            # Claim the probe so concurrent requests don't start it again.
+            self.health[alias] = (healthy, now + self.check_interval)
+        self.prober.submit(self.probe, alias)
+        return healthy
+
+    def probe(self, alias):
+        healthy = self.check(alias)
+        with self.lock:
+            self.health[alias] = (healthy, time.monotonic() + self.check_interval)
+        return healthy
+
+    def check(self, alias):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                lag = self.lag(connection, cursor)
+        except DatabaseError as e:
+            logger.warning('Replica %s ejected: %s', alias, e)
+            connection.close()
+            return False
+        if self.max_lag is not None and (lag is None or lag > self.max_lag):
+            logger.warning('Replica %s ejected: %s seconds behind the primary', alias, lag)
+            return False
+        return True
+
+    def lag(self, connection, cursor):
+        if self.max_lag is None or connection.vendor != 'mysql':
+            return 0
+        cursor.execute('SHOW SLAVE STATUS')
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        columns = [column[0] for column in cursor.description]
+        return dict(zip(columns, row)).get('Seconds_Behind_Master')
+
+    def eject(self, alias):
+        logger.warning('Replica %s ejected after a failed request', alias)
+        with self.lock:
+            self.health[alias] = (False, time.monotonic() + self.check_interval)
+
+
+pool = ReplicaPool(
+    getattr(settings, 'DATABASE_REPLICAS', []),
+    getattr(settings, 'REPLICA_HEALTH_CHECK_INTERVAL', 10),
+    getattr(settings, 'REPLICA_MAX_LAG_SECONDS', None),
+)
+
+
+def check_pin_cache(aliases):
+    if aliases and settings.CACHES[PIN_CACHE_ALIAS]['BACKEND'] in PROCESS_LOCAL_CACHES:
+        logger.warning(
+            'Clients that wrote are pinned to the primary in the process-local cache %r; with several worker '
+            'processes set REPLICA_PIN_CACHE_ALIAS to a shared cache, or they may not read their own writes.',
+            PIN_CACHE_ALIAS,
+        )
+
+
+check_pin_cache(pool.aliases)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = _current.get()
+        if routing is None or not routing.use_replica or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if routing.replica is None:
+            routing.replica = pool.choose()
+            if routing.replica is None:
+                routing.use_replica = False
+                return DEFAULT_DB_ALIAS
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _current.get()
+        if routing is not None:
+            routing.wrote = True
+            routing.use_replica = False
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in pool.aliases:
+            return False
+        return None
+
+
+def _client_id(request):
+    # Only used to pick a database, so the token doesn't need verifying here;
+    # a forged one can do no more than send its bearer's reads to the primary.
+    header = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(header) != 2:
+        return None
+    try:
+        payload = header[1].split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return claims.get(jwt_settings.USER_ID_CLAIM)
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+        if asyncio.iscoroutinefunction(self.get_response):
+            # Lets Django call the middleware as a coroutine, like MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not pool.aliases:
+            return self.get_response(request)
+
+        client_id = _client_id(request)
+        pin_key = f'replicas:pinned:{client_id}'
+        use_replica = request.method in SAFE_METHODS and not (client_id is not None and caches[PIN_CACHE_ALIAS].get(pin_key))
+        routing = RequestRouting(use_replica)
+        token = _current.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        if routing.wrote and client_id is not None and self.sticky_seconds:
+            caches[PIN_CACHE_ALIAS].set(pin_key, True, self.sticky_seconds)
+        return response
+
+    async def __acall__(self, request):
+        if not pool.aliases:
+            return await self.get_response(request)
+
+        client_id = _client_id(request)
+        pin_key = f'replicas:pinned:{client_id}'
+        use_replica = request.method in SAFE_METHODS and not (
+            client_id is not None and await sync_to_async(caches[PIN_CACHE_ALIAS].get)(pin_key)
+        )
+        routing = RequestRouting(use_replica)
+        token = _current.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        if routing.wrote and client_id is not None and self.sticky_seconds:
+            await sync_to_async(caches[PIN_CACHE_ALIAS].set)(pin_key, True, self.sticky_seconds)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'cls', view_func)
+        if getattr(view, 'read_from_primary', False) or getattr(view_func, 'read_from_primary', False):
+            routing = _current.get()
+            if routing is not None:
+                routing.use_replica = False
+
+    def process_exception(self, request, exception):
+        # Only blame the replica when it is the only database the request read from.
+        routing = _current.get()
+        if (routing is not None and routing.use_replica and routing.replica is not None
+                and isinstance(exception, (OperationalError, InterfaceError))):
+            pool.eject(routing.replica)
@@ -45,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'backend.metrics.MetricsMiddleware',
+    'backend.replicas.ReplicaMiddleware',
+    'backend.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,6 +94,54 @@ DATABASES = {
     }
 }
 
+# Read replicas (see backend/replicas.py), given as a comma-separated list of
+# hosts in REPLICA_HOSTS and sharing the primary's credentials. In tests they
+# mirror the primary's test database.
+for number, host in enumerate(filter(None, os.getenv('REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['backend.replicas.ReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# 'responses' holds cached API responses. LRUCache is per process; for several
+# worker processes point it at a shared backend instead, e.g.
+# django.core.cache.backends.filebased.FileBasedCache or
+# django.core.cache.backends.db.DatabaseCache.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'spyne.cache.LRUCache',
+        'TIMEOUT': 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'MAX_BYTES': 64 * 1024 * 1024,
+        },
+    },
+    'typeahead': {
+        'BACKEND': 'spyne.cache.LRUCache',
+        'TIMEOUT': 30,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    'auth': {
+        'BACKEND': 'spyne.cache.LRUCache',
+        'TIMEOUT': 30,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+RESPONSE_CACHE_ALIAS = 'responses'
+TYPEAHEAD_CACHE_ALIAS = 'typeahead'
+AUTH_CACHE_ALIAS = 'auth'
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -134,7 +185,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'spyne.authentication.CachedJWTAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'spyne.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'spyne.renderers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
 }
 
@@ -146,3 +206,125 @@ SIMPLE_JWT = {
 AUTH_USER_MODEL = 'spyne.User'
 
 APPEND_SLASH = False
+
+# Discussion views are counted in memory and written back in bulk. Counts in the
+# database lag by at most VIEW_COUNT_FLUSH_INTERVAL seconds (0 disables buffering)
+# or VIEW_COUNT_MAX_PENDING distinct discussions, whichever comes first.
+VIEW_COUNT_FLUSH_INTERVAL = 5
+VIEW_COUNT_MAX_PENDING = 1000
+
+# Home timelines are materialized on write, except for authors with more than
+# FEED_FANOUT_LIMIT followers, whose discussions are merged in at read time.
+# Following someone copies their latest FEED_BACKFILL_SIZE discussions.
+FEED_FANOUT_LIMIT = 10000
+FEED_BACKFILL_SIZE = 100
+# Copying a new discussion into its followers' timelines happens after the
+# request on a background thread; set to False to leave it to `manage.py fan_out`.
+FEED_FANOUT_IN_PROCESS = True
+
+# Follow adjacency sets and follower/following counts are cached for this many
+# seconds in the FOLLOW_CACHE_ALIAS cache; follow and unfollow invalidate them
+# immediately, in every process only if that cache is shared by all of them
+# (the LocMemCache default isn't).
+FOLLOW_CACHE_ALIAS = 'default'
+FOLLOW_CACHE_TIMEOUT = 300
+
+# Maximum number of ids accepted by the batch endpoints.
+BATCH_MAX_ITEMS = 100
+
+# Request instrumentation (see backend/metrics.py). Metrics are served at
+# /metrics to METRICS_ALLOWED_IPS, and to clients sending
+# "Authorization: Bearer <METRICS_TOKEN>" when a token is set.
+METRICS_QUERY_COUNT_HEADER = DEBUG
+METRICS_SLOW_REQUEST_SECONDS = 1.0
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# After a client writes, its reads go to the primary for this many seconds.
+# Writers are remembered in the REPLICA_PIN_CACHE_ALIAS cache, which must be
+# shared by all worker processes (the LocMemCache default above isn't) when
+# replicas are used. Replicas are health checked at most every REPLICA_HEALTH_CHECK_INTERVAL
+# seconds and skipped while down or lagging by more than REPLICA_MAX_LAG_SECONDS
+# (MySQL only; None disables the lag check).
+REPLICA_STICKY_SECONDS = 5
+REPLICA_PIN_CACHE_ALIAS = 'default'
+REPLICA_HEALTH_CHECK_INTERVAL = 10
+REPLICA_MAX_LAG_SECONDS = None
+
+# Trending discussions and hashtags are ranked by likes, comments and views
+# weighted by TRENDING_WEIGHTS and decayed with each window's half-life in
+# seconds. `manage.py compute_trending` refreshes the top TRENDING_SIZE of each.
+# Likes and comments are counted once they're TRENDING_GRACE_SECONDS old, so
+# that those committed out of id order aren't skipped.
+TRENDING_WINDOWS = {'hour': 3600, 'day': 6 * 3600, 'week': 2 * 86400}
+TRENDING_WEIGHTS = {'view': 1, 'like': 5, 'comment': 10}
+TRENDING_SIZE = 100
+TRENDING_GRACE_SECONDS = 60
+
+# Discussion text search returns the best SEARCH_MAX_RESULTS matches, and only
+# matches a word found in more than SEARCH_MAX_POSTINGS discussions in the newest
+# SEARCH_MAX_POSTINGS of them (spyne/search.py).
+SEARCH_MAX_RESULTS = 1000
+SEARCH_MAX_POSTINGS = 20000
+
+# Users returned by the typeahead search (users/typeahead) by default and at most.
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_MAX_LIMIT = 50
+
+# Deleted users and discussions are hidden at once; their rows and everything
+# depending on them are removed PURGE_CHUNK_SIZE rows per transaction, on a
+# background thread when PURGE_IN_PROCESS is set, else by `manage.py purge_deleted`.
+PURGE_CHUNK_SIZE = 500
+PURGE_IN_PROCESS = True
+
+# Rows read per query by the NDJSON exports (/api/v1/export/, `manage.py export_data`).
+EXPORT_CHUNK_SIZE = 2000
+
+# Follow suggestions (users/<id>/suggestions) rank the users followed by the
+# users someone follows, by how many of them do, plus SUGGESTIONS_POPULARITY_WEIGHT
+# per doubling of the candidate's followers. `manage.py compute_suggestions`
+# keeps the top SUGGESTIONS_SIZE per user, ranking users across
+# SUGGESTIONS_PROCESSES worker processes (None: one per CPU).
+SUGGESTIONS_SIZE = 50
+SUGGESTIONS_POPULARITY_WEIGHT = 0.25
+SUGGESTIONS_PROCESSES = None
+
+# Uploads are streamed to a temporary file in chunks rather than buffered in
+# memory, and discussion images are then stored once per distinct content.
+# IMAGE_VARIANTS (longest edge in pixels) are rendered in IMAGE_PROCESSES worker
+# processes, in the web process when IMAGE_PROCESS_IN_PROCESS is set, else by
+# `manage.py process_images`.
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+IMAGE_VARIANTS = {'thumbnail': 160, 'medium': 800}
+IMAGE_PROCESSES = 2
+IMAGE_PROCESS_IN_PROCESS = True
+
+# Under ASGI (backend/asgi.py) the hot read endpoints are async views whose
+# database work runs on ASYNC_DB_THREADS threads, each holding at most one
+# connection per database.
+ASYNC_DB_THREADS = 16
+
+# Authenticated users are cached for the TIMEOUT of the AUTH_CACHE_ALIAS cache
+# (spyne/authentication.py) and evicted when saved. With AUTH_LAZY_USERS, views
+# get a user that is only loaded when they use more than its id; deactivated and
+# deleted users are then rejected through a revocation list in the same cache,
+# which must be shared by all worker processes (the LocMemCache default isn't).
+AUTH_LAZY_USERS = False
+
+# Logins verify passwords on LOGIN_HASHING_THREADS threads (None: one per CPU)
+# and turn away logins beyond LOGIN_MAX_PENDING in flight (None: four per
+# thread) with 503 and Retry-After (spyne/logins.py). `manage.py prune_tokens`
+# deletes expired refresh tokens TOKEN_PRUNE_CHUNK_SIZE rows per transaction.
+LOGIN_HASHING_THREADS = None
+LOGIN_MAX_PENDING = None
+TOKEN_PRUNE_CHUNK_SIZE = 1000
+
+# JSON is encoded and parsed with orjson (in requirements.txt), or DRF's json
+# module when it isn't installed (spyne/renderers.py). Unpaginated lists of
+# JSON_STREAM_MIN_ITEMS or more are streamed, encoded JSON_STREAM_CHUNK_SIZE
+# items at a time. Text and JSON responses of at least COMPRESS_MIN_SIZE bytes,
+# and streamed ones, are compressed with brotli (an optional extra:
+# `pip install brotli`) or gzip, as the client accepts (backend/compression.py).
+JSON_STREAM_MIN_ITEMS = 1000
+JSON_STREAM_CHUNK_SIZE = 500
+COMPRESS_MIN_SIZE = 1024
@@ -3,8 +3,11 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('spyne.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SpyneConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'spyne'
+
+    def ready(self):
+        # Connects the signal receivers.
+        from . import authentication
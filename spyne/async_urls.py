@@ -0,0 +1,24 @@
+from django.urls import path
+
+from . import async_views, views
+
+# Served in front of spyne/urls.py by the ASGI application (backend/asgi.py).
+# Each route hands the methods it doesn't serve to the synchronous view.
+urlpatterns = [
+    path('discussions/', async_views.DiscussionListView.as_view(
+        views.DiscussionViewSet.as_view({'get': 'list', 'post': 'create'}),
+    ), name='discussion-list'),
+    path('discussions/<int:pk>/', async_views.DiscussionDetailView.as_view(
+        views.DiscussionViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}),
+    ), name='discussion-detail'),
+    path('discussions/search', async_views.DiscussionSearchView.as_view(
+        views.DiscussionListView.as_view(),
+    ), name='discussion_search'),
+    path('users/search', async_views.UserSearchView.as_view(views.UserSearchView.as_view()), name='user_search'),
+    path('users/followers/<int:user_id>', async_views.FollowersListView.as_view(
+        views.FollowersListView.as_view({'get': 'list'}),
+    ), name='user-followers'),
+    path('users/following/<int:user_id>', async_views.FollowingListView.as_view(
+        views.FollowingListView.as_view({'get': 'list'}),
+    ), name='user-following'),
+]
@@ -0,0 +1,313 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+
+from .authentication import CachedJWTAuthentication
+from .batch import parse_ids
+from .filters import HashtagAndTextFilter
+from .models import User, Discussion, Follow
+from .pagination import KeysetPagination, FollowKeysetPagination, SearchPagination
+from .renderers import JSONRenderer
+from .search import ranked_ids
+from .serializers import DiscussionSerializer, UserSerializer
+from .viewcounts import view_counts
+from . import fastpath
+from . import response_cache
+
+# Async versions of the hottest read endpoints, served in place of the DRF views
+# by backend/asgi.py. Django 3.2 has no async ORM, so database work is handed to
+# a pool of ASYNC_DB_THREADS threads with db(): the event loop stays free while
+# queries run, and independent queries of one request run at the same time.
+# Responses are byte-identical to the synchronous views', which still handle
+# every other method on the same URLs.
+
+DB_THREADS = getattr(settings, 'ASYNC_DB_THREADS', 16)
+
+_executor = ThreadPoolExecutor(DB_THREADS, thread_name_prefix='async-db')
+_authentication = CachedJWTAuthentication()
+_renderer = JSONRenderer()
+
+
+def _call(func, args, kwargs):
+    # Executor threads keep their connections between calls, at most one per
+    # database each, and no request ever starts or finishes on them; so, as
+    # Django does for each request, drop those that have failed or outlived
+    # CONN_MAX_AGE before every call.
+    for connection in connections.all():
+        connection.close_if_unusable_or_obsolete()
+    return func(*args, **kwargs)
+
+
+async def db(func, *args, **kwargs):
+    # Runs blocking (ORM) code on the database threads, in the caller's context
+    # so that replica routing and request metrics follow it.
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _executor, functools.partial(context.run, _call, func, args, kwargs),
+    )
+
+
+async def _nothing():
+    return None
+
+
+def json_response(data=None, status=status.HTTP_200_OK):
+    if data is None:
+        return HttpResponse(status=status)
+    return HttpResponse(_renderer.render(data), status=status, content_type=_renderer.media_type)
+
+
+def error_response(request, exc):
+    # What DRF's exception handler returns for exc.
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = json_response(data, status=exc.status_code)
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        response['WWW-Authenticate'] = _authentication.authenticate_header(request)
+    return response
+
+
+def validated_token(request):
+    # The request's access token, checked without touching the database, or
+    # None if it carries none. Raises AuthenticationFailed for a bad one.
+    header = _authentication.get_header(request)
+    if header is None:
+        return None
+    raw_token = _authentication.get_raw_token(header)
+    if raw_token is None:
+        return None
+    return _authentication.get_validated_token(raw_token)
+
+
+class Fallback(Exception):
+    # Raised by handlers for requests only the synchronous view can serve.
+    pass
+
+
+class AsyncReadView:
+    # Handles GET requests on the event loop; other methods go to the
+    # synchronous view for the same URL. Authentication, permissions and the
+    # response cache behave as in the DRF views.
+    authenticated = False
+    # Cache tags found while building the response (see response_cache.store).
+    response_tags = ()
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    @classmethod
+    def as_view(cls, fallback):
+        fallback = sync_to_async(fallback)
+
+        async def view(request, *args, **kwargs):
+            if request.method != 'GET':
+                return await fallback(request, *args, **kwargs)
+            return await cls(fallback).dispatch(request, *args, **kwargs)
+
+        # Like DRF views, which authenticate with tokens rather than cookies.
+        view.csrf_exempt = True
+        view.cls = cls
+        return view
+
+    def get_cache_tags(self, **kwargs):
+        # Invalidation tags of a cached response, or None to not cache.
+        return None
+
+    def get_serializer_context(self):
+        return {'request': self.request, 'format': None, 'view': self}
+
+    async def dispatch(self, request, **kwargs):
+        self.request = Request(request)
+        self.kwargs = kwargs
+        try:
+            token = validated_token(request)
+            if token is None and self.authenticated:
+                raise exceptions.NotAuthenticated()
+            # The user lookup and the cache lookup don't depend on each other.
+            tags = self.get_cache_tags(**kwargs)
+            user, cached = await asyncio.gather(
+                db(_authentication.get_user, token) if token is not None else _nothing(),
+                db(response_cache.lookup, self.request, tags) if tags is not None else _nothing(),
+            )
+            self.request.user = AnonymousUser() if user is None else user
+
+            if cached is not None:
+                key, entry = cached
+                if entry is not None:
+                    return response_cache.respond(self.request, entry, json_response)
+            data = await self.get(**kwargs)
+            if isinstance(data, HttpResponse):
+                return data
+            if cached is None:
+                return json_response(data)
+            entry = await db(response_cache.store, key, data, self.response_tags)
+            return response_cache.respond(self.request, entry, json_response)
+        except exceptions.APIException as exc:
+            return error_response(request, exc)
+        except Fallback:
+            return await self.fallback(request, **kwargs)
+
+    async def get(self, **kwargs):
+        raise NotImplementedError
+
+
+class AsyncListView(AsyncReadView):
+    # Lists rendered from .values() rows (see spyne/fastpath.py).
+    serializer_class = None
+    pagination_class = None
+
+    def get_plan(self):
+        plan = fastpath.compile(self.serializer_class(context=self.get_serializer_context()))
+        if plan is None:
+            raise Fallback()
+        return plan
+
+    async def render(self, plan, rows):
+        # The nested lists of the rows are independent and loaded concurrently.
+        pks = [row['pk'] for row in rows] if plan.many else []
+        related = await asyncio.gather(*(db(plan.related, many, pks) for many in plan.many))
+        return plan.attach(rows, related)
+
+    async def paginate(self, queryset):
+        # A keyset page of queryset, as the synchronous list views return it.
+        plan = self.get_plan()
+        paginator = self.pagination_class()
+        keys = [paginator.ordering_field, paginator.tiebreak_field]
+        rows = await db(paginator.paginate_queryset, plan.values(queryset, *keys), self.request)
+        self.response_tags = self.get_response_tags(rows)
+        return paginator.get_paginated_response(await self.render(plan, rows)).data
+
+    def get_response_tags(self, rows):
+        return ()
+
+    async def fetch(self, queryset, pks):
+        # The rows of queryset among pks that still exist, in the order given.
+        plan = self.get_plan()
+        pks = list(dict.fromkeys(pks))
+        rows = await db(list, plan.values(queryset.filter(pk__in=pks), 'pk'))
+        found = {row['pk']: row for row in rows}
+        rows = [found[pk] for pk in pks if pk in found]
+        return await self.render(plan, rows)
+
+
+class DiscussionDetailView(AsyncReadView):
+    authenticated = True
+
+    def get_cache_tags(self, pk):
+        return [f'discussion:{pk}']
+
+    async def dispatch(self, request, **kwargs):
+        response = await super().dispatch(request, **kwargs)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            await db(view_counts.add, kwargs['pk'])
+        return response
+
+    async def get(self, pk):
+        serializer = DiscussionSerializer(context=self.get_serializer_context())
+        plan = fastpath.compile(serializer)
+        if plan is None:
+            discussion = await db(Discussion.objects.filter(pk=pk).first)
+            if discussion is None:
+                return json_response({'error': 'Discussion not found'}, status=status.HTTP_404_NOT_FOUND)
+            return await db(lambda: DiscussionSerializer(discussion, context=serializer.context).data)
+        # The discussion and its comments are fetched at the same time.
+        rows, *related = await asyncio.gather(
+            db(list, plan.values(Discussion.objects.filter(pk=pk), 'pk')),
+            *(db(plan.related, many, [pk]) for many in plan.many),
+        )
+        if not rows:
+            return json_response({'error': 'Discussion not found'}, status=status.HTTP_404_NOT_FOUND)
+        return plan.attach(rows, related)[0]
+
+
+class DiscussionListView(AsyncListView):
+    authenticated = True
+    serializer_class = DiscussionSerializer
+    pagination_class = KeysetPagination
+
+    async def get(self):
+        ids = self.request.query_params.get('ids', None)
+        if ids is None:
+            return await self.paginate(Discussion.objects.all())
+        try:
+            ids = parse_ids(ids)
+        except ValueError as e:
+            return json_response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return await self.fetch(Discussion.objects.all(), ids)
+
+
+class DiscussionSearchView(AsyncListView):
+    serializer_class = DiscussionSerializer
+    pagination_class = KeysetPagination
+
+    def get_cache_tags(self):
+        return ['discussions']
+
+    def get_response_tags(self, rows):
+        return response_cache.discussion_tags(rows)
+
+    async def get(self):
+        queryset = await db(HashtagAndTextFilter().filter_queryset, self.request, Discussion.objects.all(), self)
+        text = self.request.query_params.get('text', None)
+        if not text:
+            return await self.paginate(queryset)
+
+        ranked = await db(ranked_ids, text, queryset)
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(ranked, self.request, view=self)
+        self.response_tags = response_cache.discussion_tags(page)
+        return paginator.get_paginated_response(await self.fetch(Discussion.objects.all(), page)).data
+
+
+class UserSearchView(AsyncListView):
+    serializer_class = UserSerializer
+
+    def get_cache_tags(self):
+        return ['users']
+
+    async def get(self):
+        queryset = User.objects.all()
+        name = self.request.query_params.get('name', None)
+        if name is not None:
+            queryset = queryset.filter(name__icontains=name)
+        plan = self.get_plan()
+        return await db(plan.render, plan.values(queryset))
+
+
+class FollowListView(AsyncReadView):
+    # The followers (direction 'follower') or followed users ('following') of a user.
+    authenticated = True
+    direction = None
+
+    def get_cache_tags(self, user_id):
+        return ['users', f'{"followers" if self.direction == "follower" else "following"}:{user_id}']
+
+    async def get(self, user_id):
+        if self.direction == 'follower':
+            queryset = Follow.objects.filter(following_id=user_id, follower__deleted_on__isnull=True)
+        else:
+            queryset = Follow.objects.filter(follower_id=user_id, following__deleted_on__isnull=True)
+        paginator = FollowKeysetPagination()
+        rows = await db(
+            paginator.paginate_queryset,
+            queryset.values('id', 'created_at', f'{self.direction}_id', f'{self.direction}__name'),
+            self.request,
+        )
+        users = [{'id': row[f'{self.direction}_id'], 'name': row[f'{self.direction}__name']} for row in rows]
+        return paginator.get_paginated_response(users).data
+
+
+class FollowersListView(FollowListView):
+    direction = 'follower'
+
+
+class FollowingListView(FollowListView):
+    direction = 'following'
@@ -0,0 +1,113 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from backend.replicas import PROCESS_LOCAL_CACHES
+
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+# Users of authenticated requests are kept in a short-lived cache, so most
+# requests run no query to authenticate. Saving a user (through the API, the
+# admin or anywhere else) and soft deleting one evicts it at once from the
+# cache, which with a process-local cache means only in the process that did
+# it; other processes catch up when the entry expires.
+CACHE_ALIAS = getattr(settings, 'AUTH_CACHE_ALIAS', 'default')
+# Hand views a user that is only loaded once they use more than its id. Such
+# users are never checked against the database, so deactivated and deleted
+# users are also put on a revocation list in the cache, for as long as their
+# access tokens may live, and rejected while on it.
+LAZY_USERS = getattr(settings, 'AUTH_LAZY_USERS', False)
+REVOKE_TIMEOUT = api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()
+
+
+def check_cache(lazy_users):
+    if lazy_users and settings.CACHES[CACHE_ALIAS]['BACKEND'] in PROCESS_LOCAL_CACHES:
+        logger.warning(
+            'Users are revoked in the process-local cache %r; with several worker processes set '
+            'AUTH_CACHE_ALIAS to a shared cache, or lazy users deactivated in one keep access in the others.',
+            CACHE_ALIAS,
+        )
+
+
+check_cache(LAZY_USERS)
+
+
+def _key(user_id):
+    return f'spyne:auth:user:{user_id}'
+
+
+def _revoked_key(user_id):
+    return f'spyne:auth:revoked:{user_id}'
+
+
+def forget_user(user_id, revoke=False):
+    # Evicts the cached user after commit; `revoke` also rejects its tokens
+    # until they expire, and is lifted by the next save of an active user.
+    def forget():
+        cache = caches[CACHE_ALIAS]
+        cache.delete(_key(user_id))
+        if revoke:
+            cache.set(_revoked_key(user_id), True, REVOKE_TIMEOUT)
+        else:
+            cache.delete(_revoked_key(user_id))
+
+    transaction.on_commit(forget)
+
+
+@receiver(post_save, sender=User)
+def forget_saved_user(sender, instance, created, **kwargs):
+    if not created:
+        forget_user(instance.pk, revoke=not instance.is_active or instance.deleted_on is not None)
+
+
+class LazyUser(SimpleLazyObject):
+    # The user of a token, read from the cache or the database on first use of
+    # anything but its id.
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id, func):
+        super().__init__(func)
+        self.__dict__['id'] = self.__dict__['pk'] = user_id
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if not LAZY_USERS:
+            return self.get_cached_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        if caches[CACHE_ALIAS].get(_revoked_key(user_id)):
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return LazyUser(user_id, lambda: self.get_cached_user(validated_token))
+
+    def get_cached_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+        cache = caches[CACHE_ALIAS]
+        user = cache.get(_key(user_id))
+        if user is None:
+            # Raises for unknown and inactive users, which are never cached.
+            user = super().get_user(validated_token)
+            cache.set(_key(user_id), user)
+        elif api_settings.CHECK_REVOKE_TOKEN and (
+            validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)
+        ):
+            raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
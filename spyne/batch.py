@@ -0,0 +1,108 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .counters import adjust_counter, adjust_counters
+from .feed import backfill_many
+from .models import User, Follow, Discussion
+from . import follow_graph, suggestions
+from .response_cache import invalidate
+
+MAX_ITEMS = getattr(settings, 'BATCH_MAX_ITEMS', 100)
+
+
+def parse_ids(values):
+    # Accepts a JSON list or a comma separated string of ids.
+    if isinstance(values, str):
+        values = [value for value in values.split(',') if value.strip()]
+    if not isinstance(values, (list, tuple)) or not values:
+        raise ValueError('A non-empty list of ids is required')
+    if len(values) > MAX_ITEMS:
+        raise ValueError(f'At most {MAX_ITEMS} ids are allowed per request')
+    try:
+        return [int(value) for value in values]
+    except (TypeError, ValueError):
+        raise ValueError('Ids must be integers')
+
+
+def _results(ids, key, found, existing):
+    results = []
+    seen = set()
+    for pk in ids:
+        if pk not in found:
+            result = 'not_found'
+        elif pk in existing or pk in seen:
+            result = 'exists'
+        else:
+            result = 'created'
+        seen.add(pk)
+        results.append({key: pk, 'status': result})
+    return results
+
+
+def discussion_ids(target_model, ids):
+    # The discussions whose cached responses embed the given likeable rows.
+    if not ids or target_model is Discussion:
+        return ids
+    return set(target_model.objects.filter(id__in=ids).values_list('discussion_id', flat=True))
+
+
+def _existing(model, field, **filters):
+    return set(model.objects.filter(**filters).values_list(field, flat=True))
+
+
+def _insert(model, rows):
+    # Inserts rows and returns the ones that were inserted: all of them in one
+    # statement, unless a concurrent request inserted some of the same pairs
+    # (or deleted a target) since they were checked. Then they are inserted one
+    # at a time and the ones that fail are skipped, so counters are only ever
+    # incremented for rows this request created.
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(rows)
+        return rows
+    except IntegrityError:
+        pass
+    inserted = []
+    for row in rows:
+        try:
+            with transaction.atomic():
+                row.save(force_insert=True)
+        except IntegrityError:
+            continue
+        inserted.append(row)
+    return inserted
+
+
+def like_many(user, ids, like_model, target_model, target_field):
+    # Likes every target in one transaction, skipping ones that don't exist or
+    # are already liked, and reports a status per requested id.
+    fk = f'{target_field}_id'
+    found = set(target_model.objects.filter(id__in=ids).values_list('id', flat=True))
+    with transaction.atomic():
+        existing = _existing(like_model, fk, user=user, **{f'{fk}__in': found})
+        new = [pk for pk in dict.fromkeys(ids) if pk in found and pk not in existing]
+        inserted = _insert(like_model, [like_model(user=user, **{fk: pk}) for pk in new])
+        created = [getattr(like, fk) for like in inserted]
+        existing.update(set(new) - set(created))
+        adjust_counters(target_model, 'like_count', dict.fromkeys(created, 1))
+        invalidate(*[f'discussion:{pk}' for pk in discussion_ids(target_model, created)])
+    return _results(ids, target_field, found, existing)
+
+
+def follow_many(user, ids):
+    found = User.objects.in_bulk(ids)
+    with transaction.atomic():
+        existing = _existing(Follow, 'following_id', follower=user, following_id__in=found)
+        new = [pk for pk in dict.fromkeys(ids) if pk in found and pk not in existing]
+        created = [
+            follow.following_id for follow in _insert(Follow, [Follow(follower=user, following_id=pk) for pk in new])
+        ]
+        existing.update(set(new) - set(created))
+        adjust_counters(User, 'follower_count', dict.fromkeys(created, 1))
+        if created:
+            adjust_counter(User, user.id, 'following_count', len(created))
+            suggestions.mark_stale([user.id])
+            backfill_many(user, [found[pk] for pk in created])
+            follow_graph.invalidate(user.id, *created)
+        invalidate(f'following:{user.id}', *[f'followers:{pk}' for pk in created])
+    return _results(ids, 'following_id', found, existing)
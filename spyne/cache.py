@@ -0,0 +1,122 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Django makes a cache instance per thread (and per async context); like
+# LocMemCache's, the entries live here so every instance of a name shares them.
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class _Store:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+
+class LRUCache(BaseCache):
+    # Process-local cache that evicts the least recently used entries once either
+    # MAX_ENTRIES or MAX_BYTES (of pickled values) is exceeded. Unlike LocMemCache,
+    # which culls a fraction of its keys at random, a single large response only
+    # pushes out as many cold entries as needed to make room for it.
+    #
+    #   CACHES = {'responses': {
+    #       'BACKEND': 'spyne.cache.LRUCache',
+    #       'TIMEOUT': 60,
+    #       'OPTIONS': {'MAX_ENTRIES': 10000, 'MAX_BYTES': 64 * 1024 * 1024},
+    #   }}
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._max_bytes = int(options.get('MAX_BYTES', 64 * 1024 * 1024))
+        with _stores_lock:
+            self._shared = _stores.setdefault(name, _Store())
+        self._entries = self._shared.entries
+        self._lock = self._shared.lock
+
+    def _expired(self, key, now):
+        expiry = self._entries[key][1]
+        return expiry is not None and expiry <= now
+
+    def _remove(self, key):
+        value, expiry = self._entries.pop(key)
+        self._shared.bytes -= len(value)
+
+    def _store(self, key, value, timeout):
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        if len(pickled) > self._max_bytes:
+            return False
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (pickled, self.get_backend_timeout(timeout))
+        self._shared.bytes += len(pickled)
+        while len(self._entries) > self._max_entries or self._shared.bytes > self._max_bytes:
+            self._remove(next(iter(self._entries)))
+        return True
+
+    def _live(self, key):
+        if key not in self._entries:
+            return False
+        if self._expired(key, time.time()):
+            self._remove(key)
+            return False
+        return True
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            if self._live(key):
+                return False
+            return self._store(key, value, timeout)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            if not self._live(key):
+                return default
+            self._entries.move_to_end(key)
+            pickled = self._entries[key][0]
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._store(key, value, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        with self._lock:
+            if not self._live(key):
+                return False
+            self._entries[key] = (self._entries[key][0], self.get_backend_timeout(timeout))
+            return True
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            return self._live(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._shared.bytes = 0
@@ -0,0 +1,25 @@
+from collections import defaultdict
+
+from django.db.models import F
+
+
+def adjust_counter(model, pk, field, delta):
+    # Single UPDATE ... SET field = field + delta, so concurrent writers never
+    # lose increments. Must run inside the transaction that wrote the child row.
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def adjust_counters(model, field, deltas):
+    # Applies {pk: delta} with one UPDATE per distinct delta rather than per row.
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        queryset = model.objects.filter(pk__in=pks)
+        if delta < 0:
+            queryset = queryset.filter(**{f'{field}__gte': -delta})
+        queryset.update(**{field: F(field) + delta})
@@ -0,0 +1,78 @@
+import json
+import zlib
+from datetime import datetime, time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Discussion, Comment, Reply, Like, Follow
+
+CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+# kind: (queryset, creation time field, exported columns)
+EXPORTS = {
+    'discussions': (Discussion.objects.all(), 'created_on',
+                    ['id', 'user_id', 'text', 'image', 'hashtags', 'created_on', 'views', 'like_count', 'comment_count']),
+    'comments': (Comment.objects.all(), 'created_on',
+                 ['id', 'user_id', 'discussion_id', 'text', 'created_on', 'like_count', 'reply_count']),
+    'replies': (Reply.objects.all(), 'created_on', ['id', 'user_id', 'comment_id', 'text', 'created_on']),
+    'likes': (Like.objects.all(), 'created_on', ['id', 'user_id', 'discussion_id', 'created_on']),
+    'follows': (Follow.objects.all(), 'created_at', ['id', 'follower_id', 'following_id', 'created_at']),
+}
+
+
+def parse_time(value):
+    # Accepts an ISO 8601 datetime or date; naive values are in the current
+    # time zone. Raises ValueError for anything else.
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date or datetime: {value}')
+        parsed = datetime.combine(day, time())
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def rows(kind, since=None, until=None, after=None, chunk_size=CHUNK_SIZE, using=None):
+    # Yields the rows of `kind` created in [since, until) with an id above
+    # `after`, in id order. Each chunk is its own short keyset query, so no
+    # cursor or transaction stays open while a slow client reads, and the
+    # export resumes from any id it reached.
+    queryset, time_field, columns = EXPORTS[kind]
+    queryset = queryset.using(using)
+    if since is not None:
+        queryset = queryset.filter(**{f'{time_field}__gte': since})
+    if until is not None:
+        queryset = queryset.filter(**{f'{time_field}__lt': until})
+    last = after or 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last).order_by('pk').values(*columns)[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]['id']
+
+
+def ndjson(rows, chunk_size=CHUNK_SIZE):
+    # Encodes rows one JSON object per line, in blocks of chunk_size lines.
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False))
+        if len(lines) >= chunk_size:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def gzipped(blocks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
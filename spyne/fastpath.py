@@ -0,0 +1,142 @@
+from collections import defaultdict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from rest_framework import serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+
+# Read-only list responses are rendered straight from .values() rows instead of
+# building a serializer per instance. compile() turns a serializer's readable
+# fields into one extractor per field, reusing each field's own
+# to_representation, so the output is identical to serializer.data. Serializers
+# with fields that can't be read from a row (method fields, attributes set in
+# Python, dotted sources, ...) compile to None and go through DRF as before.
+
+# Fields whose to_representation is a plain conversion.
+CONVERTERS = {
+    serializers.IntegerField: int,
+    serializers.CharField: str,
+    serializers.EmailField: str,
+}
+
+
+class Plan:
+    def __init__(self, model, columns, fields, many):
+        self.model = model
+        self.columns = columns
+        # (key, column, convert, nested plan) for fields read from the row,
+        # nested serializers over a foreign key reading the joined columns.
+        self.fields = fields
+        # (key, foreign key name, foreign key column, plan) for nested lists of
+        # related rows, loaded with one query per page.
+        self.many = many
+
+    def values(self, queryset, *extra):
+        return queryset.values(*dict.fromkeys([*self.columns, *extra]))
+
+    def render_row(self, row):
+        data = {}
+        for key, column, convert, nested in self.fields:
+            value = row[column]
+            if value is None:
+                data[key] = None
+            elif nested is not None:
+                data[key] = nested.render_row(row)
+            else:
+                data[key] = convert(value)
+        return data
+
+    def render(self, rows):
+        rows = list(rows)
+        pks = [row['pk'] for row in rows] if self.many else []
+        return self.attach(rows, [self.related(many, pks) for many in self.many])
+
+    def related(self, many, pks):
+        # {pk: [data]} for one of the nested lists in self.many, in one query.
+        key, fk, fk_column, plan = many
+        related = defaultdict(list)
+        if pks:
+            children = list(plan.values(plan.model._default_manager.filter(**{f'{fk}__in': pks}), fk_column))
+            for child, rendered in zip(children, plan.render(children)):
+                related[child[fk_column]].append(rendered)
+        return related
+
+    def attach(self, rows, related):
+        # Renders rows given the related() results for each of self.many.
+        data = [self.render_row(row) for row in rows]
+        for (key, fk, fk_column, plan), children in zip(self.many, related):
+            for row, item in zip(rows, data):
+                item[key] = children[row['pk']]
+        return data
+
+    def fetch(self, queryset, pks):
+        # {pk: data} for the rows of queryset among pks, in the order of pks.
+        pks = list(dict.fromkeys(pks))
+        rows = {row['pk']: row for row in self.values(queryset.filter(pk__in=pks), 'pk')}
+        found = [pk for pk in pks if pk in rows]
+        return dict(zip(found, self.render([rows[pk] for pk in found])))
+
+
+def _later(pk):
+    # Keeps a nested list's place in the output until Plan.render fills it in.
+    return None
+
+
+def _file_converter(field, model_field):
+    def convert(name):
+        return field.to_representation(model_field.attr_class(None, model_field, name))
+    return convert
+
+
+def compile(serializer, prefix=''):
+    model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+    if model is None:
+        return None
+    columns, fields, many = [], [], []
+    for key, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if len(field.source_attrs) != 1:
+            return None
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return None
+
+        if isinstance(field, serializers.ListSerializer):
+            if prefix or not model_field.one_to_many:
+                return None
+            plan = compile(field.child)
+            if plan is None:
+                return None
+            many.append((key, model_field.field.name, model_field.field.attname, plan))
+            fields.append((key, 'pk', _later, None))
+            columns.append('pk')
+        elif model_field.is_relation:
+            if not model_field.concrete or model_field.many_to_many:
+                return None
+            column = prefix + field.source
+            if isinstance(field, serializers.Serializer):
+                plan = compile(field, prefix=column + '__')
+                if plan is None or plan.many:
+                    return None
+                fields.append((key, column, None, plan))
+                columns += [column, *plan.columns]
+            elif isinstance(field, PrimaryKeyRelatedField):
+                convert = field.pk_field.to_representation if field.pk_field is not None else (lambda value: value)
+                fields.append((key, column, convert, None))
+                columns.append(column)
+            else:
+                return None
+        elif isinstance(field, (serializers.Serializer, serializers.SerializerMethodField, serializers.HiddenField)):
+            return None
+        else:
+            if isinstance(model_field, models.FileField):
+                convert = _file_converter(field, model_field)
+            else:
+                convert = CONVERTERS.get(type(field), field.to_representation)
+            column = prefix + field.source
+            fields.append((key, column, convert, None))
+            columns.append(column)
+
+    return Plan(model, list(dict.fromkeys(columns)), fields, many)
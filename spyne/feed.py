@@ -0,0 +1,191 @@
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, connections, router, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import User, Discussion, FanOutJob, Follow, TimelineEntry
+
+logger = logging.getLogger(__name__)
+
+# Authors with more followers than this are not fanned out on write; their
+# followers pull their discussions at read time instead.
+FANOUT_LIMIT = getattr(settings, 'FEED_FANOUT_LIMIT', 10000)
+
+# How many of an author's latest discussions are copied into a new follower's
+# timeline.
+BACKFILL_SIZE = getattr(settings, 'FEED_BACKFILL_SIZE', 100)
+
+BATCH_SIZE = 1000
+
+# Fan-outs run after commit on a background thread of the process that created
+# the discussion; without it, `manage.py fan_out` does them all.
+IN_PROCESS = getattr(settings, 'FEED_FANOUT_IN_PROCESS', True)
+
+
+def is_pulled(author):
+    return author.follower_count > FANOUT_LIMIT
+
+
+def _insert(user_ids, discussion):
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, discussion_id=discussion.id,
+                          author_id=discussion.user_id, created_on=discussion.created_on)
+            for user_id in user_ids
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def fan_out(discussion):
+    # Called in the transaction that creates discussion. Its author sees it at
+    # once; copying it into the followers' timelines (up to FANOUT_LIMIT rows)
+    # is recorded as a FanOutJob and done after commit, BATCH_SIZE followers
+    # per transaction, so the request neither waits on nor holds locks for it.
+    _insert([discussion.user_id], discussion)
+    # Read afresh: the request's user may come from the authentication cache.
+    followers = User.objects.filter(pk=discussion.user_id).values_list('follower_count', flat=True).first()
+    if not followers or followers > FANOUT_LIMIT:
+        return
+    FanOutJob.objects.create(discussion=discussion)
+    if IN_PROCESS:
+        transaction.on_commit(lambda: fan_out_worker.add(discussion.pk))
+
+
+def run_chunk(discussion_id, chunk_size=BATCH_SIZE):
+    # Copies a discussion into the timelines of its author's next chunk of
+    # followers and records the progress in the same transaction, so a job
+    # interrupted at any point resumes where it stopped. Returns False once the
+    # job has finished; jobs of discussions deleted since are dropped.
+    with transaction.atomic():
+        job = FanOutJob.objects.select_for_update().filter(pk=discussion_id).first()
+        if job is None:
+            return False
+        discussion = Discussion.objects.filter(pk=discussion_id).first()
+        rows = []
+        if discussion is not None:
+            rows = list(
+                Follow.objects.filter(following_id=discussion.user_id, pk__gt=job.last_follow_id)
+                .order_by('pk').values_list('pk', 'follower_id')[:chunk_size]
+            )
+        if not rows:
+            job.delete()
+            return False
+        _insert([follower_id for pk, follower_id in rows], discussion)
+        job.last_follow_id = rows[-1][0]
+        job.save(update_fields=['last_follow_id'])
+        return True
+
+
+def run_job(discussion_id, chunk_size=BATCH_SIZE):
+    try:
+        while run_chunk(discussion_id, chunk_size):
+            pass
+    except Exception:
+        logger.exception('Fan-out of discussion %s failed', discussion_id)
+        return False
+    return True
+
+
+class FanOutWorker:
+    # Runs queued fan-outs one at a time on a daemon thread. Fan-outs left
+    # unfinished when the process exits are resumed by `manage.py fan_out`.
+
+    def __init__(self, chunk_size=BATCH_SIZE):
+        self.chunk_size = chunk_size
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, discussion_id):
+        self.jobs.put(discussion_id)
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='feed-fan-out', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            discussion_id = self.jobs.get()
+            close_old_connections()
+            run_job(discussion_id, self.chunk_size)
+
+
+fan_out_worker = FanOutWorker()
+
+
+def backfill(user, author):
+    if is_pulled(author):
+        return
+    discussions = Discussion.objects.filter(user=author).order_by('-created_on', '-id')[:BACKFILL_SIZE]
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user=user, discussion_id=discussion_id, author=author, created_on=created_on)
+            for discussion_id, created_on in discussions.values_list('id', 'created_on')
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _latest(author_ids):
+    # The latest BACKFILL_SIZE discussions of each author, ranked per author with
+    # a window function in one query, or, on servers without them, a UNION ALL of
+    # each author's where the backend can slice its parts, else a query each
+    # (see threads.attach_first_replies).
+    features = connections[router.db_for_read(Discussion)].features
+    if features.supports_over_clause:
+        ranked = Discussion.objects.filter(user_id__in=author_ids).only('id', 'user_id', 'created_on').annotate(
+            discussion_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('user_id')],
+                order_by=[F('created_on').desc(), F('id').desc()],
+            )
+        )
+        sql, params = ranked.query.sql_with_params()
+        return Discussion.objects.raw(
+            f'SELECT * FROM ({sql}) ranked_discussions WHERE discussion_rank <= %s', (*params, BACKFILL_SIZE)
+        )
+    latest = [
+        Discussion.objects.filter(user_id=author_id).only('id', 'user_id', 'created_on')
+        .order_by('-created_on', '-id')[:BACKFILL_SIZE]
+        for author_id in author_ids
+    ]
+    if features.supports_slicing_ordering_in_compound and len(latest) > 1:
+        latest = [latest[0].union(*latest[1:], all=True)]
+    return [discussion for queryset in latest for discussion in queryset]
+
+
+def backfill_many(user, authors):
+    # backfill() for several newly followed authors at once.
+    author_ids = [author.id for author in authors if not is_pulled(author)]
+    if not author_ids:
+        return
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user=user, discussion_id=discussion.id, author_id=discussion.user_id,
+                          created_on=discussion.created_on)
+            for discussion in _latest(author_ids)
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def prune(user, author):
+    TimelineEntry.objects.filter(user=user, author=author).delete()
+
+
+def timeline_querysets(user):
+    querysets = [TimelineEntry.objects.filter(user=user).values('created_on', 'discussion_id')]
+    pulled = list(
+        Follow.objects.filter(follower=user, following__follower_count__gt=FANOUT_LIMIT)
+        .values_list('following_id', flat=True)
+    )
+    if pulled:
+        querysets.append(
+            Discussion.objects.filter(user_id__in=pulled).values('created_on', discussion_id=F('id'))
+        )
+    return querysets
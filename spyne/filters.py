@@ -1,21 +1,26 @@
-from django.db.models import Q
+from django.db.models import Count
 from rest_framework.filters import BaseFilterBackend
 
+from .hashtags import parse_hashtags, get_hashtag_ids
+from .models import DiscussionHashtag
+
 
 class HashtagAndTextFilter(BaseFilterBackend):
+    # Free-text matching and ranking is done by the search index, see
+    # DiscussionListView.list.
     def filter_queryset(self, request, queryset, view):
         hashtags = request.query_params.get('hashtags', None)
-        text = request.query_params.get('text', None)
+        match = request.query_params.get('match', 'any')
 
         if hashtags:
-            hashtags_list = hashtags.split(',')
-            hashtag_query = Q()
-            for hashtag in hashtags_list:
-                hashtag_query |= Q(hashtags__regex=rf'\b{hashtag}\b')
-            queryset = queryset.filter(hashtag_query).distinct()
+            names = parse_hashtags(hashtags)
+            hashtag_ids = list(get_hashtag_ids(names).values())
+            if not hashtag_ids or (match == 'all' and len(hashtag_ids) < len(names)):
+                return queryset.none()
 
-        if text:
-            text_query = Q(text__icontains=text)
-            queryset = queryset.filter(text_query).distinct()
+            links = DiscussionHashtag.objects.filter(hashtag_id__in=hashtag_ids)
+            if match == 'all':
+                links = links.values('discussion_id').annotate(n=Count('hashtag_id')).filter(n=len(hashtag_ids))
+            queryset = queryset.filter(id__in=links.values('discussion_id'))
 
-        return queryset
\ No newline at end of file
+        return queryset
@@ -0,0 +1,83 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from backend.replicas import PROCESS_LOCAL_CACHES
+
+from .models import User, Follow
+
+logger = logging.getLogger(__name__)
+
+# Adjacency sets and counts are cached for this many seconds in the
+# FOLLOW_CACHE_ALIAS cache, and dropped as soon as a follow touching the user is
+# created or removed. That cache must be shared by all worker processes, or the
+# others keep serving what they cached before the change until it expires.
+CACHE_ALIAS = getattr(settings, 'FOLLOW_CACHE_ALIAS', 'default')
+TIMEOUT = getattr(settings, 'FOLLOW_CACHE_TIMEOUT', 300)
+
+
+def check_cache(alias):
+    if settings.CACHES[alias]['BACKEND'] in PROCESS_LOCAL_CACHES:
+        logger.warning(
+            'The follow graph is cached in the process-local cache %r; with several worker processes set '
+            'FOLLOW_CACHE_ALIAS to a shared cache, or follows only take effect in the process that made them.',
+            alias,
+        )
+
+
+check_cache(CACHE_ALIAS)
+
+
+def _key(kind, user_id):
+    return f'spyne:follow:{kind}:{user_id}'
+
+
+def _cached(kind, user_id, load):
+    cache = caches[CACHE_ALIAS]
+    key = _key(kind, user_id)
+    value = cache.get(key)
+    if value is None:
+        value = load()
+        cache.set(key, value, TIMEOUT)
+    return value
+
+
+def following_ids(user_id):
+    return _cached('following', user_id, lambda: frozenset(
+        Follow.objects.filter(follower_id=user_id).values_list('following_id', flat=True)
+    ))
+
+
+def mutual_ids(user_id):
+    return _cached('mutuals', user_id, lambda: sorted(
+        Follow.objects.filter(
+            following_id=user_id,
+            follower_id__in=Follow.objects.filter(follower_id=user_id).values('following_id'),
+        ).values_list('follower_id', flat=True)
+    ))
+
+
+def _load_counts(user_id):
+    counts = User.objects.filter(id=user_id).values('follower_count', 'following_count').first()
+    if counts is None:
+        return None
+    return {'followers': counts['follower_count'], 'following': counts['following_count']}
+
+
+def follow_counts(user_id):
+    # Returns {'followers': n, 'following': n}, or None for an unknown user.
+    return _cached('counts', user_id, lambda: _load_counts(user_id))
+
+
+def is_following(user_id, other_id):
+    return other_id in following_ids(user_id)
+
+
+def invalidate(follower_id, *following_ids):
+    keys = [_key('following', follower_id), _key('mutuals', follower_id), _key('counts', follower_id)]
+    for following_id in following_ids:
+        keys += [_key('mutuals', following_id), _key('counts', following_id)]
+    # After commit, so a concurrent read can't re-cache the pre-write state.
+    transaction.on_commit(lambda: caches[CACHE_ALIAS].delete_many(keys))
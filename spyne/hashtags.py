@@ -0,0 +1,30 @@
+import re
+
+from .models import Hashtag, DiscussionHashtag
+
+HASHTAG_RE = re.compile(r'\w+')
+MAX_HASHTAG_LENGTH = Hashtag._meta.get_field('name').max_length
+
+
+def parse_hashtags(text):
+    # Same word-boundary semantics the old regex filter had, minus case.
+    names = []
+    for name in HASHTAG_RE.findall((text or '').lower()):
+        if len(name) <= MAX_HASHTAG_LENGTH and name not in names:
+            names.append(name)
+    return names
+
+
+def get_hashtag_ids(names, create=False):
+    if create:
+        Hashtag.objects.bulk_create([Hashtag(name=name) for name in names], ignore_conflicts=True)
+    return dict(Hashtag.objects.filter(name__in=names).values_list('name', 'id'))
+
+
+def set_discussion_hashtags(discussion):
+    hashtag_ids = list(get_hashtag_ids(parse_hashtags(discussion.hashtags), create=True).values())
+    DiscussionHashtag.objects.filter(discussion=discussion).exclude(hashtag_id__in=hashtag_ids).delete()
+    DiscussionHashtag.objects.bulk_create(
+        [DiscussionHashtag(discussion=discussion, hashtag_id=hashtag_id) for hashtag_id in hashtag_ids],
+        ignore_conflicts=True,
+    )
@@ -0,0 +1,226 @@
+import atexit
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing import Pool
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, close_old_connections, connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import Discussion, StoredImage
+from .response_cache import invalidate
+
+logger = logging.getLogger(__name__)
+
+# variant: longest edge in pixels. Images are only ever scaled down.
+VARIANTS = getattr(settings, 'IMAGE_VARIANTS', {'thumbnail': 160, 'medium': 800})
+PROCESSES = getattr(settings, 'IMAGE_PROCESSES', 2)
+IN_PROCESS = getattr(settings, 'IMAGE_PROCESS_IN_PROCESS', True)
+JPEG_QUALITY = 85
+
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp', 'BMP': '.bmp'}
+
+
+def _extension(upload):
+    # ImageField validation leaves the opened image on the upload.
+    image = getattr(upload, 'image', None)
+    return EXTENSIONS.get(getattr(image, 'format', None)) or os.path.splitext(upload.name)[1].lower()
+
+
+def file_hash(file):
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def store(upload):
+    # Saves an upload under the hash of its content and returns its
+    # StoredImage, or the existing one if the same image was uploaded before.
+    # Uploads are streamed to a temporary file (see FILE_UPLOAD_HANDLERS) and
+    # only ever read in chunks; on local storage the file is moved, not copied.
+    digest = file_hash(upload)
+    stored = StoredImage.objects.filter(sha256=digest).first()
+    if stored is not None:
+        return stored
+    name = f'images/{digest[:2]}/{digest}{_extension(upload)}'
+    # The file may outlive a rolled back transaction; the name says it's the same image.
+    if not default_storage.exists(name):
+        name = default_storage.save(name, upload)
+    try:
+        with transaction.atomic():
+            return StoredImage.objects.create(sha256=digest, name=name, variants=json.dumps({'original': name}))
+    except IntegrityError:
+        # An identical upload was stored concurrently; keep its copy.
+        stored = StoredImage.objects.get(sha256=digest)
+        if stored.name != name:
+            default_storage.delete(name)
+        return stored
+
+
+def render(name, variants=VARIANTS):
+    # Runs in a worker process. Returns {variant: (extension, data)}, each
+    # variant scaled down from the next larger one. Images with transparency
+    # stay PNG; everything else becomes JPEG.
+    with default_storage.open(name) as file:
+        image = Image.open(file)
+        largest = max(variants.values())
+        # Lets JPEGs decode straight at a fraction of their size.
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if alpha else 'RGB')
+
+    rendered = {}
+    for variant, size in sorted(variants.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if alpha:
+            image.save(buffer, 'PNG', optimize=True)
+            rendered[variant] = ('.png', buffer.getvalue())
+        else:
+            image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            rendered[variant] = ('.jpg', buffer.getvalue())
+    return rendered
+
+
+def _render_job(job):
+    image_id, name = job
+    try:
+        return image_id, render(name), ''
+    except Exception as e:
+        return image_id, None, f'{type(e).__name__}: {e}'
+
+
+def link(stored):
+    # Points every discussion showing the image at its variants.
+    with transaction.atomic():
+        ids = list(
+            Discussion.all_objects.filter(image=stored.name).exclude(image_variants=stored.variants)
+            .values_list('id', flat=True)
+        )
+        if ids:
+            Discussion.all_objects.filter(pk__in=ids).update(image_variants=stored.variants)
+            invalidate('discussions', *(f'discussion:{pk}' for pk in ids))
+    return len(ids)
+
+
+def finish(image_id, rendered, error):
+    # Saves rendered variants from the parent process, which owns the storage
+    # and database connections. Returns True if the image was processed.
+    stored = StoredImage.objects.get(pk=image_id)
+    if error:
+        logger.error('Processing image %s (%s) failed: %s', image_id, stored.name, error)
+        StoredImage.objects.filter(pk=image_id).update(error=error)
+        return False
+    variants = {'original': stored.name}
+    for variant, (extension, data) in rendered.items():
+        name = f'images/variants/{stored.sha256[:2]}/{stored.sha256}_{variant}{extension}'
+        # Reprocessing replaces the previous rendering.
+        default_storage.delete(name)
+        variants[variant] = default_storage.save(name, ContentFile(data))
+    stored.variants = json.dumps(variants)
+    stored.processed_on = timezone.now()
+    stored.error = ''
+    stored.save(update_fields=['variants', 'processed_on', 'error'])
+    link(stored)
+    return True
+
+
+def process(images, processes=PROCESSES):
+    # Renders the variants of [(image id, name)] across worker processes.
+    # Yields (image id, processed) as each image finishes.
+    images = list(images)
+    if processes == 1 or len(images) <= 1:
+        for result in map(_render_job, images):
+            yield result[0], finish(*result)
+        return
+    # Workers only read files; close the connections so no child inherits them.
+    connections.close_all()
+    with Pool(min(processes, len(images))) as pool:
+        for result in pool.imap_unordered(_render_job, images):
+            yield result[0], finish(*result)
+
+
+def backfill(chunk_size=500):
+    # Registers images uploaded before the pipeline: each discussion with an
+    # image but no variants is pointed at the StoredImage of its content, to be
+    # processed like a new upload. Returns the number of discussions updated.
+    updated = 0
+    last = 0
+    while True:
+        rows = list(
+            Discussion.all_objects.filter(pk__gt=last, image_variants='').exclude(image='').exclude(image=None)
+            .order_by('pk').values_list('pk', 'image')[:chunk_size]
+        )
+        if not rows:
+            return updated
+        for pk, name in rows:
+            try:
+                with default_storage.open(name) as file:
+                    digest = file_hash(file)
+            except OSError as e:
+                logger.warning('Skipping the image of discussion %s: %s', pk, e)
+                continue
+            stored, created = StoredImage.objects.get_or_create(
+                sha256=digest, defaults={'name': name, 'variants': json.dumps({'original': name})},
+            )
+            updated += Discussion.all_objects.filter(pk=pk).update(image=stored.name, image_variants=stored.variants)
+        invalidate('discussions', *(f'discussion:{pk}' for pk, name in rows))
+        last = rows[-1][0]
+
+
+class Processor:
+    # Renders new uploads in a pool of PROCESSES worker processes, started on
+    # first use, so no request waits on Pillow. Images left unprocessed when the
+    # process exits are picked up by `manage.py process_images`. The workers
+    # are spawned rather than forked: a fork of this multithreaded process
+    # would copy whatever locks other threads held at the time, and could hang.
+
+    def __init__(self, processes=PROCESSES):
+        self.processes = processes
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def add(self, stored):
+        with self.lock:
+            if self.pool is None:
+                # Workers only read files; close the connections so no child inherits them.
+                connections.close_all()
+                self.pool = multiprocessing.get_context('spawn').Pool(self.processes, initializer=django.setup)
+                atexit.register(self.pool.terminate)
+        self.pool.apply_async(_render_job, ((stored.pk, stored.name),), callback=self.done)
+
+    def done(self, result):
+        # Runs on the pool's result thread, which must not die.
+        close_old_connections()
+        try:
+            finish(*result)
+        except Exception:
+            logger.exception('Saving the variants of image %s failed', result[0])
+
+
+processor = Processor()
+
+
+def process_on_commit(stored):
+    # Queues an image for processing once the discussion showing it commits.
+    # An identical upload may have been processed since `stored` was read, in
+    # which case the new discussion only needs linking.
+    def start():
+        current = StoredImage.objects.get(pk=stored.pk)
+        if current.processed_on is not None:
+            link(current)
+        else:
+            processor.add(current)
+    if IN_PROCESS:
+        transaction.on_commit(start)
@@ -0,0 +1,112 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from .models import User
+
+# Verifying a password (PBKDF2) keeps a CPU busy for tens of milliseconds but
+# releases the GIL, so logins hash on a pool of HASHING_THREADS threads rather
+# than on every request thread at once. At most MAX_PENDING logins use or wait
+# for the pool; beyond that a login is turned away at once with 503 and
+# Retry-After instead of queueing until every worker is stuck hashing.
+HASHING_THREADS = getattr(settings, 'LOGIN_HASHING_THREADS', None) or os.cpu_count() or 1
+MAX_PENDING = getattr(settings, 'LOGIN_MAX_PENDING', None) or 4 * HASHING_THREADS
+RETRY_AFTER = 1
+
+PRUNE_CHUNK_SIZE = getattr(settings, 'TOKEN_PRUNE_CHUNK_SIZE', 1000)
+
+
+class LoginOverloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins in progress, try again shortly.'
+    default_code = 'login_overloaded'
+
+    def __init__(self):
+        super().__init__()
+        # Sent as Retry-After by DRF's exception handler.
+        self.wait = RETRY_AFTER
+
+
+class HashingPool:
+    def __init__(self, threads=HASHING_THREADS, max_pending=MAX_PENDING):
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='login-hashing')
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    @contextmanager
+    def admit(self):
+        # Holds one of the MAX_PENDING slots, or rejects the login before it
+        # does any work.
+        if not self.slots.acquire(blocking=False):
+            raise LoginOverloaded()
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    def run(self, func, *args):
+        return self.executor.submit(func, *args).result()
+
+
+hashing_pool = HashingPool()
+
+
+def _check(password, encoded):
+    # Runs on the pool. Returns whether the password matches, and its new
+    # encoding if the hasher's settings changed since it was stored.
+    upgraded = []
+    valid = check_password(password, encoded, setter=upgraded.append)
+    return valid, make_password(password) if valid and upgraded else None
+
+
+def authenticate(email, password):
+    # What django.contrib.auth.authenticate() does with the ModelBackend (the
+    # only backend configured), with the hashing done on the pool. Returns the
+    # user or None.
+    with hashing_pool.admit():
+        try:
+            user = User._default_manager.get_by_natural_key(email)
+        except User.DoesNotExist:
+            # Hash anyway, so unknown emails take as long as wrong passwords.
+            hashing_pool.run(make_password, password)
+            return None
+        valid, upgraded = hashing_pool.run(_check, password, user.password)
+    if upgraded:
+        user.password = upgraded
+        user.save(update_fields=['password'])
+    return user if valid and user.is_active else None
+
+
+def prune_tokens(chunk_size=PRUNE_CHUNK_SIZE, full=False):
+    # Deletes expired outstanding refresh tokens and their blacklist entries,
+    # walking the table a chunk at a time in id order (expires_at has no
+    # index). Tokens are issued in id order with a fixed lifetime, so the scan
+    # stops at the first chunk with nothing expired; `full` scans the whole
+    # table, e.g. after REFRESH_TOKEN_LIFETIME was shortened. Returns the
+    # number of tokens deleted.
+    now = aware_utcnow()
+    deleted = 0
+    last = 0
+    while True:
+        rows = list(
+            OutstandingToken.objects.filter(pk__gt=last).order_by('pk').values_list('pk', 'expires_at')[:chunk_size]
+        )
+        if not rows:
+            return deleted
+        expired = [pk for pk, expires_at in rows if expires_at <= now]
+        if expired:
+            with transaction.atomic():
+                BlacklistedToken.objects.filter(token_id__in=expired).delete()
+                OutstandingToken.objects.filter(pk__in=expired).delete()
+            deleted += len(expired)
+        elif not full:
+            return deleted
+        last = rows[-1][0]
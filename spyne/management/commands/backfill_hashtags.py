@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from spyne.hashtags import parse_hashtags, get_hashtag_ids
+from spyne.models import Discussion, DiscussionHashtag
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the hashtag index from the Discussion.hashtags column.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        total = 0
+        while True:
+            rows = list(
+                Discussion.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', 'hashtags')[:chunk_size]
+            )
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+
+            parsed = {pk: parse_hashtags(hashtags) for pk, hashtags in rows}
+            with transaction.atomic():
+                hashtag_ids = get_hashtag_ids({name for names in parsed.values() for name in names}, create=True)
+                DiscussionHashtag.objects.filter(discussion_id__in=parsed).delete()
+                DiscussionHashtag.objects.bulk_create([
+                    DiscussionHashtag(discussion_id=pk, hashtag_id=hashtag_ids[name])
+                    for pk, names in parsed.items() for name in names
+                ])
+            total += len(rows)
+            self.stdout.write(f'Indexed hashtags for {total} discussions')
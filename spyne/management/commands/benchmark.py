@@ -0,0 +1,276 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.urls import get_resolver
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from spyne.models import User, Follow, Discussion, Comment, Like, CommentLike, Reply
+
+
+class Rollback(Exception):
+    pass
+
+
+class QueryCounter:
+    # CaptureQueriesContext can't be used around test client requests: the
+    # request_started signal resets the connection's query log mid-capture.
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure latency and query counts for every spyne endpoint against the '
+        'current database (see generate_dataset) and write the results as JSON. '
+        'Writes are rolled back after each request.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', default='benchmark.json')
+        parser.add_argument('--compare', help='Earlier results file to print changes against.')
+        parser.add_argument('--only', nargs='*', help='URL names to run.')
+        parser.add_argument('--password', default='password', help='Password of the generated users.')
+
+    def handle(self, *args, **options):
+        if not Discussion.objects.exists():
+            raise CommandError('No discussions found; run generate_dataset first.')
+
+        self.sample = self.get_sample()
+        user = self.sample['user']
+        client = APIClient(SERVER_NAME='localhost')
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        # Admin-only endpoints run as an unsaved staff copy of the same user.
+        admin_client = APIClient(SERVER_NAME='localhost')
+        admin_client.force_authenticate(User(id=user.id, email=user.email, name=user.name, is_staff=True))
+
+        cases = [(case, client) for case in self.get_cases(options['password'])]
+        cases += [(case, admin_client) for case in self.get_admin_cases()]
+        self.check_coverage([case for case, case_client in cases])
+        if options['only']:
+            cases = [(case, case_client) for case, case_client in cases if case[0] in options['only']]
+
+        results = {}
+        failed = []
+        for (name, method, path, data), case_client in cases:
+            self.client = case_client
+            label = f'{method.upper()} {name}'
+            if label in results:
+                label = f'{label} {len([key for key in results if key.startswith(label)]) + 1}'
+            result = results[label] = self.run_case(method, path, data, options['iterations'])
+            if result.get('failed'):
+                failed.append(label)
+                self.stderr.write(f"{label:34} {result['status']:>4} FAILED, not timed")
+                continue
+            self.stdout.write(
+                f"{label:34} {result['status']:>4} "
+                f"p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  "
+                f"queries {result['queries']:>4} (cold {result['cold_queries']})"
+            )
+
+        report = {'meta': self.get_meta(options['iterations']), 'results': results}
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        self.stdout.write(f"Wrote {options['output']}")
+
+        if options['compare']:
+            self.compare(options['compare'], results)
+        if failed:
+            # Their latency would be that of an error path, not of the operation.
+            raise CommandError(f"Cases without a 2xx response: {', '.join(failed)}")
+
+    def get_sample(self):
+        # The busiest rows make the most useful worst cases. Writes to a user's
+        # own rows need a user that has some.
+        user = User.objects.filter(
+            Exists(Discussion.objects.filter(user=OuterRef('pk'))),
+            Exists(Comment.objects.filter(user=OuterRef('pk'))),
+            Exists(Like.objects.filter(user=OuterRef('pk'))),
+        ).order_by('-following_count', 'id').first() or User.objects.order_by('-following_count', 'id').first()
+        popular = User.objects.order_by('-follower_count', 'id').first()
+        discussion = Discussion.objects.order_by('-comment_count', 'id').first()
+        comment = Comment.objects.filter(discussion=discussion).order_by('-reply_count', 'id').first() \
+            or Comment.objects.order_by('-reply_count', 'id').first()
+        word = discussion.text.split()[0] if discussion.text.split() else 'a'
+        return {
+            'user': user,
+            'popular': popular,
+            'discussion': discussion,
+            'comment': comment,
+            'reply': Reply.objects.filter(comment=comment).first() or Reply.objects.first(),
+            'own_discussion': Discussion.objects.filter(user=user).order_by('-comment_count', 'id').first(),
+            'own_comment': Comment.objects.filter(user=user).order_by('-reply_count', 'id').first(),
+            'like': Like.objects.filter(user=user).first(),
+            'unliked_discussion': Discussion.objects.exclude(likes__user=user).order_by('-comment_count', 'id').first(),
+            'unliked_comment': Comment.objects.exclude(likes__user=user).order_by('-reply_count', 'id').first(),
+            'comment_like': CommentLike.objects.first(),
+            'follow': Follow.objects.filter(follower=user).first(),
+            'other_user': User.objects.exclude(id=user.id).exclude(followers__follower=user).first(),
+            'word': word,
+            'hashtag': (discussion.hashtags.split(',') or [''])[0],
+            'discussion_ids': ','.join(str(pk) for pk in Discussion.objects.order_by('-id').values_list('id', flat=True)[:50]),
+            'liked_discussions': list(Discussion.objects.order_by('id').values_list('id', flat=True)[:50]),
+            'comment_ids': list(Comment.objects.order_by('id').values_list('id', flat=True)[:50]),
+            'user_ids': list(User.objects.order_by('id').values_list('id', flat=True)[:50]),
+        }
+
+    def get_cases(self, password):
+        s = self.sample
+        user, discussion, comment = s['user'], s['discussion'], s['comment']
+        reply = s['reply']
+        other = s['other_user'] or s['popular']
+        own, own_comment, like = s['own_discussion'], s['own_comment'], s['like']
+        return [
+            # (url name, method, path, data)
+            ('api-root', 'get', '/api/v1/', None),
+            ('token_obtain_pair', 'post', '/api/v1/token/', {'email': user.email, 'password': password}),
+            ('user-list', 'get', '/api/v1/users/', None),
+            ('user-list', 'post', '/api/v1/users/',
+             {'name': 'Bench', 'mobile': '1', 'email': 'bench@example.com', 'password': 'pw'}),
+            ('user-detail', 'get', f'/api/v1/users/{user.id}/', None),
+            ('user_search', 'get', f'/api/v1/users/search?name={user.name[:3]}', None),
+            ('user_typeahead', 'get', f'/api/v1/users/typeahead?q={user.name[:2]}', None),
+            ('user_update', 'put', f'/api/v1/users/update/{user.id}',
+             {'name': user.name, 'mobile': user.mobile, 'email': user.email, 'password': password}),
+            ('user_delete', 'delete', f'/api/v1/users/delete/{other.id}', None),
+            ('user-followers', 'get', f"/api/v1/users/followers/{s['popular'].id}", None),
+            ('user-following', 'get', f'/api/v1/users/following/{user.id}', None),
+            ('user-follow-counts', 'get', f"/api/v1/users/follow-counts/{s['popular'].id}", None),
+            ('user-is-following', 'get', f"/api/v1/users/is-following/{user.id}/{s['popular'].id}", None),
+            ('user-mutuals', 'get', f'/api/v1/users/mutuals/{user.id}', None),
+            ('user-suggestions', 'get', f'/api/v1/users/{user.id}/suggestions', None),
+            ('follow-list', 'get', '/api/v1/follows/', None),
+            ('follow-list', 'post', '/api/v1/follows/', {'following_id': other.id}),
+            ('follow-detail', 'delete', f"/api/v1/follows/{s['follow'].following_id}/" if s['follow'] else None, None),
+            ('follow-batch', 'post', '/api/v1/follows/batch/', {'following_ids': s['user_ids']}),
+            ('feed', 'get', '/api/v1/feed', None),
+            ('discussion-list', 'get', '/api/v1/discussions/', None),
+            ('discussion-list', 'get', f"/api/v1/discussions/?ids={s['discussion_ids']}", None),
+            ('discussion-list', 'post', '/api/v1/discussions/', {'text': 'benchmark discussion', 'hashtags': 'bench'}),
+            ('discussion-detail', 'get', f'/api/v1/discussions/{discussion.id}/', None),
+            ('discussion-detail', 'delete', f'/api/v1/discussions/{own.id}/' if own else None, None),
+            ('discussion_update', 'put', f'/api/v1/discussions/update/{own.id}' if own else None,
+             {'text': own.text, 'hashtags': own.hashtags} if own else None),
+            ('discussion_delete', 'delete', f'/api/v1/discussions/delete/{own.id}' if own else None, None),
+            ('discussion_search', 'get', f"/api/v1/discussions/search?hashtags={s['hashtag']}", None),
+            ('discussion_search', 'get', f"/api/v1/discussions/search?text={s['word']}", None),
+            ('discussion_trending', 'get', '/api/v1/discussions/trending', None),
+            ('hashtag_trending', 'get', '/api/v1/hashtags/trending', None),
+            ('discussion_thread', 'get', f'/api/v1/discussions/{discussion.id}/thread', None),
+            ('comment-list', 'get', '/api/v1/comments/', None),
+            ('comment-list', 'post', '/api/v1/comments/', {'discussion': discussion.id, 'text': 'benchmark'}),
+            ('comment-detail', 'get', f'/api/v1/comments/{comment.id}/', None),
+            ('comment-detail', 'delete', f'/api/v1/comments/{own_comment.id}/' if own_comment else None, None),
+            ('reply-list', 'get', '/api/v1/replies/', None),
+            ('reply-list', 'post', '/api/v1/replies/', {'comment': comment.id, 'text': 'benchmark'}),
+            ('reply-detail', 'get', f'/api/v1/replies/{reply.id}/', None),
+            ('like-list', 'get', '/api/v1/likes/', None),
+            ('like-list', 'post', '/api/v1/likes/' if s['unliked_discussion'] else None,
+             {'discussion': getattr(s['unliked_discussion'], 'id', None)}),
+            ('like-detail', 'delete', f'/api/v1/likes/{like.discussion_id}/' if like else None, None),
+            ('like-batch', 'post', '/api/v1/likes/batch/', {'discussions': s['liked_discussions']}),
+            ('commentlike-list', 'get', '/api/v1/commentlikes/', None),
+            ('commentlike-list', 'post', '/api/v1/commentlikes/' if s['unliked_comment'] else None,
+             {'comment': getattr(s['unliked_comment'], 'id', None)}),
+            ('commentlike-detail', 'get', f"/api/v1/commentlikes/{s['comment_like'].id}/" if s['comment_like'] else None, None),
+            ('commentlike-batch', 'post', '/api/v1/commentlikes/batch/', {'comments': s['comment_ids']}),
+        ]
+
+    def get_admin_cases(self):
+        return [
+            ('export', 'get', '/api/v1/export/discussions', None),
+            ('export', 'get', '/api/v1/export/follows?gzip=1', None),
+        ]
+
+    def check_coverage(self, cases):
+        resolver = get_resolver('spyne.urls')
+        names = {name for name in resolver.reverse_dict if isinstance(name, str)}
+        missing = names - {case[0] for case in cases}
+        if missing:
+            self.stderr.write(f"No benchmark case for: {', '.join(sorted(missing))}")
+
+    def run_case(self, method, path, data, iterations):
+        if path is None:
+            return {'status': 'skip', 'p50_ms': 0.0, 'p95_ms': 0.0, 'queries': 0, 'cold_queries': 0}
+        caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')].clear()
+        timings = []
+        queries = []
+        for _ in range(iterations):
+            try:
+                with transaction.atomic():
+                    counter = QueryCounter()
+                    with connection.execute_wrapper(counter):
+                        start = time.perf_counter()
+                        response = getattr(self.client, method)(path, data, format='json')
+                        if response.streaming:
+                            for block in response.streaming_content:
+                                pass
+                        timings.append((time.perf_counter() - start) * 1000)
+                    queries.append(counter.count)
+                    if method != 'get':
+                        raise Rollback
+            except Rollback:
+                pass
+            if not 200 <= response.status_code < 300:
+                return {'method': method.upper(), 'path': path, 'status': response.status_code, 'failed': True}
+        warm = timings[1:] or timings
+        return {
+            'method': method.upper(),
+            'path': path,
+            'status': response.status_code,
+            'iterations': iterations,
+            'cold_ms': round(timings[0], 3),
+            'mean_ms': round(statistics.mean(warm), 3),
+            'p50_ms': round(statistics.median(warm), 3),
+            'p95_ms': round(sorted(warm)[max(0, int(len(warm) * 0.95) - 1)], 3),
+            'max_ms': round(max(warm), 3),
+            'cold_queries': queries[0],
+            'queries': max(queries[1:] or queries),
+        }
+
+    def get_meta(self, iterations):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'created': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'iterations': iterations,
+            'rows': {
+                model.__name__: model.objects.count()
+                for model in (User, Follow, Discussion, Comment, Reply, Like, CommentLike)
+            },
+        }
+
+    def compare(self, path, results):
+        with open(path) as f:
+            previous = json.load(f)['results']
+        self.stdout.write(f'Changes against {path}:')
+        for name, result in results.items():
+            before = previous.get(name)
+            if not before or result['status'] == 'skip' or result.get('failed') or before.get('failed'):
+                continue
+            change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+            self.stdout.write(
+                f"{name:34} p50 {before['p50_ms']:8.2f} -> {result['p50_ms']:8.2f}ms ({change:+.0f}%)  "
+                f"queries {before['queries']} -> {result['queries']}"
+            )
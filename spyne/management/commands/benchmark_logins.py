@@ -0,0 +1,102 @@
+import io
+import json
+import statistics
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from spyne.models import User
+
+
+def percentile(timings, fraction):
+    return sorted(timings)[max(0, int(len(timings) * fraction) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure login latency percentiles and throughput with many logins in flight, '
+        'through the WSGI application. Deletes the refresh tokens it issues.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=32, help='Logins in flight.')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--password', default='password', help='Password of the generated users.')
+        parser.add_argument('--retry', action='store_true',
+                            help='Retry rejected logins after their Retry-After, timing each until it succeeds.')
+        parser.add_argument('--output', default='logins.json')
+        parser.add_argument('--compare', help='Earlier results file to print changes against.')
+
+    def handle(self, *args, **options):
+        emails = list(User.objects.order_by('id').values_list('email', flat=True)[:options['requests']])
+        if not emails:
+            raise CommandError('No users found; run generate_dataset first.')
+        from backend.wsgi import application
+
+        def login(email):
+            body = json.dumps({'email': email, 'password': options['password']}).encode()
+            environ = {
+                'REQUEST_METHOD': 'POST', 'PATH_INFO': '/api/v1/token/', 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'localhost', 'REMOTE_ADDR': '127.0.0.1',
+                'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+                'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(body),
+                'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            status = []
+            response = application(environ, lambda line, headers: status.append((int(line.split()[0]), dict(headers))))
+            try:
+                for block in response:
+                    pass
+            finally:
+                response.close()
+            return status[0]
+
+        def timed(email):
+            start = time.perf_counter()
+            status, headers = login(email)
+            while options['retry'] and status == 503:
+                time.sleep(int(headers.get('Retry-After', 1)))
+                status, headers = login(email)
+            return status, time.perf_counter() - start
+
+        last_token = OutstandingToken.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        requests = [emails[i % len(emails)] for i in range(options['requests'])]
+        try:
+            with ThreadPoolExecutor(options['concurrency']) as pool:
+                start = time.perf_counter()
+                statuses, timings = zip(*pool.map(timed, requests))
+                elapsed = time.perf_counter() - start
+        finally:
+            OutstandingToken.objects.filter(pk__gt=last_token).delete()
+
+        ok = [timing for status, timing in zip(statuses, timings) if status == 200]
+        result = {
+            'concurrency': options['concurrency'],
+            'retry': options['retry'],
+            'logins_per_second': round(statuses.count(200) / elapsed, 1),
+            'statuses': {str(status): count for status, count in sorted(Counter(statuses).items())},
+            'p50_ms': round(statistics.median(timings) * 1000, 3),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+            # Latency of the logins that succeeded, without the fast rejections.
+            'ok_p99_ms': round(percentile(ok, 0.99) * 1000, 3) if ok else None,
+        }
+        self.stdout.write(
+            f"{result['logins_per_second']:.1f} logins/s  statuses {result['statuses']}  p50 {result['p50_ms']:.2f}ms  "
+            f"p95 {result['p95_ms']:.2f}ms  p99 {result['p99_ms']:.2f}ms  (succeeded p99 {result['ok_p99_ms']}ms)"
+        )
+        with open(options['output'], 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+        self.stdout.write(f"Wrote {options['output']}")
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                before = json.load(f)
+            for key in ['logins_per_second', 'p50_ms', 'p95_ms', 'p99_ms']:
+                self.stdout.write(f'{key:18} {before[key]:10.2f} -> {result[key]:10.2f} ({result[key] / before[key]:.2f}x)')
@@ -0,0 +1,183 @@
+import asyncio
+import io
+import json
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from spyne.models import Discussion
+
+from .benchmark import Command as Benchmark
+
+MODES = ['wsgi', 'asgi']
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the throughput of the read endpoints served by async views under ASGI '
+        '(spyne/async_views.py) against the synchronous views under WSGI. Each server runs '
+        'in its own process with the same number of requests in flight, so both are '
+        'compared at the memory of a single worker process; peak RSS is reported.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=MODES + ['both'], default='both')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Requests in flight: WSGI threads, or concurrent ASGI requests.')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint.')
+        parser.add_argument('--cold', action='store_true',
+                            help='Make every URL unique so no response comes from the response cache.')
+        parser.add_argument('--only', nargs='*', help='URL names to run.')
+        parser.add_argument('--output', default='throughput.json')
+
+    def handle(self, *args, **options):
+        if not Discussion.objects.exists():
+            raise CommandError('No discussions found; run generate_dataset first.')
+        if options['mode'] == 'both':
+            return self.compare(options)
+
+        sample = Benchmark().get_sample()
+        token = str(RefreshToken.for_user(sample['user']).access_token)
+        cases = [case for case in self.get_cases(sample) if not options['only'] or case[0] in options['only']]
+        run = self.run_wsgi if options['mode'] == 'wsgi' else self.run_asgi
+
+        results = {}
+        for name, path in cases:
+            paths = [
+                f"{path}{'&' if '?' in path else '?'}_={i}" if options['cold'] else path
+                for i in range(options['requests'])
+            ]
+            # One pass to warm up connections, caches and lazily built state.
+            run(paths[:options['concurrency']], token, options['concurrency'])
+            start = time.perf_counter()
+            statuses, timings = run(paths, token, options['concurrency'])
+            elapsed = time.perf_counter() - start
+            label = f'{name} {path}'
+            results[label] = {
+                'requests_per_second': round(len(paths) / elapsed, 1),
+                'p50_ms': round(statistics.median(timings) * 1000, 3),
+                'p95_ms': round(sorted(timings)[max(0, int(len(timings) * 0.95) - 1)] * 1000, 3),
+                'statuses': sorted(set(statuses)),
+            }
+            self.stdout.write(
+                f"{options['mode']} {label[:60]:60} {results[label]['requests_per_second']:8.1f} req/s  "
+                f"p50 {results[label]['p50_ms']:8.2f}ms  p95 {results[label]['p95_ms']:8.2f}ms"
+            )
+
+        report = {
+            'mode': options['mode'],
+            'concurrency': options['concurrency'],
+            'cold': options['cold'],
+            # Kilobytes on Linux.
+            'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        self.stdout.write(f"Peak RSS {report['max_rss']}; wrote {options['output']}")
+
+    def get_cases(self, s):
+        user, popular, discussion = s['user'], s['popular'], s['discussion']
+        return [
+            ('discussion-detail', f'/api/v1/discussions/{discussion.id}/'),
+            ('discussion-list', '/api/v1/discussions/'),
+            ('discussion-list', f"/api/v1/discussions/?ids={s['discussion_ids']}&comments=false"),
+            ('discussion_search', f"/api/v1/discussions/search?hashtags={s['hashtag']}"),
+            ('discussion_search', f"/api/v1/discussions/search?text={s['word']}"),
+            ('user_search', f'/api/v1/users/search?name={user.name[:3]}'),
+            ('user-followers', f'/api/v1/users/followers/{popular.id}'),
+            ('user-following', f'/api/v1/users/following/{user.id}'),
+        ]
+
+    def run_wsgi(self, paths, token, concurrency):
+        from backend.wsgi import application
+
+        def call(url):
+            path, _, query = url.partition('?')
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+                'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': 'localhost', 'HTTP_AUTHORIZATION': f'Bearer {token}', 'REMOTE_ADDR': '127.0.0.1',
+                'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+                'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            status = []
+            start = time.perf_counter()
+            response = application(environ, lambda line, headers: status.append(int(line.split()[0])))
+            try:
+                for block in response:
+                    pass
+            finally:
+                response.close()
+            return status[0], time.perf_counter() - start
+
+        with ThreadPoolExecutor(concurrency) as pool:
+            return zip(*pool.map(call, paths))
+
+    def run_asgi(self, paths, token, concurrency):
+        from backend.asgi import application
+
+        async def call(url, limit):
+            path, _, query = url.partition('?')
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                'root_path': '', 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+                'headers': [(b'host', b'localhost'), (b'authorization', f'Bearer {token}'.encode())],
+            }
+            status = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            async with limit:
+                start = time.perf_counter()
+                await application(scope, receive, send)
+                return status[0], time.perf_counter() - start
+
+        async def run():
+            limit = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(call(path, limit) for path in paths))
+
+        return zip(*asyncio.run(run()))
+
+    def compare(self, options):
+        # Runs each server in a fresh process, so neither inherits the other's memory.
+        reports = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for mode in MODES:
+                output = f'{directory}/{mode}.json'
+                command = [
+                    sys.executable, sys.argv[0], 'benchmark_throughput', '--mode', mode,
+                    '--concurrency', str(options['concurrency']), '--requests', str(options['requests']),
+                    '--output', output,
+                ]
+                if options['cold']:
+                    command.append('--cold')
+                if options['only']:
+                    command += ['--only', *options['only']]
+                subprocess.run(command, check=True)
+                with open(output) as f:
+                    reports[mode] = json.load(f)
+
+        wsgi, asgi = reports['wsgi'], reports['asgi']
+        self.stdout.write(f"Peak RSS: wsgi {wsgi['max_rss']}, asgi {asgi['max_rss']}")
+        for label, result in asgi['results'].items():
+            before = wsgi['results'][label]['requests_per_second']
+            after = result['requests_per_second']
+            self.stdout.write(f'{label[:60]:60} {before:8.1f} -> {after:8.1f} req/s ({after / before:.2f}x)')
+        with open(options['output'], 'w') as f:
+            json.dump(reports, f, indent=2, sort_keys=True)
+        self.stdout.write(f"Wrote {options['output']}")
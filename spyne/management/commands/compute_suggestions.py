@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from spyne.suggestions import PROCESSES, refresh
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the follow suggestions of users whose follows changed since the last run, '
+        'or of every user with --full. Keep it running with --interval.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every user, not just the changed ones.')
+        parser.add_argument('--processes', type=int, default=PROCESSES,
+                            help='Worker processes ranking users (default: one per CPU).')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Refresh changed users every this many seconds instead of once.')
+
+    def handle(self, *args, **options):
+        full = options['full']
+        while True:
+            started = time.monotonic()
+            refreshed = refresh(full=full, processes=options['processes'])
+            self.stdout.write(f'Refreshed suggestions for {refreshed} users in {time.monotonic() - started:.2f}s')
+            if options['interval'] <= 0:
+                return
+            full = False
+            time.sleep(max(0, options['interval'] - (time.monotonic() - started)))
+            close_old_connections()
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from spyne.trending import compute
+
+
+class Command(BaseCommand):
+    help = (
+        'Fold new likes, comments and views into the trending scores and rewrite the '
+        'ranked trending snapshots. Run it periodically, or keep it running with --interval.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Recompute every this many seconds instead of once.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            ranked = compute()
+            self.stdout.write(f'Wrote {ranked} trending entries in {time.monotonic() - started:.2f}s')
+            if options['interval'] <= 0:
+                return
+            time.sleep(max(0, options['interval'] - (time.monotonic() - started)))
+            close_old_connections()
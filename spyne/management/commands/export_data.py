@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from spyne.export import CHUNK_SIZE, EXPORTS, gzipped, ndjson, parse_time, rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Write every row of one table as NDJSON, in id order. Use --since/--until for '
+        'incremental exports and --after to resume from the last id written.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS))
+        parser.add_argument('--output', help='File to write to instead of stdout.')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output.')
+        parser.add_argument('--since', help='Only rows created at or after this ISO date/datetime.')
+        parser.add_argument('--until', help='Only rows created before this ISO date/datetime.')
+        parser.add_argument('--after', type=int, default=0, help='Only rows with an id above this one.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_time(options['since']) if options['since'] else None
+            until = parse_time(options['until']) if options['until'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        blocks = ndjson(
+            rows(options['kind'], since, until, options['after'], options['chunk_size']), options['chunk_size'],
+        )
+        if options['gzip']:
+            blocks = gzipped(blocks)
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for block in blocks:
+                output.write(block)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from spyne.feed import BATCH_SIZE, run_job
+from spyne.models import FanOutJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy new discussions into their followers\' timelines: fan-outs left unfinished by a restart '
+        'or a failure, or all of them with FEED_FANOUT_IN_PROCESS off. Each resumes from the last '
+        'follower it reached.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Run pending fan-outs every this many seconds instead of once.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            pending = list(FanOutJob.objects.order_by('created_on').values_list('pk', flat=True))
+            failed = [discussion_id for discussion_id in pending if not run_job(discussion_id, options['chunk_size'])]
+            self.stdout.write(f'Fanned out {len(pending) - len(failed)} discussions')
+            if options['interval'] <= 0:
+                if failed:
+                    raise CommandError(f'{len(failed)} fan-out(s) failed; see the log, then rerun to resume them')
+                return
+            for discussion_id in failed:
+                self.stderr.write(f'Fan-out of discussion {discussion_id} failed; see the log')
+            time.sleep(max(0, options['interval'] - (time.monotonic() - started)))
+            close_old_connections()
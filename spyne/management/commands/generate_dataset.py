@@ -0,0 +1,188 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from spyne.feed import FANOUT_LIMIT
+from spyne.models import (
+    User, Follow, Discussion, Comment, Like, CommentLike, Reply, TimelineEntry,
+)
+
+WORDS = (
+    'about above across after again against all almost alone along already also although always among '
+    'answer around article back because before begin behind believe below best better between build '
+    'camera change city close code coffee common company complete consider could country course create '
+    'data design develop different discuss early easy enough every example experience family feature '
+    'find first follow friend future game give great group grow happen help home house idea important '
+    'include interest issue keep kind know large last learn leave life light little local long look '
+    'make market matter mean media million model money month morning music need never news next night '
+    'number offer office often open order other paper party people photo picture place plan play point '
+    'power present problem program project public question quick quite rather reason recent remember '
+    'report result right road room school science season second service share short should show simple '
+    'since small social some something sound space speak special sport start state still story study '
+    'success system table team tell test thank thing think through time today together travel under '
+    'until update value video view visit watch water week while whole why window without word work '
+    'world write year young'
+).split()
+
+HASHTAGS = (
+    'python django travel food music sports news tech design photo art books movies gaming fitness '
+    'science coding startup health nature'
+).split()
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a reproducible synthetic social graph for load testing. Rows are '
+        'streamed into the database in bulk_create batches, so memory use does not '
+        'grow with the requested scale.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument('--discussions', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--replies', type=int, default=20000)
+        parser.add_argument('--likes', type=int, default=50000)
+        parser.add_argument('--comment-likes', type=int, default=20000)
+        parser.add_argument('--days', type=int, default=365, help='Spread created dates over this many days.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--password', default='password', help='Password set on every generated user.')
+        parser.add_argument('--skip-indexes', action='store_true',
+                            help="Don't reconcile counters or build the hashtag, search, user search, timeline and trending indexes.")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.span = timedelta(days=options['days']).total_seconds()
+
+        users = self.create(User, options['users'], self.users(options['users'], options['password']))
+        self.create(Follow, options['users'] * options['follows_per_user'], self.follows(users, options['follows_per_user']))
+        discussions = self.create(Discussion, options['discussions'], self.discussions(users, options['discussions']))
+        comments = self.create(Comment, options['comments'], self.comments(users, discussions, options['comments']))
+        self.create(Reply, options['replies'], self.replies(users, comments, options['replies']))
+        self.create(Like, options['likes'], self.likes(users, discussions, 'discussion_id', Like, options['likes']))
+        self.create(CommentLike, options['comment_likes'],
+                    self.likes(users, comments, 'comment_id', CommentLike, options['comment_likes']))
+
+        if not options['skip_indexes']:
+            call_command('reconcile_counters', chunk_size=self.batch_size, stdout=self.stdout)
+            call_command('backfill_hashtags', chunk_size=self.batch_size, stdout=self.stdout)
+            call_command('rebuild_search_index', chunk_size=self.batch_size, stdout=self.stdout)
+            call_command('rebuild_user_search', chunk_size=self.batch_size, stdout=self.stdout)
+            self.fill_timelines()
+            call_command('compute_trending', stdout=self.stdout)
+            call_command('compute_suggestions', full=True, stdout=self.stdout)
+
+    def create(self, model, total, rows):
+        # Returns the (first, last) id range of the inserted rows. Ids are assumed to
+        # be allocated contiguously, which holds for a generator run on its own,
+        # but not to follow on from the highest existing id: auto-increment
+        # counters aren't reset when rows are deleted.
+        if total <= 0:
+            return None
+        before = model.objects.aggregate(last=Max('id'))['last'] or 0
+        created = 0
+        for batch in _batches(rows, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+            created += len(batch)
+            self.stdout.write(f'{model.__name__}: {created}/{total}', ending='\r')
+        self.stdout.write(f'{model.__name__}: {created}')
+        return tuple(model.objects.filter(id__gt=before).aggregate(first=Min('id'), last=Max('id')).values())
+
+    def created_on(self):
+        return self.now - timedelta(seconds=self.random.random() * self.span)
+
+    def pick(self, ids, skew=1.0):
+        # skew > 1 concentrates picks on the lowest ids, giving a few very
+        # popular users/discussions and a long tail.
+        first, last = ids
+        return first + int((last - first) * self.random.random() ** skew)
+
+    def text(self, low, high):
+        return ' '.join(self.random.choice(WORDS) for _ in range(self.random.randint(low, high)))
+
+    def users(self, total, password):
+        password = make_password(password)
+        for i in range(total):
+            yield User(
+                email=f'user{i}.{self.random.getrandbits(32):08x}@example.com',
+                name=f'{self.random.choice(WORDS).title()} {self.random.choice(WORDS).title()}',
+                mobile=f'{self.random.randrange(10 ** 9, 10 ** 10)}',
+                password=password,
+            )
+
+    def follows(self, users, per_user):
+        if users is None:
+            return
+        first, last = users
+        for follower_id in range(first, last + 1):
+            following = {self.pick(users, skew=3) for _ in range(self.random.randint(0, 2 * per_user))}
+            following.discard(follower_id)
+            for following_id in sorted(following):
+                yield Follow(follower_id=follower_id, following_id=following_id, created_at=self.created_on())
+
+    def discussions(self, users, total):
+        for _ in range(total):
+            yield Discussion(
+                user_id=self.pick(users, skew=2),
+                text=self.text(5, 60),
+                hashtags=','.join(self.random.sample(HASHTAGS, self.random.randint(0, 3))),
+                created_on=self.created_on(),
+                views=self.random.randint(0, 10000),
+            )
+
+    def comments(self, users, discussions, total):
+        for _ in range(total):
+            yield Comment(user_id=self.pick(users), discussion_id=self.pick(discussions, skew=3), text=self.text(3, 30))
+
+    def replies(self, users, comments, total):
+        for _ in range(total):
+            yield Reply(user_id=self.pick(users), comment_id=self.pick(comments, skew=3), text=self.text(3, 20))
+
+    def likes(self, users, targets, field, model, total):
+        # Repeated (user, target) pairs are dropped by the unique constraint.
+        for _ in range(total):
+            yield model(user_id=self.pick(users), **{field: self.pick(targets, skew=3)})
+
+    def fill_timelines(self):
+        # Fan every discussion out to its author's followers in one INSERT ... SELECT
+        # rather than round-tripping rows through Python.
+        timeline = TimelineEntry._meta.db_table
+        follow = Follow._meta.db_table
+        discussion = Discussion._meta.db_table
+        user = User._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {timeline}')
+            cursor.execute(
+                f'INSERT INTO {timeline} (user_id, discussion_id, author_id, created_on) '
+                f'SELECT f.follower_id, d.id, d.user_id, d.created_on FROM {follow} f '
+                f'JOIN {discussion} d ON d.user_id = f.following_id '
+                f'JOIN {user} u ON u.id = d.user_id WHERE u.follower_count <= %s',
+                [FANOUT_LIMIT],
+            )
+            cursor.execute(
+                f'INSERT INTO {timeline} (user_id, discussion_id, author_id, created_on) '
+                f'SELECT d.user_id, d.id, d.user_id, d.created_on FROM {discussion} d'
+            )
+        self.stdout.write(f'TimelineEntry: {TimelineEntry.objects.count()}')
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from spyne.images import PROCESSES, backfill, process
+from spyne.models import StoredImage
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the resized variants of every stored image that has none yet: uploads made while '
+        'IMAGE_PROCESS_IN_PROCESS is off, left behind by a restart, or that failed before.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=PROCESSES)
+        parser.add_argument(
+            '--backfill', action='store_true', help='First register the images of discussions created before variants.',
+        )
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.stdout.write(f'Registered the images of {backfill()} discussions')
+
+        pending = StoredImage.objects.filter(processed_on__isnull=True).order_by('id').values_list('id', 'name')
+        processed = failed = 0
+        for image_id, ok in process(pending, options['processes']):
+            if ok:
+                processed += 1
+            else:
+                failed += 1
+                self.stderr.write(f'Image {image_id} failed; see the log')
+        self.stdout.write(f'Processed {processed} images')
+        if failed:
+            raise CommandError(f'{failed} image(s) failed')
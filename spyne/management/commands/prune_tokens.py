@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from spyne.logins import PRUNE_CHUNK_SIZE, prune_tokens
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired outstanding refresh tokens, which every login records, and their '
+        'blacklist entries, in small transactions. Run it periodically, or keep it running '
+        'with --interval.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=PRUNE_CHUNK_SIZE)
+        parser.add_argument('--full', action='store_true',
+                            help='Scan the whole table instead of stopping at the first unexpired chunk.')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Prune every this many seconds instead of once.')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            deleted = prune_tokens(options['chunk_size'], options['full'])
+            self.stdout.write(f'Deleted {deleted} expired tokens in {time.monotonic() - started:.2f}s')
+            if options['interval'] <= 0:
+                return
+            time.sleep(max(0, options['interval'] - (time.monotonic() - started)))
+            close_old_connections()
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from spyne.models import PurgeJob
+from spyne.purge import CHUNK_SIZE, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove the rows of soft-deleted users and discussions. Runs every unfinished purge job '
+        '(or just --job), resuming each from the stage it reached.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', type=int, help='Run only this purge job.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--list', action='store_true', help='List unfinished jobs instead of running them.')
+
+    def handle(self, *args, **options):
+        jobs = PurgeJob.objects.filter(finished_on__isnull=True).order_by('created_on', 'id')
+        if options['job'] is not None:
+            jobs = PurgeJob.objects.filter(pk=options['job'])
+            if not jobs.exists():
+                raise CommandError(f"Purge job {options['job']} does not exist")
+
+        if options['list']:
+            for job in jobs:
+                line = f'{job.pk}: {job.kind} {job.object_id}, stage {job.stage or "-"}, {job.deleted} rows deleted'
+                self.stdout.write(line + (f', error: {job.error}' if job.error else ''))
+            return
+
+        failed = 0
+        for job_id in list(jobs.values_list('pk', flat=True)):
+            if run_job(job_id, options['chunk_size']):
+                job = PurgeJob.objects.get(pk=job_id)
+                self.stdout.write(f'Purged {job.kind} {job.object_id}: {job.deleted} rows deleted')
+            else:
+                failed += 1
+                self.stderr.write(f'Purge job {job_id} failed; see the log, then rerun to resume it')
+        if failed:
+            raise CommandError(f'{failed} purge job(s) failed')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from spyne.models import Discussion
+from spyne.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Drop and rebuild the full-text search index for discussions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        discussions = Discussion.objects.order_by('pk').values_list('pk', 'text').iterator(chunk_size=options['chunk_size'])
+        for indexed in rebuild_index(discussions, chunk_size=options['chunk_size']):
+            self.stdout.write(f'Indexed {indexed} discussions')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from spyne.models import User
+from spyne.typeahead import index_users
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the typeahead search keys of every user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        indexed = 0
+        last_pk = 0
+        while True:
+            users = list(User.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'name', 'email')[:options['chunk_size']])
+            if not users:
+                break
+            with transaction.atomic():
+                index_users(users)
+            last_pk = users[-1].pk
+            indexed += len(users)
+            self.stdout.write(f'Indexed {indexed} users')
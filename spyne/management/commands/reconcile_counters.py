@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from spyne.models import User, Follow, Discussion, Comment, Like, CommentLike, Reply
+
+
+# (model, {counter field: (child model, child foreign key)})
+COUNTERS = [
+    (User, {
+        'follower_count': (Follow, 'following_id'),
+        'following_count': (Follow, 'follower_id'),
+    }),
+    (Discussion, {
+        'like_count': (Like, 'discussion_id'),
+        'comment_count': (Comment, 'discussion_id'),
+    }),
+    (Comment, {
+        'like_count': (CommentLike, 'comment_id'),
+        'reply_count': (Reply, 'comment_id'),
+    }),
+]
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalized follow/like/comment/reply counters and fix any that drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        for model, counters in COUNTERS:
+            fixed = self.reconcile(model, counters, options['chunk_size'], options['dry_run'])
+            self.stdout.write(f'{model.__name__}: {fixed} rows with drifted counters')
+
+    def reconcile(self, model, counters, chunk_size, dry_run):
+        fields = list(counters)
+        fixed = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                # Lock the chunk first so live F() increments queue behind us and
+                # land on top of the recomputed value instead of being overwritten.
+                rows = list(
+                    model.objects.select_for_update()
+                    .filter(pk__gt=last_pk).order_by('pk')
+                    .values('pk', *fields)[:chunk_size]
+                )
+                if not rows:
+                    break
+                last_pk = rows[-1]['pk']
+                ids = [row['pk'] for row in rows]
+
+                actual = {}
+                for field, (child, fk) in counters.items():
+                    actual[field] = dict(
+                        child.objects.filter(**{f'{fk}__in': ids}).order_by()
+                        .values_list(fk).annotate(n=Count('id'))
+                    )
+
+                drifted = []
+                for row in rows:
+                    values = {field: actual[field].get(row['pk'], 0) for field in fields}
+                    if any(row[field] != value for field, value in values.items()):
+                        drifted.append(model(pk=row['pk'], **values))
+
+                if drifted and not dry_run:
+                    model.objects.bulk_update(drifted, fields)
+                fixed += len(drifted)
+        return fixed
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.12 on 2026-10-18 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spyne', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['created_on', 'id'], name='spyne_comme_created_255c8a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discussion',
+            index=models.Index(fields=['created_on', 'id'], name='spyne_discu_created_8ebe44_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reply',
+            index=models.Index(fields=['created_on', 'id'], name='spyne_reply_created_e6775b_idx'),
+        ),
+    ]
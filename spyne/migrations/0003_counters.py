@@ -0,0 +1,33 @@
+# Generated by Django 3.2.12 on 2026-10-18 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spyne', '0002_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='discussion',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='discussion',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.12 on 2026-10-18 12:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spyne', '0003_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DiscussionHashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('discussion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hashtag_links', to='spyne.discussion')),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discussion_links', to='spyne.hashtag')),
+            ],
+            options={
+                'unique_together': {('hashtag', 'discussion')},
+            },
+        ),
+    ]
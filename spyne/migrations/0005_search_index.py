@@ -0,0 +1,42 @@
+# Generated by Django 3.2.12 on 2026-10-18 12:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spyne', '0004_hashtags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('discussion', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='spyne.discussion')),
+                ('length', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, unique=True)),
+                ('document_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frequency', models.PositiveIntegerField()),
+                ('positions', models.TextField()),
+                ('discussion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_postings', to='spyne.discussion')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='spyne.searchterm')),
+            ],
+            options={
+                'unique_together': {('term', 'discussion')},
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.12 on 2026-10-18 11:18
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    # Likes were only unique by convention until now; keep the earliest of each
+    # (target, user) pair so the unique constraints can be created. Run
+    # reconcile_counters afterwards if any were removed.
+    for model_name, field in (('Like', 'discussion'), ('CommentLike', 'comment')):
+        model = apps.get_model('spyne', model_name)
+        duplicates = (
+            model.objects.values(field, 'user')
+            .annotate(keep=Min('id'), total=Count('id'))
+            .filter(total__gt=1)
+        )
+        for row in duplicates.iterator():
+            model.objects.filter(**{field: row[field], 'user': row['user']}).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spyne', '0006_timeline'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['discussion', 'created_on'], name='comment_discussion_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='discussion',
+            index=models.Index(fields=['user', 'created_on'], name='discussion_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['following', 'created_at'], name='follow_following_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='commentlike',
+            constraint=models.UniqueConstraint(fields=('comment', 'user'), name='commentlike_comment_user_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='like',
+            constraint=models.UniqueConstraint(fields=('discussion', 'user'), name='like_discussion_user_uniq'),
+        ),
+    ]
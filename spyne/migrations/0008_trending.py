@@ -0,0 +1,64 @@
+# Generated by Django 3.2.12 on 2026-10-18 11:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spyne', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10)),
+                ('window', models.CharField(max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('score', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingState',
+            fields=[
+                ('key', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ViewDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('views', models.PositiveIntegerField()),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('discussion', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='spyne.discussion')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10)),
+                ('window', models.CharField(max_length=10)),
+                ('rank', models.PositiveIntegerField()),
+                ('object_id', models.BigIntegerField()),
+                ('score', models.FloatField()),
+                ('computed_on', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('kind', 'window', 'rank')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='trendingscore',
+            index=models.Index(fields=['kind', 'window', 'score'], name='spyne_trend_kind_81b6da_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='trendingscore',
+            unique_together={('kind', 'window', 'object_id')},
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.12 on 2026-10-18 11:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spyne', '0008_trending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=255)),
+                ('kind', models.CharField(max_length=5)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_keys', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.12 on 2026-10-18 11:29
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spyne', '0009_user_search_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurgeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('stage', models.CharField(default='', max_length=30)),
+                ('deleted', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='discussion',
+            name='deleted_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='deleted_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='purgejob',
+            index=models.Index(fields=['finished_on', 'created_on'], name='spyne_purge_finishe_c02b0c_idx'),
+        ),
+    ]
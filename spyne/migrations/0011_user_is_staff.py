@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-18 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spyne', '0010_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='is_staff',
+            field=models.BooleanField(default=False),
+        ),
+    ]
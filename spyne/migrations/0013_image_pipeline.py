@@ -0,0 +1,39 @@
+# Generated by Django 3.2.12 on 2026-10-18 11:42
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spyne', '0012_follow_suggestions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('variants', models.TextField(default='')),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now)),
+                ('processed_on', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='discussion',
+            name='image_variants',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddIndex(
+            model_name='discussion',
+            index=models.Index(fields=['image'], name='discussion_image_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storedimage',
+            index=models.Index(fields=['processed_on', 'id'], name='spyne_store_process_871f9b_idx'),
+        ),
+    ]
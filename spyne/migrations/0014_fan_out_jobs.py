@@ -0,0 +1,23 @@
+# Generated by Django 3.2.12 on 2026-10-18 12:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('spyne', '0013_image_pipeline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FanOutJob',
+            fields=[
+                ('discussion', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='spyne.discussion')),
+                ('last_follow_id', models.BigIntegerField(default=0)),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
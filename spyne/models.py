@@ -4,6 +4,11 @@ from django.utils import timezone
 
 
 class UserManager(BaseUserManager):
+    # Soft-deleted users are hidden everywhere, including from authentication,
+    # until spyne.purge removes them; all_objects still sees them.
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_on__isnull=True)
+
     def create_user(self, email, password=None, **extra_fields):
         if not email:
             raise ValueError('The Email field must be set')
@@ -15,7 +20,6 @@ class UserManager(BaseUserManager):
 
     def create_superuser(self, email, password=None, **extra_fields):
         extra_fields.setdefault('is_staff', True)
-        extra_fields.setdefault('is_superuser', True)
 
         return self.create_user(email, password, **extra_fields)
 
@@ -26,8 +30,12 @@ class User(AbstractBaseUser):
     mobile = models.CharField(max_length=15)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    deleted_on = models.DateTimeField(null=True, blank=True)
 
     objects = UserManager()
+    all_objects = models.Manager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['name', 'mobile']
@@ -35,9 +43,12 @@ class User(AbstractBaseUser):
     def __str__(self):
         return self.email
 
-    @property
-    def is_staff(self):
-        return self.is_admin
+class UserSearchKey(models.Model):
+    # Normalized prefixes a user can be found by in typeahead search: their full
+    # name, each trailing run of its words, and their email (see spyne/typeahead.py).
+    user = models.ForeignKey(User, related_name='search_keys', on_delete=models.CASCADE)
+    key = models.CharField(max_length=255, db_index=True)
+    kind = models.CharField(max_length=5)
 
 class Follow(models.Model):
     follower = models.ForeignKey(User, related_name='following', on_delete=models.CASCADE)
@@ -47,33 +58,201 @@ class Follow(models.Model):
     class Meta:
         unique_together = ('follower', 'following')
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['following', 'created_at'], name='follow_following_created_idx')]
+
+class DiscussionManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_on__isnull=True)
 
 class Discussion(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
     image = models.ImageField(upload_to='images/', null=True, blank=True)
+    # JSON {variant: storage name} of the image's resized copies, including
+    # the original; filled in by spyne/images.py once they are rendered.
+    image_variants = models.TextField(blank=True, default='')
     hashtags = models.TextField(default="")
     created_on = models.DateTimeField(default=timezone.now)
     views = models.IntegerField(default=0)
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    deleted_on = models.DateTimeField(null=True, blank=True)
+
+    objects = DiscussionManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_on', 'id']),
+            models.Index(fields=['user', 'created_on'], name='discussion_user_created_idx'),
+            models.Index(fields=['image'], name='discussion_image_idx'),
+        ]
 
 class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     discussion = models.ForeignKey(Discussion, related_name='comments', on_delete=models.CASCADE)
     text = models.TextField()
     created_on = models.DateTimeField(auto_now_add=True)
+    like_count = models.PositiveIntegerField(default=0)
+    reply_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_on', 'id']),
+            models.Index(fields=['discussion', 'created_on'], name='comment_discussion_created_idx'),
+        ]
 
 class Like(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     discussion = models.ForeignKey(Discussion, related_name='likes', on_delete=models.CASCADE)
     created_on = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['discussion', 'user'], name='like_discussion_user_uniq')]
+
 class CommentLike(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     comment = models.ForeignKey(Comment, related_name='likes', on_delete=models.CASCADE)
     created_on = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['comment', 'user'], name='commentlike_comment_user_uniq')]
+
 class Reply(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     comment = models.ForeignKey(Comment, related_name='replies', on_delete=models.CASCADE)
     text = models.TextField()
     created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['created_on', 'id'])]
+
+class Hashtag(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+
+class DiscussionHashtag(models.Model):
+    discussion = models.ForeignKey(Discussion, related_name='hashtag_links', on_delete=models.CASCADE)
+    hashtag = models.ForeignKey(Hashtag, related_name='discussion_links', on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('hashtag', 'discussion')
+
+class SearchTerm(models.Model):
+    term = models.CharField(max_length=100, unique=True)
+    document_count = models.PositiveIntegerField(default=0)
+
+class SearchDocument(models.Model):
+    discussion = models.OneToOneField(Discussion, primary_key=True, related_name='search_document', on_delete=models.CASCADE)
+    length = models.PositiveIntegerField(default=0)
+
+class SearchPosting(models.Model):
+    term = models.ForeignKey(SearchTerm, related_name='postings', on_delete=models.CASCADE)
+    discussion = models.ForeignKey(Discussion, related_name='search_postings', on_delete=models.CASCADE)
+    frequency = models.PositiveIntegerField()
+    positions = models.TextField()
+
+    class Meta:
+        unique_together = ('term', 'discussion')
+
+class TimelineEntry(models.Model):
+    # Materialized home timeline: one row per discussion fanned out to a follower.
+    # created_on mirrors the discussion's so a page is one range scan on the index.
+    user = models.ForeignKey(User, related_name='timeline', on_delete=models.CASCADE)
+    discussion = models.ForeignKey(Discussion, related_name='timeline_entries', on_delete=models.CASCADE)
+    author = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    created_on = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'discussion')
+        indexes = [
+            models.Index(fields=['user', 'created_on', 'discussion']),
+            models.Index(fields=['user', 'author']),
+        ]
+
+class FanOutJob(models.Model):
+    # A discussion still being copied into its author's followers' timelines,
+    # one chunk of follows at a time in follow id order (see spyne/feed.py).
+    discussion = models.OneToOneField(Discussion, primary_key=True, related_name='+', on_delete=models.CASCADE)
+    last_follow_id = models.BigIntegerField(default=0)
+    created_on = models.DateTimeField(default=timezone.now)
+
+class ViewDelta(models.Model):
+    # View increments written by each view count flush, consumed (and deleted) by
+    # compute_trending.
+    # No constraint: a buffered view may outlive its discussion.
+    discussion = models.ForeignKey(Discussion, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+    views = models.PositiveIntegerField()
+    created_on = models.DateTimeField(default=timezone.now)
+
+class TrendingScore(models.Model):
+    # Running decayed activity score of a discussion or hashtag in one window,
+    # stored relative to the epoch in TrendingState so that only rows with new
+    # activity have to be rewritten (see spyne/trending.py).
+    kind = models.CharField(max_length=10)
+    window = models.CharField(max_length=10)
+    object_id = models.BigIntegerField()
+    score = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('kind', 'window', 'object_id')
+        indexes = [models.Index(fields=['kind', 'window', 'score'])]
+
+class TrendingSnapshot(models.Model):
+    kind = models.CharField(max_length=10)
+    window = models.CharField(max_length=10)
+    rank = models.PositiveIntegerField()
+    object_id = models.BigIntegerField()
+    score = models.FloatField()
+    computed_on = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('kind', 'window', 'rank')
+
+class TrendingState(models.Model):
+    # Watermarks of the consumed event ids and the score epoch.
+    key = models.CharField(max_length=20, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+class PurgeJob(models.Model):
+    # Background removal of a soft-deleted user or discussion and everything
+    # that depends on it, one chunk per transaction (see spyne/purge.py).
+    kind = models.CharField(max_length=10)
+    object_id = models.BigIntegerField()
+    stage = models.CharField(max_length=30, default='')
+    deleted = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_on = models.DateTimeField(default=timezone.now)
+    updated_on = models.DateTimeField(auto_now=True)
+    finished_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['finished_on', 'created_on'])]
+
+class FollowSuggestion(models.Model):
+    # Precomputed "who to follow" lists, best first (see spyne/suggestions.py).
+    user = models.ForeignKey(User, related_name='suggestions', on_delete=models.CASCADE)
+    candidate = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()
+    mutuals = models.PositiveIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('user', 'rank')
+
+class SuggestionRefresh(models.Model):
+    # Users whose follows changed since their suggestions were computed.
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+
+class StoredImage(models.Model):
+    # One row per distinct uploaded image, keyed by the SHA-256 of its content,
+    # so identical uploads share one stored file and one set of variants.
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    # JSON {variant: storage name}, like Discussion.image_variants.
+    variants = models.TextField(default='')
+    created_on = models.DateTimeField(default=timezone.now)
+    processed_on = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [models.Index(fields=['processed_on', 'id'])]
@@ -0,0 +1,151 @@
+import base64
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    # Rows are ordered newest first on (ordering_field, tiebreak_field). The
+    # tiebreak breaks ties between equal timestamps, so every row has a unique
+    # position and a page is always a single range scan starting right after the
+    # cursor, however deep.
+    ordering_field = 'created_on'
+    tiebreak_field = 'id'
+    cursor_query_param = 'cursor'
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_querysets([queryset], request, view=view)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        # Pages through several querysets that share the ordering columns as if
+        # they were one, e.g. a materialized timeline plus rows pulled live.
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+        self.reverse = self.cursor is not None and self.cursor[0] == 'p'
+
+        rows = {}
+        for queryset in querysets:
+            for row in self.get_window(queryset):
+                rows.setdefault(self.get_position(row), row)
+        rows = [rows[position] for position in sorted(rows, reverse=not self.reverse)]
+
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+
+        self.page = rows
+        if self.reverse:
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = self.cursor is not None, has_more
+        return rows
+
+    def get_window(self, queryset):
+        field, tiebreak = self.ordering_field, self.tiebreak_field
+        if self.cursor is not None:
+            direction, value, pk = self.cursor
+            lookup = 'gt' if self.reverse else 'lt'
+            queryset = queryset.filter(
+                Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'{tiebreak}__{lookup}': pk})
+            )
+
+        if self.reverse:
+            queryset = queryset.order_by(field, tiebreak)
+        else:
+            queryset = queryset.order_by(f'-{field}', f'-{tiebreak}')
+        return list(queryset[:self.page_size + 1])
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor('n', self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Paged past the end; step back from the position we were given.
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor('p', self.page[0])
+
+    def get_position(self, row):
+        if isinstance(row, dict):
+            return row[self.ordering_field], row[self.tiebreak_field]
+        return getattr(row, self.ordering_field), getattr(row, self.tiebreak_field)
+
+    def encode_cursor(self, direction, row):
+        value, pk = self.get_position(row)
+        raw = f'{direction}|{value.isoformat()}|{pk}'
+        token = base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(token.encode('ascii')).decode('ascii')
+            direction, value, pk = raw.split('|')
+            value = parse_datetime(value)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if direction not in ('n', 'p') or value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return direction, value, pk
+
+
+class FollowKeysetPagination(KeysetPagination):
+    ordering_field = 'created_at'
+
+
+class FeedPagination(KeysetPagination):
+    # Feed rows are keyed on the discussion they point at, so timeline entries
+    # and discussions pulled straight from followed authors page together.
+    tiebreak_field = 'discussion_id'
+
+
+class SearchPagination(PageNumberPagination):
+    # Ranked search results and cached id lists have no column to key on, so they
+    # are paged by position instead.
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,189 @@
+import logging
+import queue
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import follow_graph, suggestions, typeahead
+from .authentication import forget_user
+from .counters import adjust_counters
+from .models import (
+    User, Follow, Discussion, Comment, Like, CommentLike, Reply, DiscussionHashtag, TimelineEntry,
+    UserSearchKey, FollowSuggestion, PurgeJob,
+)
+from .response_cache import invalidate
+from .search import unindex_discussion
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = getattr(settings, 'PURGE_CHUNK_SIZE', 500)
+IN_PROCESS = getattr(settings, 'PURGE_IN_PROCESS', True)
+
+
+class Stage:
+    # Deletes the rows of `model` matching `condition(object_id)` (a dict of
+    # lookups), a chunk at a time. `counters` lists (model, foreign key, field)
+    # counters to decrement for each deleted row; `after(rows)` runs in the same
+    # transaction with the selected `fields`.
+    def __init__(self, name, model, condition, counters=(), after=None, fields=()):
+        self.name = name
+        self.model = model
+        self.condition = condition
+        self.counters = counters
+        self.after = after
+        self.fields = list(dict.fromkeys(['pk', *(fk for model, fk, field in counters), *fields]))
+
+    def select(self, object_id, chunk_size):
+        queryset = self.model._base_manager.filter(**self.condition(object_id))
+        return list(queryset.order_by('pk').values(*self.fields)[:chunk_size])
+
+    def delete(self, rows):
+        self.model._base_manager.filter(pk__in=[row['pk'] for row in rows]).delete()
+        for model, fk, field in self.counters:
+            adjust_counters(model, field, {pk: -n for pk, n in Counter(row[fk] for row in rows).items()})
+            if model is Discussion:
+                invalidate(*(f'discussion:{pk}' for pk in {row[fk] for row in rows}))
+        if self.after:
+            self.after(rows)
+
+
+class UnindexDiscussions(Stage):
+    # Removes a deleted user's discussions from the search index, which has to
+    # happen one discussion at a time.
+    def __init__(self):
+        super().__init__('unindex', Discussion, lambda pk: {'user_id': pk, 'search_document__isnull': False})
+
+    def select(self, object_id, chunk_size):
+        return list(Discussion.all_objects.filter(**self.condition(object_id)).order_by('pk')[:chunk_size])
+
+    def delete(self, discussions):
+        for discussion in discussions:
+            unindex_discussion(discussion)
+
+
+def _invalidate_follows(rows):
+    for row in rows:
+        follow_graph.invalidate(row['follower_id'], row['following_id'])
+    suggestions.mark_stale(row['follower_id'] for row in rows)
+
+
+def _discussion_stages(prefix, discussion):
+    # Dependents of the discussions matching the lookups `discussion(pk)`.
+    def via(path):
+        return lambda pk: {f'{path}__{lookup}': value for lookup, value in discussion(pk).items()}
+    return [
+        Stage(f'{prefix}timeline', TimelineEntry, via('discussion')),
+        Stage(f'{prefix}replies', Reply, via('comment__discussion')),
+        Stage(f'{prefix}comment_likes', CommentLike, via('comment__discussion')),
+        Stage(f'{prefix}comments', Comment, via('discussion')),
+        Stage(f'{prefix}likes', Like, via('discussion')),
+        Stage(f'{prefix}hashtags', DiscussionHashtag, via('discussion')),
+        Stage(f'{prefix}discussions', Discussion, discussion),
+    ]
+
+
+STAGES = {
+    'discussion': _discussion_stages('', lambda pk: {'pk': pk}),
+    'user': [UnindexDiscussions()] + _discussion_stages('discussion_', lambda pk: {'user_id': pk}) + [
+        Stage('home_timeline', TimelineEntry, lambda pk: {'user_id': pk}),
+        Stage('received_replies', Reply, lambda pk: {'comment__user_id': pk}),
+        Stage('received_comment_likes', CommentLike, lambda pk: {'comment__user_id': pk}),
+        Stage('replies', Reply, lambda pk: {'user_id': pk}, [(Comment, 'comment_id', 'reply_count')]),
+        Stage('comment_likes', CommentLike, lambda pk: {'user_id': pk}, [(Comment, 'comment_id', 'like_count')]),
+        Stage('comments', Comment, lambda pk: {'user_id': pk}, [(Discussion, 'discussion_id', 'comment_count')]),
+        Stage('likes', Like, lambda pk: {'user_id': pk}, [(Discussion, 'discussion_id', 'like_count')]),
+        Stage('following', Follow, lambda pk: {'follower_id': pk}, [(User, 'following_id', 'follower_count')],
+              _invalidate_follows, ['follower_id']),
+        Stage('followers', Follow, lambda pk: {'following_id': pk}, [(User, 'follower_id', 'following_count')],
+              _invalidate_follows, ['following_id']),
+        Stage('search_keys', UserSearchKey, lambda pk: {'user_id': pk}),
+        Stage('suggestions', FollowSuggestion, lambda pk: {'candidate_id': pk}),
+        Stage('user', User, lambda pk: {'pk': pk}),
+    ],
+}
+
+
+def soft_delete(instance):
+    # Hides a user or discussion immediately and queues the removal of its rows.
+    kind = 'user' if isinstance(instance, User) else 'discussion'
+    with transaction.atomic():
+        type(instance).all_objects.filter(pk=instance.pk).update(deleted_on=timezone.now())
+        if kind == 'discussion':
+            unindex_discussion(instance)
+            invalidate('discussions', f'discussion:{instance.pk}')
+        else:
+            Discussion.objects.filter(user=instance).update(deleted_on=timezone.now())
+            invalidate('users', 'discussions')
+            typeahead.forget_user(instance)
+            forget_user(instance.pk, revoke=True)
+        job = PurgeJob.objects.create(kind=kind, object_id=instance.pk)
+        if IN_PROCESS:
+            transaction.on_commit(lambda: purger.add(job.pk))
+    return job
+
+
+def run_chunk(job_id, chunk_size=CHUNK_SIZE):
+    # Deletes the next chunk of a job and records its progress in the same
+    # transaction, so a job interrupted at any point resumes where it stopped.
+    # Returns False once the job has finished.
+    with transaction.atomic():
+        job = PurgeJob.objects.select_for_update().get(pk=job_id)
+        if job.finished_on is not None:
+            return False
+        stages = STAGES[job.kind]
+        names = [stage.name for stage in stages]
+        position = names.index(job.stage) if job.stage in names else 0
+        for stage in stages[position:]:
+            rows = stage.select(job.object_id, chunk_size)
+            if rows:
+                stage.delete(rows)
+                job.stage = stage.name
+                job.deleted += len(rows)
+                job.error = ''
+                job.save(update_fields=['stage', 'deleted', 'error', 'updated_on'])
+                return True
+        job.stage = stages[-1].name
+        job.finished_on = timezone.now()
+        job.save(update_fields=['stage', 'finished_on', 'updated_on'])
+        return False
+
+
+def run_job(job_id, chunk_size=CHUNK_SIZE):
+    try:
+        while run_chunk(job_id, chunk_size):
+            pass
+    except Exception as e:
+        logger.exception('Purge job %s failed', job_id)
+        PurgeJob.objects.filter(pk=job_id).update(error=str(e), updated_on=timezone.now())
+        return False
+    return True
+
+
+class Purger:
+    # Runs queued purge jobs one at a time on a daemon thread. Jobs left
+    # unfinished when the process exits are resumed by `manage.py purge_deleted`.
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, job_id):
+        self.jobs.put(job_id)
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='purger', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            job_id = self.jobs.get()
+            close_old_connections()
+            run_job(job_id, self.chunk_size)
+
+
+purger = Purger()
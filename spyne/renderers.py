@@ -0,0 +1,87 @@
+import io
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework import parsers, renderers, status
+from rest_framework.response import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON is encoded and decoded with orjson when it's installed, else with the
+# json module exactly as DRF does. Either way the bytes are DRF's: datetimes,
+# dates, times, Decimals, UUIDs and the like go through DRF's encoder, and
+# anything orjson can't produce identically (non-string keys, integers wider
+# than 64 bits, indented output) is handed to DRF. The only difference is in
+# float formatting: orjson writes 1e16 and 1e-7 where json writes 1e+16 and
+# 1e-07, and NaN and infinities as null where DRF refuses them.
+STREAM_MIN_ITEMS = getattr(settings, 'JSON_STREAM_MIN_ITEMS', 1000)
+STREAM_CHUNK_SIZE = getattr(settings, 'JSON_STREAM_CHUNK_SIZE', 500)
+
+if orjson is not None:
+    OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or data is None or self.ensure_ascii or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Like DRF, so the output is also valid JavaScript.
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class JSONParser(parsers.JSONParser):
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # Invalid JSON, or numbers orjson doesn't take; DRF decides which
+            # and words the error.
+            return super().parse(io.BytesIO(body), media_type, parser_context)
+
+
+def _chunks(renderer, items):
+    yield b'['
+    for i in range(0, len(items), STREAM_CHUNK_SIZE):
+        if i:
+            yield b','
+        # Without the brackets, rendered lists concatenate into the whole list.
+        yield renderer.render(items[i:i + STREAM_CHUNK_SIZE])[1:-1]
+    yield b']'
+
+
+def streamed(response):
+    # A successful Response listing at least STREAM_MIN_ITEMS items, as a
+    # StreamingHttpResponse with the same body encoded STREAM_CHUNK_SIZE items
+    # at a time, so the whole body is never held in memory (twice, once
+    # compressed). Other responses are returned unchanged.
+    if not (
+        isinstance(response, Response) and response.status_code == status.HTTP_200_OK
+        and isinstance(response.data, list) and len(response.data) >= STREAM_MIN_ITEMS
+        and isinstance(getattr(response, 'accepted_renderer', None), JSONRenderer) and response.accepted_renderer.compact
+        and response.accepted_renderer.get_indent(response.accepted_media_type, response.renderer_context) is None
+    ):
+        return response
+    renderer = response.accepted_renderer
+    streaming = StreamingHttpResponse(_chunks(renderer, response.data), content_type=renderer.media_type)
+    for header, value in response.items():
+        if header.lower() != 'content-type':
+            streaming[header] = value
+    return streaming
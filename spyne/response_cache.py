@@ -0,0 +1,144 @@
+import functools
+import hashlib
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from backend.replicas import read_from_replica
+
+# Cached responses are keyed on the request URL plus the current version of
+# every tag they were built from, e.g. 'discussion:42' or 'users'. Writes bump
+# the versions of the tags they touch, which orphans the dependent entries
+# without having to know their keys; the backend evicts them in time. Tags only
+# known once the response is built, such as the discussions on a page of a
+# list, are stored with the entry along with their versions, and the entry is
+# discarded when it's next read if any of them has changed since.
+CACHE_ALIAS = getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_key(tag):
+    return f'spyne:tag:{tag}'
+
+
+def tag_versions(tags):
+    cache = get_cache()
+    keys = {tag: _version_key(tag) for tag in tags}
+    found = cache.get_many(keys.values())
+    versions = {}
+    for tag, key in keys.items():
+        if key not in found:
+            # Never start again from a counter that may have been seen before, or
+            # an evicted version could resurrect entries cached under it.
+            cache.add(key, uuid.uuid4().hex, None)
+            found[key] = cache.get(key)
+        versions[tag] = found[key]
+    return versions
+
+
+def invalidate(*tags):
+    keys = {_version_key(tag): uuid.uuid4().hex for tag in tags}
+    # After commit, so a concurrent read can't cache the pre-write state under
+    # the new version.
+    transaction.on_commit(lambda: get_cache().set_many(keys, None))
+
+
+def discussion_tags(rows):
+    # The tags of the discussions listed in a response, given as .values()
+    # rows, instances or ids, so that a like or comment on any of them
+    # invalidates it.
+    return [f"discussion:{row['id'] if isinstance(row, dict) else getattr(row, 'pk', row)}" for row in rows]
+
+
+def make_etag(data):
+    body = json.dumps(data, cls=JSONEncoder, sort_keys=True, separators=(',', ':'))
+    return '"%s"' % hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def _not_modified(request, etag, modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        # Compared weakly: compressed responses carry the ETag as W/"...".
+        tags = [value.strip() for value in if_none_match.split(',')]
+        return if_none_match.strip() == '*' or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and modified <= if_modified_since
+
+
+def _current(versions):
+    keys = {tag: _version_key(tag) for tag in versions}
+    found = get_cache().get_many(keys.values())
+    return all(found.get(keys[tag]) == version for tag, version in versions.items())
+
+
+def lookup(request, tags):
+    # The cache key of a request given the tags its response depends on, and
+    # the (data, etag, modified, versions) entry cached under it, if any.
+    tags = list(tags)
+    if request.query_params.get('expand'):
+        # Expanded users embed their names.
+        tags.append('users')
+    versions = tag_versions(tags)
+    # The full URL: responses hold absolute links (images, pages) to the host.
+    fingerprint = json.dumps([request.build_absolute_uri(), sorted(versions.items())])
+    key = 'spyne:response:' + hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+    entry = get_cache().get(key)
+    if entry is not None and entry[3] and not _current(entry[3]):
+        entry = None
+    return key, entry
+
+
+def store(key, data, tags=()):
+    # `tags` are the ones found while building the response.
+    entry = (data, make_etag(data), int(time.time()), tag_versions(tags) if tags else {})
+    # A lagging replica can build a response from before a write whose version
+    # bump is already visible; cached under the new versions, it would be served
+    # even to the writer, whose reads go to the primary. So only responses
+    # built from the primary are cached.
+    if not read_from_replica():
+        get_cache().set(key, entry)
+    return entry
+
+
+def respond(request, entry, response_class=Response):
+    data, etag, modified = entry[:3]
+    if _not_modified(request, etag, modified):
+        response = response_class(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = response_class(data)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def cache_response(tags):
+    # Caches the 200 responses of a DRF handler by URL, answers conditional GETs
+    # with 304 and sets ETag/Last-Modified. `tags` maps the handler's arguments to
+    # the invalidation tags the response depends on; the handler can add more
+    # as view.response_tags. Authentication and permission checks have already
+    # run when the handler is called, so cached data is never served to a client
+    # that couldn't have fetched it.
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            key, entry = lookup(request, tags(view, request, *args, **kwargs))
+            if entry is None:
+                response = handler(view, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                entry = store(key, response.data, getattr(view, 'response_tags', ()))
+            return respond(request, entry)
+        return wrapper
+    return decorator
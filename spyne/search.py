@@ -0,0 +1,285 @@
+import hashlib
+import heapq
+import math
+import re
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum, Count
+
+from .models import SearchTerm, SearchDocument, SearchPosting
+from . import response_cache
+
+TOKEN_RE = re.compile(r'\w+')
+QUERY_RE = re.compile(r'"([^"]*)"|(\w+)(\*?)')
+MAX_TERM_LENGTH = SearchTerm._meta.get_field('term').max_length
+
+# BM25 parameters.
+K1 = 1.2
+B = 0.75
+
+# A prefix query expands to at most this many of the most common matching terms.
+MAX_PREFIX_EXPANSIONS = 20
+
+# Only the best MAX_RESULTS matches of a query are ranked and cached. A clause
+# whose terms appear in more than MAX_POSTINGS documents (a common word) is
+# only matched in the newest MAX_POSTINGS of them, so no query reads or scores
+# the whole corpus.
+MAX_RESULTS = getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+MAX_POSTINGS = getattr(settings, 'SEARCH_MAX_POSTINGS', 20000)
+
+# Collection statistics (document count, average length) only shift the scores
+# slightly as the corpus grows, so they are recomputed at most this often.
+STATS_TTL = 300
+
+CHUNK_SIZE = 500
+
+_stats = {'expires': 0, 'documents': 0, 'average_length': 0.0}
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall((text or '').lower()) if len(token) <= MAX_TERM_LENGTH]
+
+
+def _chunks(values, size=CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _positions(tokens):
+    positions = defaultdict(list)
+    for position, token in enumerate(tokens):
+        positions[token].append(position)
+    return positions
+
+
+def _term_ids(terms):
+    SearchTerm.objects.bulk_create([SearchTerm(term=term) for term in terms], ignore_conflicts=True)
+    return dict(SearchTerm.objects.filter(term__in=terms).values_list('term', 'id'))
+
+
+def index_discussion(discussion):
+    positions = _positions(tokenize(discussion.text))
+    with transaction.atomic():
+        old_ids = set(SearchPosting.objects.filter(discussion=discussion).values_list('term_id', flat=True))
+        SearchPosting.objects.filter(discussion=discussion).delete()
+
+        term_ids = _term_ids(list(positions))
+        new_ids = set(term_ids.values())
+        SearchTerm.objects.filter(id__in=old_ids - new_ids).update(document_count=F('document_count') - 1)
+        SearchTerm.objects.filter(id__in=new_ids - old_ids).update(document_count=F('document_count') + 1)
+
+        SearchPosting.objects.bulk_create([
+            SearchPosting(
+                term_id=term_ids[term], discussion=discussion,
+                frequency=len(offsets), positions=' '.join(map(str, offsets)),
+            )
+            for term, offsets in positions.items()
+        ])
+        SearchDocument.objects.update_or_create(
+            discussion=discussion, defaults={'length': sum(len(offsets) for offsets in positions.values())},
+        )
+
+
+def unindex_discussion(discussion):
+    with transaction.atomic():
+        term_ids = list(SearchPosting.objects.filter(discussion=discussion).values_list('term_id', flat=True))
+        SearchTerm.objects.filter(id__in=term_ids, document_count__gt=0).update(document_count=F('document_count') - 1)
+        SearchPosting.objects.filter(discussion=discussion).delete()
+        SearchDocument.objects.filter(discussion=discussion).delete()
+
+
+def rebuild_index(discussions, chunk_size=1000):
+    # Drops and rebuilds the whole index from an iterable of (id, text) rows.
+    SearchPosting.objects.all().delete()
+    SearchDocument.objects.all().delete()
+    SearchTerm.objects.all().delete()
+
+    indexed = 0
+    for rows in _chunks(discussions, chunk_size):
+        parsed = {pk: _positions(tokenize(text)) for pk, text in rows}
+        with transaction.atomic():
+            term_ids = _term_ids({term for positions in parsed.values() for term in positions})
+            SearchPosting.objects.bulk_create([
+                SearchPosting(
+                    term_id=term_ids[term], discussion_id=pk,
+                    frequency=len(offsets), positions=' '.join(map(str, offsets)),
+                )
+                for pk, positions in parsed.items() for term, offsets in positions.items()
+            ])
+            SearchDocument.objects.bulk_create([
+                SearchDocument(discussion_id=pk, length=sum(len(offsets) for offsets in positions.values()))
+                for pk, positions in parsed.items()
+            ])
+        indexed += len(rows)
+        yield indexed
+
+    for term_ids in _chunks(SearchTerm.objects.values_list('id', flat=True).iterator()):
+        counts = dict(
+            SearchPosting.objects.filter(term_id__in=term_ids).order_by()
+            .values_list('term_id').annotate(n=Count('id'))
+        )
+        SearchTerm.objects.bulk_update(
+            [SearchTerm(id=term_id, document_count=counts.get(term_id, 0)) for term_id in term_ids],
+            ['document_count'],
+        )
+    _stats['expires'] = 0
+
+
+def collection_stats():
+    now = time.monotonic()
+    if _stats['expires'] <= now:
+        aggregate = SearchDocument.objects.aggregate(documents=Count('pk'), length=Sum('length'))
+        documents = aggregate['documents'] or 0
+        _stats.update(
+            expires=now + STATS_TTL,
+            documents=documents,
+            average_length=(aggregate['length'] or 0) / documents if documents else 0.0,
+        )
+    return _stats['documents'], _stats['average_length']
+
+
+def parse_query(query):
+    # Returns a list of (kind, tokens) clauses: 'term', 'prefix' or 'phrase'.
+    clauses = []
+    for phrase, word, star in QUERY_RE.findall(query or ''):
+        if phrase:
+            tokens = tokenize(phrase)
+            if len(tokens) > 1:
+                clauses.append(('phrase', tokens))
+            elif tokens:
+                clauses.append(('term', tokens))
+        else:
+            tokens = tokenize(word)
+            if tokens:
+                clauses.append(('prefix' if star else 'term', tokens))
+    return clauses
+
+
+def _resolve(clauses):
+    # Maps each clause to {term id: document count}. Returns None if a clause can't match.
+    exact = {token for kind, tokens in clauses if kind != 'prefix' for token in tokens}
+    terms = {
+        term: (term_id, document_count)
+        for term, term_id, document_count in SearchTerm.objects.filter(term__in=exact)
+        .values_list('term', 'id', 'document_count')
+    }
+    resolved = []
+    for kind, tokens in clauses:
+        if kind == 'prefix':
+            expansions = dict(
+                SearchTerm.objects.filter(term__startswith=tokens[0], document_count__gt=0)
+                .order_by('-document_count').values_list('id', 'document_count')[:MAX_PREFIX_EXPANSIONS]
+            )
+            if not expansions:
+                return None
+            resolved.append((kind, [expansions]))
+        else:
+            if any(token not in terms for token in tokens):
+                return None
+            resolved.append((kind, [dict([terms[token]]) for token in tokens]))
+    return resolved
+
+
+def _has_phrase(postings, term_ids):
+    starts = {int(p) for p in postings[term_ids[0]][1].split()}
+    for offset, term_id in enumerate(term_ids[1:], 1):
+        starts &= {int(p) - offset for p in postings[term_id][1].split()}
+        if not starts:
+            return False
+    return True
+
+
+def search(query, queryset):
+    # Returns [(discussion id, score)] for the best MAX_RESULTS discussions in
+    # `queryset` matching every clause of `query`, best BM25 score first. Clauses
+    # are plain terms, prefixes (`term*`) and quoted phrases.
+    resolved = _resolve(parse_query(query))
+    if not resolved:
+        return []
+
+    # Walk clauses from the rarest, so later posting lists are only read for the
+    # documents that are still candidates.
+    resolved.sort(key=lambda clause: sum(sum(group.values()) for group in clause[1]))
+    postings = defaultdict(dict)
+    document_counts = {}
+    candidates = None
+    for kind, groups in resolved:
+        term_ids = [term_id for group in groups for term_id in group]
+        for group in groups:
+            document_counts.update(group)
+
+        if candidates is None:
+            batch = SearchPosting.objects.filter(term_id__in=term_ids)
+            if sum(sum(group.values()) for group in groups) > MAX_POSTINGS:
+                # Newest first along the (term, discussion) unique index.
+                batch = batch.order_by('-discussion_id')[:MAX_POSTINGS]
+            batches = [batch]
+        else:
+            batches = [
+                SearchPosting.objects.filter(term_id__in=term_ids, discussion_id__in=chunk)
+                for chunk in _chunks(candidates)
+            ]
+        # Positions are only needed, and only read, to match phrases.
+        fields = ['discussion_id', 'term_id', 'frequency'] + (['positions'] if kind == 'phrase' else [])
+        matched = defaultdict(dict)
+        for batch in batches:
+            for discussion_id, term_id, frequency, *positions in batch.values_list(*fields):
+                matched[discussion_id][term_id] = (frequency, positions[0] if positions else None)
+
+        if kind == 'phrase':
+            phrase = [next(iter(group)) for group in groups]
+            matched = {
+                discussion_id: found for discussion_id, found in matched.items()
+                if len(found) == len(set(phrase)) and _has_phrase(found, phrase)
+            }
+
+        for discussion_id, found in matched.items():
+            postings[discussion_id].update(found)
+        candidates = set(matched) if candidates is None else candidates & set(matched)
+        if not candidates:
+            return []
+
+    allowed = set()
+    lengths = {}
+    for chunk in _chunks(candidates):
+        allowed.update(queryset.filter(id__in=chunk).values_list('id', flat=True))
+        lengths.update(SearchDocument.objects.filter(discussion_id__in=chunk).values_list('discussion_id', 'length'))
+
+    documents, average_length = collection_stats()
+    documents = max(documents, len(allowed))
+    average_length = average_length or 1.0
+    idf = {
+        term_id: math.log(1 + (documents - count + 0.5) / (count + 0.5))
+        for term_id, count in document_counts.items()
+    }
+
+    def score(discussion_id):
+        norm = K1 * (1 - B + B * lengths.get(discussion_id, 0) / average_length)
+        return sum(
+            idf[term_id] * frequency * (K1 + 1) / (frequency + norm)
+            for term_id, (frequency, positions) in postings[discussion_id].items()
+        )
+
+    ranked = ((discussion_id, score(discussion_id)) for discussion_id in allowed)
+    return heapq.nsmallest(MAX_RESULTS, ranked, key=lambda item: (-item[1], -item[0]))
+
+
+def ranked_ids(query, queryset):
+    # The (at most MAX_RESULTS) ids search() ranks, cached until a discussion
+    # is created, edited or deleted, so paging through the results of a query ranks them once rather
+    # than once per page. Likes and views don't change the ranking.
+    if queryset.query.is_empty():
+        return []
+    version = response_cache.tag_versions(['discussions'])['discussions']
+    fingerprint = '\n'.join([version, query, str(queryset.query)])
+    key = 'spyne:search:' + hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+    cache = response_cache.get_cache()
+    ids = cache.get(key)
+    if ids is None:
+        ids = [discussion_id for discussion_id, score in search(query, queryset)]
+        cache.set(key, ids)
+    return ids
@@ -1,8 +1,67 @@
+import json
+
+from django.core.files.storage import default_storage
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+from backend.metrics import TimedSerializerMixin
 from .models import User, Discussion, Follow, Comment, Like, CommentLike, Reply
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from . import images, logins
+from .hashtags import set_discussion_hashtags
+from .search import index_discussion
+from .typeahead import index_users
+
+def _requested(param, path, leaf):
+    # Names in a comma-separated list of dotted paths that apply to the
+    # serializer at `path`: its own fields, or with leaf=False also the
+    # nested serializers leading to deeper names.
+    prefix = f'{path}.' if path else ''
+    names = set()
+    for item in (param or '').split(','):
+        item = item.strip()
+        if item.startswith(prefix) and item != prefix:
+            name, dot, rest = item[len(prefix):].partition('.')
+            if not (leaf and dot):
+                names.add(name)
+    return names
+
+class SparseFieldsetMixin:
+    # On GET requests ?fields=id,text,comments.id trims the response to the
+    # named fields, and ?expand=user replaces the user id with the user from
+    # expandable_fields. Nested serializers are addressed by their dotted path.
+    expandable_fields = {}
+
+    def get_path(self):
+        names = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return '.'.join(reversed(names))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return fields
+        path = self.get_path()
+        for name in _requested(request.query_params.get('expand'), path, leaf=True):
+            if name not in self.expandable_fields:
+                raise serializers.ValidationError({'error': f"Cannot expand '{'.'.join(filter(None, [path, name]))}'"})
+            fields[name] = self.expandable_fields[name](read_only=True)
+        requested = _requested(request.query_params.get('fields'), path, leaf=False)
+        if requested:
+            unknown = requested - fields.keys()
+            if unknown:
+                names = ', '.join(sorted('.'.join(filter(None, [path, name])) for name in unknown))
+                raise serializers.ValidationError({'error': f'Unknown fields: {names}'})
+            for name in list(fields):
+                if name not in requested:
+                    fields.pop(name)
+        return fields
 
 class CustomTokenObtainSerializer(serializers.Serializer):
     email = serializers.EmailField()
@@ -12,7 +71,7 @@ class CustomTokenObtainSerializer(serializers.Serializer):
         email = data.get('email')
         password = data.get('password')
 
-        user = authenticate(email=email, password=password)
+        user = logins.authenticate(email, password)
         if user is None:
             raise serializers.ValidationError('Invalid login credentials')
 
@@ -22,25 +81,43 @@ class CustomTokenObtainSerializer(serializers.Serializer):
             'access': str(refresh.access_token),
         }
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSummarySerializer(TimedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'name']
+
+class UserSerializer(TimedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'name', 'mobile', 'email', 'password']
-        extra_kwargs = {'password': {'write_only': True}}
+        extra_kwargs = {
+            'password': {'write_only': True},
+            # A deleted user keeps their email until the purge removes the row.
+            'email': {'validators': [UniqueValidator(queryset=User.all_objects.all())]},
+        }
 
     def create(self, validated_data):
-        user = User.objects.create_user(**validated_data)
+        with transaction.atomic():
+            user = User.objects.create_user(**validated_data)
+            index_users([user])
         return user
 
     def update(self, instance, validated_data):
         password = validated_data.pop('password', None)
-        instance = super().update(instance, validated_data)
-        if password:
-            instance.password = make_password(password)
-            instance.save()
+        with transaction.atomic():
+            reindex = any(
+                field in validated_data and validated_data[field] != getattr(instance, field)
+                for field in ('name', 'email')
+            )
+            instance = super().update(instance, validated_data)
+            if password:
+                instance.password = make_password(password)
+                instance.save()
+            if reindex:
+                index_users([instance])
         return instance
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(TimedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     follower = UserSerializer(read_only=True)
     following = UserSerializer(read_only=True)
 
@@ -48,10 +125,14 @@ class FollowSerializer(serializers.ModelSerializer):
         model = Follow
         fields = ['id', 'follower', 'following', 'created_at']
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(TimedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    expandable_fields = {'user': UserSummarySerializer}
+    likes = serializers.IntegerField(source='like_count', read_only=True)
+    replies = serializers.IntegerField(source='reply_count', read_only=True)
+
     class Meta:
         model = Comment
-        fields = ['id', 'user', 'discussion', 'text', 'created_on']
+        fields = ['id', 'user', 'discussion', 'text', 'created_on', 'likes', 'replies']
         read_only_fields = ['user']
 
     def create(self, validated_data):
@@ -59,21 +140,79 @@ class CommentSerializer(serializers.ModelSerializer):
         comment = Comment.objects.create(user=user, **validated_data)
         return comment
 
-class DiscussionSerializer(serializers.ModelSerializer):
+class ImageVariantsField(serializers.Field):
+    # {variant: url} from a JSON {variant: storage name}, with absolute urls
+    # like ImageField's when there is a request.
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        request = self.context.get('request')
+        urls = {}
+        for variant, name in json.loads(value).items():
+            url = default_storage.url(name)
+            urls[variant] = request.build_absolute_uri(url) if request is not None else url
+        return urls
+
+class DiscussionSerializer(TimedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    expandable_fields = {'user': UserSummarySerializer}
     comments = CommentSerializer(many=True, read_only=True)
-    likes = serializers.IntegerField(source='likes.count', read_only=True)
+    likes = serializers.IntegerField(source='like_count', read_only=True)
+    # The original and its resized copies; thumbnail and medium appear once
+    # they are rendered.
+    images = ImageVariantsField(source='image_variants')
 
     class Meta:
         model = Discussion
-        fields = ['id', 'user', 'text', 'image', 'hashtags', 'created_on', 'views', 'likes', 'comments']
+        fields = ['id', 'user', 'text', 'image', 'images', 'hashtags', 'created_on', 'views', 'likes', 'comments']
         read_only_fields = ['user', 'views']
 
+    def get_fields(self):
+        fields = super().get_fields()
+        # ?comments=false leaves out the embedded comments; page through them
+        # with the thread endpoint instead.
+        request = self.context.get('request')
+        if request is not None and request.query_params.get('comments') in ('0', 'false'):
+            fields.pop('comments', None)
+        return fields
+
+    def store_image(self, validated_data):
+        # Replaces an upload with its content-addressed copy (see spyne/images.py).
+        if validated_data.get('image') is None:
+            if 'image' in validated_data:
+                validated_data['image_variants'] = ''
+            return None
+        stored = images.store(validated_data['image'])
+        validated_data['image'] = stored.name
+        validated_data['image_variants'] = stored.variants
+        if stored.processed_on is None:
+            images.process_on_commit(stored)
+        return stored
+
     def create(self, validated_data):
         user = self.context['request'].user
-        discussion = Discussion.objects.create(user=user, **validated_data)
+        with transaction.atomic():
+            self.store_image(validated_data)
+            discussion = Discussion.objects.create(user=user, **validated_data)
+            set_discussion_hashtags(discussion)
+            index_discussion(discussion)
         return discussion
 
-class LikeSerializer(serializers.ModelSerializer):
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            self.store_image(validated_data)
+            instance = super().update(instance, validated_data)
+            if 'hashtags' in validated_data:
+                set_discussion_hashtags(instance)
+            if 'text' in validated_data:
+                index_discussion(instance)
+        return instance
+
+class LikeSerializer(TimedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    expandable_fields = {'user': UserSummarySerializer}
     class Meta:
         model = Like
         fields = ['id', 'user', 'discussion', 'created_on']
@@ -84,7 +223,8 @@ class LikeSerializer(serializers.ModelSerializer):
         like = Like.objects.create(user=user, **validated_data)
         return like
 
-class CommentLikeSerializer(serializers.ModelSerializer):
+class CommentLikeSerializer(TimedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    expandable_fields = {'user': UserSummarySerializer}
     class Meta:
         model = CommentLike
         fields = ['id', 'user', 'comment', 'created_on']
@@ -95,7 +235,8 @@ class CommentLikeSerializer(serializers.ModelSerializer):
         comment_like = CommentLike.objects.create(user=user, **validated_data)
         return comment_like
 
-class ReplySerializer(serializers.ModelSerializer):
+class ReplySerializer(TimedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    expandable_fields = {'user': UserSummarySerializer}
     class Meta:
         model = Reply
         fields = ['id', 'user', 'comment', 'text', 'created_on']
@@ -105,3 +246,9 @@ class ReplySerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         reply = Reply.objects.create(user=user, **validated_data)
         return reply
+
+class ThreadCommentSerializer(CommentSerializer):
+    first_replies = ReplySerializer(many=True, read_only=True)
+
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['first_replies']
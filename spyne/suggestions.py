@@ -0,0 +1,160 @@
+import heapq
+import math
+import os
+from array import array
+from collections import defaultdict
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Max
+
+from .models import User, Follow, FollowSuggestion, SuggestionRefresh
+
+SIZE = getattr(settings, 'SUGGESTIONS_SIZE', 50)
+POPULARITY_WEIGHT = getattr(settings, 'SUGGESTIONS_POPULARITY_WEIGHT', 0.25)
+PROCESSES = getattr(settings, 'SUGGESTIONS_PROCESSES', None)
+
+# Users ranked per worker task, and suggestions written per transaction.
+CHUNK_SIZE = 500
+
+
+class Graph:
+    # The follow graph in compressed sparse row form over dense user indices:
+    # the users followed by user i are indices[indptr[i]:indptr[i + 1]].
+    # Compact enough to ship to worker processes whole.
+    def __init__(self, ids, popularity, indptr, indices, popular):
+        self.ids = ids
+        self.popularity = popularity
+        self.indptr = indptr
+        self.indices = indices
+        # The most followed users, for filling up short lists.
+        self.popular = popular
+
+    def following(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+
+def mark_stale(user_ids):
+    # Queues users whose follows changed for the next incremental refresh.
+    SuggestionRefresh.objects.bulk_create([SuggestionRefresh(user_id=pk) for pk in set(user_ids)])
+
+
+def _edges(followers=None):
+    follows = Follow.objects.order_by('follower_id', 'following_id').values_list('follower_id', 'following_id')
+    if followers is None:
+        return follows.iterator(chunk_size=10000)
+    return [edge for chunk in _chunks(sorted(followers)) for edge in follows.filter(follower_id__in=chunk)]
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def load_graph(user_ids=None):
+    # Returns the graph and its {user id: index}. With user_ids, only the part
+    # needed to rank candidates for them is loaded: their follows and the
+    # follows of everyone they follow.
+    users = User.objects.filter(is_active=True)
+    popular = list(users.order_by('-follower_count', 'id').values_list('id', 'follower_count')[:2 * SIZE])
+    if user_ids is None:
+        counts = dict(users.values_list('id', 'follower_count').iterator(chunk_size=10000))
+        edges = _edges()
+    else:
+        first = _edges(user_ids)
+        edges = sorted(set(first + _edges({following for follower, following in first} - set(user_ids))))
+        ids = list({pk for edge in edges for pk in edge} | set(user_ids))
+        counts = {}
+        for chunk in _chunks(ids):
+            counts.update(users.filter(id__in=chunk).values_list('id', 'follower_count'))
+    counts.update(popular)
+
+    ids = array('q', sorted(counts))
+    index = {pk: i for i, pk in enumerate(ids)}
+    popularity = array('d', (math.log2(1 + counts[pk]) for pk in ids))
+    indptr = array('q', bytes(8 * (len(ids) + 1)))
+    indices = array('q')
+    for follower, following in edges:
+        if follower in index and following in index:
+            indices.append(index[following])
+            indptr[index[follower] + 1] += 1
+    for i in range(len(ids)):
+        indptr[i + 1] += indptr[i]
+    return Graph(ids, popularity, indptr, indices, array('q', (index[pk] for pk, count in popular))), index
+
+
+def rank(graph, i):
+    # Returns [(candidate index, mutuals, score)], best first: users followed
+    # by the users i follows, scored by how many of them follow the candidate
+    # plus a weight for the candidate's own popularity.
+    followed = set(graph.following(i))
+    mutuals = defaultdict(int)
+    for j in followed:
+        for k in graph.following(j):
+            mutuals[k] += 1
+    for k in followed | {i}:
+        mutuals.pop(k, None)
+    for k in graph.popular:
+        if len(mutuals) >= SIZE:
+            break
+        if k not in followed and k != i:
+            mutuals.setdefault(k, 0)
+    best = heapq.nlargest(SIZE, (
+        (count + POPULARITY_WEIGHT * graph.popularity[k], count, -graph.ids[k], k) for k, count in mutuals.items()
+    ))
+    return [(k, count, score) for score, count, negative_id, k in best]
+
+
+_graph = None
+
+
+def _init_worker(graph):
+    global _graph
+    _graph = graph
+
+
+def _rank_chunk(targets):
+    return [(i, rank(_graph, i)) for i in targets]
+
+
+def _rank_all(graph, targets, processes):
+    chunks = list(_chunks(targets))
+    if processes == 1 or len(chunks) <= 1:
+        _init_worker(graph)
+        yield from map(_rank_chunk, chunks)
+        return
+    # Workers only see the graph; close the connections so no child inherits them.
+    connections.close_all()
+    with Pool(processes, initializer=_init_worker, initargs=(graph,)) as pool:
+        yield from pool.imap_unordered(_rank_chunk, chunks)
+
+
+def _store(graph, results):
+    with transaction.atomic():
+        FollowSuggestion.objects.filter(user_id__in=[graph.ids[i] for i, ranked in results]).delete()
+        FollowSuggestion.objects.bulk_create([
+            FollowSuggestion(user_id=graph.ids[i], candidate_id=graph.ids[k], rank=position, mutuals=count, score=score)
+            for i, ranked in results
+            for position, (k, count, score) in enumerate(ranked, 1)
+        ])
+
+
+def refresh(full=False, processes=PROCESSES):
+    # Recomputes the suggestions of every user, or of the users queued by
+    # mark_stale since the last run. Returns the number of users refreshed.
+    last = SuggestionRefresh.objects.aggregate(last=Max('id'))['last'] or 0
+    if full:
+        graph, index = load_graph()
+        targets = list(range(len(graph.ids)))
+    else:
+        stale = set(SuggestionRefresh.objects.filter(id__lte=last).values_list('user_id', flat=True))
+        if not stale:
+            return 0
+        graph, index = load_graph(stale)
+        targets = [index[pk] for pk in stale if pk in index]
+        FollowSuggestion.objects.filter(user_id__in=stale - index.keys()).delete()
+    for results in _rank_all(graph, targets, processes or os.cpu_count() or 1):
+        _store(graph, results)
+    SuggestionRefresh.objects.filter(id__lte=last).delete()
+    return len(targets)
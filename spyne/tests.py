@@ -1,3 +1,1737 @@
-from django.test import TestCase
+import base64
+import datetime as dt
+import decimal
+import gzip
+import io
+import json
+import math
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import AuthenticationFailed, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from backend import compression, metrics, replicas
+from backend.asgi import AsyncReadHandler
+from backend.replicas import ReplicaMiddleware, ReplicaPool, pool, use_primary
+from . import (
+    authentication, batch, export, feed, follow_graph, images, logins, purge, renderers, suggestions, trending, typeahead,
+)
+from . import search as search_module
+from .async_views import db
+from .counters import adjust_counter, adjust_counters
+from .feed import BACKFILL_SIZE
+from .hashtags import parse_hashtags, set_discussion_hashtags
+from .models import (
+    User, Follow, Discussion, Comment, Like, CommentLike, Reply, Hashtag, DiscussionHashtag, StoredImage, ViewDelta,
+    TimelineEntry, FanOutJob, TrendingScore, TrendingSnapshot, TrendingState, UserSearchKey, FollowSuggestion,
+    PurgeJob, SuggestionRefresh,
+)
+from .search import index_discussion
+from .serializers import DiscussionSerializer
+from .threads import attach_first_replies
+from .viewcounts import ViewCountBuffer, view_counts
+
+
+# The tests flush view buffers themselves; a flusher thread started by a view
+# would write the views counted in one test into whichever test runs seconds
+# later, e.g. while it holds the in-memory database's write lock.
+no_flusher = mock.patch.object(view_counts, 'start')
+
+
+def setUpModule():
+    no_flusher.start()
+
+
+def tearDownModule():
+    no_flusher.stop()
+    # Views counted by the tests must not be flushed at exit, by which time
+    # the test database is gone and the real one is configured again.
+    view_counts.clear()
+
+
+class HotPathIndexTests(TestCase):
+    # Each test checks that the query a view runs is planned against the
+    # composite index added for it rather than a lone foreign key index.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(email=f'user{i}@example.com', password='pw', name=f'User {i}', mobile='1')
+            for i in range(5)
+        ]
+        cls.discussions = [
+            Discussion.objects.create(user=user, text=f'discussion {i}') for i, user in enumerate(cls.users * 2)
+        ]
+        cls.comments = [
+            Comment.objects.create(user=cls.users[i % 5], discussion=discussion, text='comment')
+            for i, discussion in enumerate(cls.discussions)
+        ]
+        for user in cls.users:
+            for other in cls.users:
+                if user != other:
+                    Follow.objects.create(follower=user, following=other)
+            Like.objects.create(user=user, discussion=cls.discussions[0])
+            CommentLike.objects.create(user=user, comment=cls.comments[0])
+        with connection.cursor() as cursor:
+            if connection.vendor in ('sqlite', 'postgresql'):
+                cursor.execute('ANALYZE')
+
+    def index_names(self, table, columns):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                # Unique constraints are backed by sqlite_autoindex_* indexes,
+                # which introspection reports under the constraint's name.
+                cursor.execute(f'PRAGMA index_list({table})')
+                names = []
+                for name in [row[1] for row in cursor.fetchall()]:
+                    cursor.execute(f'PRAGMA index_info({name})')
+                    if [row[2] for row in cursor.fetchall()] == columns:
+                        names.append(name)
+                return names
+            constraints = connection.introspection.get_constraints(cursor, table)
+        return [
+            name for name, info in constraints.items()
+            if (info['index'] or info['unique']) and info['columns'] == columns
+        ]
+
+    def assertUsesIndex(self, queryset, *columns):
+        table = queryset.model._meta.db_table
+        names = self.index_names(table, list(columns))
+        self.assertTrue(names, f'No index on {table}({", ".join(columns)})')
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in names), f'Expected one of {names} in:\n{plan}')
+
+    def test_like_lookup(self):
+        queryset = Like.objects.filter(discussion=self.discussions[0], user=self.users[0])
+        self.assertUsesIndex(queryset, 'discussion_id', 'user_id')
+
+    def test_comment_like_lookup(self):
+        queryset = CommentLike.objects.filter(comment=self.comments[0], user=self.users[0])
+        self.assertUsesIndex(queryset, 'comment_id', 'user_id')
+
+    def test_followers_list(self):
+        queryset = (
+            Follow.objects.filter(following=self.users[0])
+            .order_by('-created_at', '-id')
+            .values('id', 'created_at', 'follower_id')[:20]
+        )
+        self.assertUsesIndex(queryset, 'following_id', 'created_at')
+
+    def test_author_discussions(self):
+        queryset = Discussion.objects.filter(user=self.users[0]).order_by('-created_on', '-id')[:BACKFILL_SIZE]
+        self.assertUsesIndex(queryset, 'user_id', 'created_on')
+
+    def test_discussion_comments(self):
+        queryset = Comment.objects.filter(discussion=self.discussions[0]).order_by('created_on', 'id')[:20]
+        self.assertUsesIndex(queryset, 'discussion_id', 'created_on')
+
+    def test_duplicate_like_rejected(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Like.objects.create(user=self.users[0], discussion=self.discussions[0])
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    # Not a TestCase: reads inside a transaction on the primary never go to a replica.
+    # The replica is a fake alias: routing picks a database without connecting to it.
+    def setUp(self):
+        self.user = User.objects.create_user(email='reader@example.com', password='pw', name='Reader', mobile='1')
+        self.auth = f'Bearer {AccessToken.for_user(self.user)}'
+        self.pool = ReplicaPool(['fake-replica'], 10, None)
+        self.addCleanup(self.pool.prober.shutdown)
+        self.check = mock.patch.object(self.pool, 'check', return_value=True).start()
+        mock.patch('backend.replicas.pool', self.pool).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def tearDown(self):
+        caches[replicas.PIN_CACHE_ALIAS].clear()
+
+    def route(self, method, primary=False, **headers):
+        # Returns the database the view's reads were sent to.
+        seen = {}
+
+        def read(request):
+            seen['db'] = Discussion.objects.all().db
+            if request.method == 'POST':
+                Discussion.objects.create(user=self.user, text='written')
+            return HttpResponse()
+
+        view = use_primary(read) if primary else read
+        middleware = ReplicaMiddleware(lambda request: middleware.process_view(request, view, (), {}) or view(request))
+        middleware(getattr(RequestFactory(), method)('/', **headers))
+        return seen['db']
+
+    def test_reads_use_replica(self):
+        self.assertEqual(self.route('get', HTTP_AUTHORIZATION=self.auth), 'fake-replica')
+
+    def test_writes_use_primary(self):
+        self.assertEqual(self.route('post', HTTP_AUTHORIZATION=self.auth), 'default')
+
+    def test_reads_stick_to_primary_after_write(self):
+        self.route('post', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(self.route('get', HTTP_AUTHORIZATION=self.auth), 'default')
+        self.assertEqual(self.route('get'), 'fake-replica')
+
+    def test_use_primary_view(self):
+        self.assertEqual(self.route('get', primary=True), 'default')
+
+    def test_ejected_replicas_are_skipped(self):
+        self.pool.eject('fake-replica')
+        self.assertEqual(self.route('get'), 'default')
+
+    def test_probes_run_in_the_background(self):
+        threads = []
+        self.check.side_effect = lambda alias: threads.append(threading.current_thread().name) or False
+        # A replica not probed yet is used while its first probe runs.
+        self.assertEqual(self.route('get'), 'fake-replica')
+        self.pool.prober.shutdown()
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('replica-health'))
+        self.assertEqual(self.route('get'), 'default')
+        self.assertEqual(len(threads), 1)
+
+    def test_due_probe_keeps_last_result_until_done(self):
+        self.pool.health['fake-replica'] = (False, time.monotonic() - 1)
+        self.assertEqual(self.route('get'), 'default')
+        self.pool.prober.shutdown()
+        self.check.assert_called_once_with('fake-replica')
+        self.assertEqual(self.route('get'), 'fake-replica')
+
+    def test_replica_reads_are_not_cached(self):
+        # The "replica" is the primary itself, made to lag by hand.
+        self.pool.aliases = ['default']
+        discussion = Discussion.objects.create(user=self.user, text='old')
+        url = f'/api/v1/discussions/{discussion.pk}/'
+        response = self.client.patch(url, {'text': 'new'}, HTTP_AUTHORIZATION=self.auth, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        other = User.objects.create_user(email='other@example.com', password='pw', name='Other', mobile='2')
+        # Another client reads from a replica that hasn't replayed the write.
+        Discussion.objects.filter(pk=discussion.pk).update(text='old')
+        response = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(other)}')
+        self.assertEqual(response.json()['text'], 'old')
+        Discussion.objects.filter(pk=discussion.pk).update(text='new')
+        # The writer is pinned to the primary and reads its own write.
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=self.auth).json()['text'], 'new')
+
+    def test_process_local_pin_cache_warns(self):
+        with self.assertLogs('backend.replicas', 'WARNING'):
+            replicas.check_pin_cache(self.pool.aliases)
+        shared = {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache'}
+        with mock.patch.dict(settings.CACHES, {replicas.PIN_CACHE_ALIAS: shared}):
+            with mock.patch.object(replicas.logger, 'warning') as warning:
+                replicas.check_pin_cache(self.pool.aliases)
+        warning.assert_not_called()
+
+
+@skipUnless(settings.DATABASE_REPLICAS, 'needs a replica alias in DATABASES, e.g. a second SQLite alias')
+class ReplicaQueryTests(TransactionTestCase):
+    databases = '__all__'
+
+    def tearDown(self):
+        pool.health.clear()
+
+    def test_reads_from_replica(self):
+        user = User.objects.create_user(email='reader@example.com', password='pw', name='Reader', mobile='1')
+        Discussion.objects.create(user=user, text='mirrored')
+
+        def read(request):
+            discussions = Discussion.objects.all()
+            return HttpResponse(f'{discussions.db}:{discussions.count()}')
+
+        response = ReplicaMiddleware(read)(RequestFactory().get('/'))
+        self.assertIn(response.content.decode(), [f'{alias}:1' for alias in settings.DATABASE_REPLICAS])
+
+
+class FastPathTests(TestCase):
+    # List responses rendered from .values() rows must be byte-identical to
+    # the serializer output they replace.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(email=f'user{i}@example.com', password='pw', name=f'User {i}', mobile='1')
+            for i in range(3)
+        ]
+        for i, user in enumerate(cls.users):
+            discussion = Discussion.objects.create(
+                user=user, text=f'discussion {i}', hashtags='#a', image='images/a.png' if i else None,
+            )
+            for other in cls.users:
+                comment = Comment.objects.create(user=other, discussion=discussion, text=f'comment by {other.name}')
+                Reply.objects.create(user=user, comment=comment, text='reply')
+                Like.objects.create(user=other, discussion=discussion)
+                CommentLike.objects.create(user=user, comment=comment)
+                if other != user:
+                    Follow.objects.create(follower=user, following=other)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def get(self, url, fast=True):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        if fast:
+            return self.client.get(url)
+        with mock.patch('spyne.views.fastpath.compile', return_value=None):
+            return self.client.get(url)
+
+    def test_matches_serializers(self):
+        urls = [
+            '/api/v1/discussions/',
+            '/api/v1/discussions/?comments=false',
+            f'/api/v1/discussions/?ids={self.users[2].id},{self.users[0].id}',
+            '/api/v1/discussions/search?hashtags=a',
+            '/api/v1/feed',
+            '/api/v1/comments/',
+            '/api/v1/replies/',
+            '/api/v1/likes/',
+            '/api/v1/commentlikes/',
+            '/api/v1/follows/',
+            '/api/v1/users/',
+            '/api/v1/users/search?name=user',
+        ]
+        for url in urls + [url + ('&' if '?' in url else '?') + 'expand=user' for url in urls[:3]]:
+            with self.subTest(url=url):
+                fast, slow = self.get(url), self.get(url, fast=False)
+                self.assertEqual(fast.status_code, 200)
+                self.assertEqual(fast.content, slow.content)
+
+    def test_sparse_fieldsets(self):
+        url = '/api/v1/discussions/?fields=id,comments.text&expand=comments.user'
+        response = self.get(url)
+        discussion = response.json()['results'][0]
+        self.assertEqual(list(discussion), ['id', 'comments'])
+        self.assertEqual(list(discussion['comments'][0]), ['text'])
+        self.assertEqual(response.content, self.get(url, fast=False).content)
+        comment = self.get('/api/v1/comments/?fields=id,user&expand=user').json()['results'][0]
+        self.assertEqual(set(comment['user']), {'id', 'name'})
+        follow = self.get('/api/v1/follows/?fields=follower.name').json()[0]
+        self.assertEqual(follow, {'follower': {'name': follow['follower']['name']}})
+
+    def test_unknown_fields_rejected(self):
+        self.assertEqual(self.get('/api/v1/discussions/?fields=id,nope').status_code, 400)
+        self.assertEqual(self.get('/api/v1/comments/?expand=text').status_code, 400)
+
+
+class ImagePipelineTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, size=(1200, 900)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (200, 30, 30)).save(buffer, 'JPEG')
+        data = {'text': 'photo', 'hashtags': '', 'image': SimpleUploadedFile('photo.jpg', buffer.getvalue())}
+        return self.client.post('/api/v1/discussions/', data, format='multipart')
+
+    def test_identical_uploads_are_stored_once(self):
+        first, second = self.upload(), self.upload()
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.json()['image'], second.json()['image'])
+        self.assertEqual(StoredImage.objects.count(), 1)
+        self.assertEqual(set(first.json()['images']), {'original'})
+
+    def test_variants(self):
+        self.upload()
+        stored = StoredImage.objects.get()
+        self.assertEqual(list(images.process([(stored.pk, stored.name)], processes=1)), [(stored.pk, True)])
+        discussion = self.client.get('/api/v1/discussions/').json()['results'][0]
+        self.assertEqual(set(discussion['images']), {'original', 'thumbnail', 'medium'})
+        variants = json.loads(Discussion.objects.get().image_variants)
+        for variant, size in images.VARIANTS.items():
+            with default_storage.open(variants[variant]) as file:
+                self.assertEqual(max(Image.open(file).size), size)
+
+    def test_processor_spawns_workers(self):
+        self.upload()
+        stored = StoredImage.objects.get()
+        processor = images.Processor(processes=2)
+        with mock.patch('multiprocessing.get_context') as get_context, mock.patch('atexit.register'):
+            with mock.patch('spyne.images.connections') as connections:
+                processor.add(stored)
+        connections.close_all.assert_called_once_with()
+        get_context.assert_called_once_with('spawn')
+        get_context.return_value.Pool.assert_called_once_with(2, initializer=django.setup)
+        # Run the queued job here and hand its result back as the pool would.
+        (render_job, (job,)), kwargs = processor.pool.apply_async.call_args
+        with mock.patch('spyne.images.close_old_connections'):
+            kwargs['callback'](render_job(job))
+        self.assertEqual(set(json.loads(StoredImage.objects.get().variants)), {'original', 'thumbnail', 'medium'})
+
+
+class AuthenticationCacheTests(TestCase):
+    def setUp(self):
+        caches[authentication.CACHE_ALIAS].clear()
+        self.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        self.auth = f'Bearer {AccessToken.for_user(self.user)}'
+        self.factory = RequestFactory()
+
+    def authenticate(self):
+        request = self.factory.get('/', HTTP_AUTHORIZATION=self.auth)
+        return authentication.CachedJWTAuthentication().authenticate(request)[0]
+
+    def test_cached_user(self):
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(), self.user)
+
+    @mock.patch('spyne.purge.IN_PROCESS', False)
+    def test_update_and_delete_evict(self):
+        self.authenticate()
+        client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(f'/api/v1/users/update/{self.user.id}', {'name': 'Renamed'}, HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.authenticate().name, 'Renamed')
+        with self.captureOnCommitCallbacks(execute=True):
+            client.delete(f'/api/v1/users/delete/{self.user.id}', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(client.get('/api/v1/discussions/', HTTP_AUTHORIZATION=self.auth).status_code, 401)
+
+    @mock.patch.object(authentication, 'LAZY_USERS', True)
+    def test_lazy_user(self):
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+            self.assertEqual(user.id, self.user.id)
+            self.assertTrue(user.is_authenticated)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.name, 'User')
+
+    def test_deactivation_evicts(self):
+        self.authenticate()
+        # As the admin or a shell would.
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = APIClient().get('/api/v1/discussions/', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 401)
+
+    @mock.patch.object(authentication, 'LAZY_USERS', True)
+    @mock.patch('spyne.purge.IN_PROCESS', False)
+    def test_lazy_user_revoked(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+        self.user.is_active = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.authenticate().id, self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            purge.soft_delete(self.user)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+        with self.assertLogs('spyne.authentication', 'WARNING'):
+            authentication.check_cache(True)
+
+
+class LoginTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        self.client = APIClient()
+
+    def login(self, password='pw'):
+        return self.client.post('/api/v1/token/', {'email': 'user@example.com', 'password': password}, format='json')
+
+    def test_login(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'access', 'refresh'})
+        self.assertEqual(self.login('wrong').status_code, 400)
+
+    def test_rejected_when_pool_is_full(self):
+        pool = logins.HashingPool(threads=1, max_pending=1)
+        with mock.patch.object(logins, 'hashing_pool', pool), pool.admit():
+            response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(logins.RETRY_AFTER))
+
+    def test_prune_tokens(self):
+        now = timezone.now()
+        tokens = [
+            OutstandingToken.objects.create(user=self.user, jti=str(i), token='', expires_at=now + timedelta(days=days))
+            for i, days in enumerate([-2, -1, 1])
+        ]
+        BlacklistedToken.objects.create(token=tokens[1])
+        self.assertEqual(logins.prune_tokens(chunk_size=2), 2)
+        self.assertEqual(list(OutstandingToken.objects.values_list('pk', flat=True)), [tokens[2].pk])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+
+class RendererTests(TestCase):
+    # Whichever encoder spyne.renderers uses, bodies must be DRF's.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(email=f'user{i}@example.com', password='pw', name=f'User\u2028{i} é', mobile='1')
+            for i in range(5)
+        ]
+        for user in cls.users:
+            Discussion.objects.create(user=user, text='x' * 2000, hashtags='#a')
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def test_matches_drf_renderer(self):
+        now = dt.datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=dt.timezone.utc)
+        data = {
+            'text': 'line\u2028separator\u2029 ünïcode "quoted" \\ \n',
+            'numbers': [0, -1, 2 ** 63 - 1, 0.5, 3.25, True, False, None],
+            'when': [now, now.replace(microsecond=0), now.replace(tzinfo=None), now.date(), now.time()],
+            'amount': decimal.Decimal('12.50'),
+            'id': uuid.UUID(int=1),
+            'duration': dt.timedelta(minutes=3),
+            'nested': [{'a': [{}], 'b': []}],
+            # Handed to DRF's encoder.
+            'wide': 2 ** 70,
+            'keys': {1: 'int key'},
+        }
+        for value in [data, data['numbers'], 'plain', None]:
+            self.assertEqual(renderers.JSONRenderer().render(value), JSONRenderer().render(value))
+        self.assertEqual(
+            renderers.JSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4'),
+        )
+        # Only the exponent notation may differ.
+        floats = [1e16, 1e-7, 1.5e300]
+        self.assertEqual(json.loads(renderers.JSONRenderer().render(floats)), floats)
+
+    def test_api_responses_match(self):
+        urls = ['/api/v1/users/', '/api/v1/discussions/', f'/api/v1/discussions/{Discussion.objects.first().id}/',
+                '/api/v1/users/search?name=user']
+        for url in urls:
+            with self.subTest(url=url):
+                fast = self.get(url)
+                with mock.patch.object(renderers, 'orjson', None):
+                    self.assertEqual(fast.content, self.get(url).content)
+
+    def get(self, url, **headers):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        return self.client.get(url, **headers)
+
+    def test_parser_matches_drf(self):
+        for body in [b'{"a": [1, 2.5, "\\u00e9", null, true]}', b'[18446744073709551616]', b'"text"']:
+            self.assertEqual(renderers.JSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body)))
+        for body in [b'{"a": ', b'[NaN]', b'']:
+            with self.assertRaises(ParseError) as expected:
+                JSONParser().parse(io.BytesIO(body))
+            with self.assertRaisesMessage(ParseError, str(expected.exception.detail)):
+                renderers.JSONParser().parse(io.BytesIO(body))
+
+    def test_streamed_list(self):
+        plain = self.get('/api/v1/users/')
+        with mock.patch.object(renderers, 'STREAM_MIN_ITEMS', 2), mock.patch.object(renderers, 'STREAM_CHUNK_SIZE', 2):
+            response = self.get('/api/v1/users/')
+            compressed = self.get('/api/v1/users/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(b''.join(response.streaming_content), plain.content)
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(compressed.streaming_content)), plain.content)
+
+    def test_compression(self):
+        url = f'/api/v1/discussions/{Discussion.objects.first().id}/'
+        plain = self.get(url)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        response = self.get(url, HTTP_ACCEPT_ENCODING='br;q=1.0, gzip;q=0.5, identity')
+        self.assertEqual(response['Content-Encoding'], 'br' if compression.brotli is not None else 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        if compression.brotli is None:
+            self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertFalse(self.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0').has_header('Content-Encoding'))
+        # The weak ETag still matches.
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(not_modified.status_code, 304)
+        small = self.get('/api/v1/users/search?name=nobody', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+
+@override_settings(ROOT_URLCONF='backend.asgi_urls')
+class AsyncReadPathTests(TransactionTestCase):
+    # The async views query from other threads, so their data must be
+    # committed. Their responses must be byte-identical to the sync views'.
+    databases = '__all__'
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(email=f'user{i}@example.com', password='pw', name=f'User {i}', mobile='1')
+            for i in range(3)
+        ]
+        self.discussions = []
+        for i, user in enumerate(self.users):
+            discussion = Discussion.objects.create(user=user, text=f'story {i}', hashtags='#a')
+            self.discussions.append(discussion)
+            for other in self.users:
+                Comment.objects.create(user=other, discussion=discussion, text=f'comment by {other.name}')
+                if other != user:
+                    Follow.objects.create(follower=user, following=other)
+        self.token = str(AccessToken.for_user(self.users[0]))
+
+    def get(self, url, asynchronous=False, **headers):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        if asynchronous:
+            headers = {key[5:].replace('_', '-').lower(): value for key, value in headers.items()}
+            response = async_to_sync(self.async_get)(url, **headers)
+            # Served by spyne/async_views.py, not a DRF view.
+            self.assertNotIsInstance(response, Response)
+            return response
+        with override_settings(ROOT_URLCONF='backend.urls'):
+            return APIClient().get(url, **headers)
+
+    async def async_get(self, url, **headers):
+        return await AsyncClient().get(url, **headers)
+
+    def test_matches_sync_views(self):
+        user, discussion = self.users[0], self.discussions[0]
+        urls = [
+            f'/api/v1/discussions/{discussion.id}/',
+            '/api/v1/discussions/999999/',
+            '/api/v1/discussions/',
+            f'/api/v1/discussions/?ids={discussion.id},999999&comments=false',
+            '/api/v1/discussions/?ids=x',
+            '/api/v1/discussions/search?hashtags=a',
+            '/api/v1/discussions/search?text=story',
+            '/api/v1/users/search?name=user',
+            f'/api/v1/users/followers/{user.id}',
+            f'/api/v1/users/following/{user.id}',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                sync = self.get(url, HTTP_AUTHORIZATION=f'Bearer {self.token}')
+                response = self.get(url, asynchronous=True, HTTP_AUTHORIZATION=f'Bearer {self.token}')
+                self.assertEqual(response.status_code, sync.status_code)
+                self.assertEqual(response.content, sync.content)
+
+    def test_authentication_required(self):
+        url = f'/api/v1/discussions/{self.discussions[0].id}/'
+        sync, response = self.get(url), self.get(url, asynchronous=True)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.content, sync.content)
+        self.assertEqual(response['WWW-Authenticate'], sync['WWW-Authenticate'])
+
+    async def asgi_get(self, path, query='', **headers):
+        # A request through backend.asgi's handler, which AsyncClient bypasses.
+        messages = []
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': query.encode(), 'scheme': 'http',
+            'server': ('testserver', 80), 'client': ('127.0.0.1', 12345),
+            'headers': [(name.encode(), value.encode()) for name, value in headers.items()],
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await AsyncReadHandler()(scope, receive, send)
+        return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+    def test_streamed_export(self):
+        admin = User.objects.create_user(email='admin@example.com', password='pw', name='Admin', mobile='1',
+                                         is_staff=True)
+        authorization = f'Bearer {AccessToken.for_user(admin)}'
+        for query in ['', 'gzip=1']:
+            with self.subTest(query=query):
+                sync = self.get(f'/api/v1/export/discussions?{query}', HTTP_AUTHORIZATION=authorization)
+                expected = b''.join(sync.streaming_content)
+                status_code, body = async_to_sync(self.asgi_get)(
+                    '/api/v1/export/discussions', query, authorization=authorization,
+                )
+                self.assertEqual(status_code, 200)
+                self.assertEqual(body, expected)
+        self.assertEqual(len(gzip.decompress(body).splitlines()), len(self.discussions))
+
+    def test_db_threads_drop_unusable_connections(self):
+        connection = mock.Mock()
+
+        def query():
+            connection.close_if_unusable_or_obsolete.assert_called_once_with()
+            return 'done'
+
+        with mock.patch('spyne.async_views.connections.all', return_value=[connection]):
+            self.assertEqual(async_to_sync(db)(query), 'done')
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        now = timezone.now()
+        # Three discussions share a timestamp, so only the id orders them.
+        cls.discussions = [
+            Discussion.objects.create(user=cls.user, text=f'discussion {i}', created_on=now - timedelta(minutes=minutes))
+            for i, minutes in enumerate([3, 2, 2, 2, 1])
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        return self.client.get(url)
+
+    def test_cursor_round_trip(self):
+        expected = [d.id for d in sorted(self.discussions, key=lambda d: (d.created_on, d.id), reverse=True)]
+        pages, url = [], '/api/v1/discussions/?page_size=2&comments=false'
+        while url:
+            body = self.get(url).json()
+            pages.append(([d['id'] for d in body['results']], body['previous']))
+            url = body['next']
+        self.assertEqual([ids for ids, previous in pages], [expected[0:2], expected[2:4], expected[4:]])
+        self.assertIsNone(pages[0][1])
+        # Stepping back from the last page returns the same pages.
+        url = pages[-1][1]
+        for ids, previous in reversed(pages[:-1]):
+            body = self.get(url).json()
+            self.assertEqual([d['id'] for d in body['results']], ids)
+            url = body['previous']
+        self.assertIsNone(url)
+
+    def test_invalid_cursor(self):
+        for raw in [b'x|2024-01-01T00:00:00+00:00|1', b'n|yesterday|1', b'n|2024-01-01T00:00:00+00:00|x', b'n|1']:
+            cursor = base64.urlsafe_b64encode(raw).decode('ascii')
+            with self.subTest(raw=raw):
+                response = self.get(f'/api/v1/discussions/?cursor={cursor}')
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+        self.assertEqual(self.get('/api/v1/discussions/?cursor=%25%25').status_code, 404)
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        self.other = User.objects.create_user(email='other@example.com', password='pw', name='Other', mobile='1')
+        self.discussion = Discussion.objects.create(user=self.user, text='discussion')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_engagement_counters(self):
+        self.client.post('/api/v1/likes/', {'discussion': self.discussion.id})
+        comment_id = self.client.post('/api/v1/comments/', {'discussion': self.discussion.id, 'text': 'c'}).json()['id']
+        self.client.post('/api/v1/replies/', {'comment': comment_id, 'text': 'r'})
+        self.client.post('/api/v1/commentlikes/', {'comment': comment_id})
+        self.client.post('/api/v1/follows/', {'following_id': self.other.id})
+        self.discussion.refresh_from_db()
+        comment = Comment.objects.get(pk=comment_id)
+        self.assertEqual((self.discussion.like_count, self.discussion.comment_count), (1, 1))
+        self.assertEqual((comment.like_count, comment.reply_count), (1, 1))
+        self.assertEqual(User.objects.get(pk=self.other.pk).follower_count, 1)
+        self.assertEqual(User.objects.get(pk=self.user.pk).following_count, 1)
+
+        self.client.delete(f'/api/v1/likes/{self.discussion.id}/')
+        self.client.delete(f'/api/v1/comments/{comment_id}/')
+        self.client.delete(f'/api/v1/follows/{self.other.id}/')
+        self.discussion.refresh_from_db()
+        self.assertEqual((self.discussion.like_count, self.discussion.comment_count), (0, 0))
+        self.assertEqual(User.objects.get(pk=self.other.pk).follower_count, 0)
+
+    def test_adjust_counter(self):
+        self.assertEqual(adjust_counter(Discussion, self.discussion.id, 'like_count', 2), 1)
+        # Never below zero.
+        self.assertEqual(adjust_counter(Discussion, self.discussion.id, 'like_count', -3), 0)
+        adjust_counters(Discussion, 'like_count', {self.discussion.id: -1, 999999: 1})
+        self.assertEqual(Discussion.objects.get(pk=self.discussion.id).like_count, 1)
+
+
+class ViewCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        self.discussions = [Discussion.objects.create(user=self.user, text=f'discussion {i}') for i in range(3)]
+
+    def views(self):
+        return [Discussion.objects.get(pk=d.pk).views for d in self.discussions]
+
+    def buffer(self, **kwargs):
+        buffer = ViewCountBuffer(**kwargs)
+        # No flusher thread; the tests flush.
+        buffer.start = lambda: None
+        return buffer
+
+    def test_flush(self):
+        buffer = self.buffer(flush_interval=60)
+        for discussion in [self.discussions[0]] * 3 + [self.discussions[1]]:
+            buffer.add(discussion.pk)
+        self.assertEqual(self.views(), [0, 0, 0])
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.views(), [3, 1, 0])
+        self.assertEqual(
+            sorted(ViewDelta.objects.values_list('discussion_id', 'views')),
+            [(self.discussions[0].pk, 3), (self.discussions[1].pk, 1)],
+        )
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_max_pending(self):
+        buffer = self.buffer(flush_interval=60, max_pending=2)
+        buffer.add(self.discussions[0].pk)
+        buffer.add(self.discussions[0].pk)
+        self.assertEqual(self.views(), [0, 0, 0])
+        # The second distinct discussion fills the buffer.
+        buffer.add(self.discussions[1].pk)
+        self.assertEqual(self.views(), [2, 1, 0])
+        self.assertFalse(buffer.pending)
+
+    def test_unbuffered(self):
+        buffer = self.buffer(flush_interval=0)
+        buffer.add(self.discussions[2].pk)
+        self.assertEqual(self.views(), [0, 0, 1])
+
+    def test_failed_flush_keeps_views(self):
+        buffer = self.buffer(flush_interval=60)
+        buffer.add(self.discussions[0].pk, 2)
+        with mock.patch('spyne.viewcounts.adjust_counters', side_effect=Exception('down')):
+            with self.assertLogs('spyne.viewcounts', 'ERROR'):
+                self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.pending, {self.discussions[0].pk: 2})
+        buffer.clear()
+        self.assertEqual(buffer.flush(), 0)
+
+
+class HashtagTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.ids = {
+            hashtags: self.client.post('/api/v1/discussions/', {'text': 'text', 'hashtags': hashtags}).json()['id']
+            for hashtags in ['#Django #python', '#python', '#rust,#go']
+        }
+
+    def search(self, query):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        return {d['id'] for d in self.client.get(f'/api/v1/discussions/search?{query}').json()['results']}
+
+    def test_parse_hashtags(self):
+        self.assertEqual(parse_hashtags('#Django, #python #django #' + 'x' * 101), ['django', 'python'])
+        self.assertEqual(parse_hashtags(None), [])
+
+    def test_indexed(self):
+        self.assertEqual(sorted(Hashtag.objects.values_list('name', flat=True)), ['django', 'go', 'python', 'rust'])
+        links = DiscussionHashtag.objects.filter(discussion_id=self.ids['#Django #python'])
+        self.assertEqual(sorted(links.values_list('hashtag__name', flat=True)), ['django', 'python'])
+
+    def test_filter(self):
+        self.assertEqual(self.search('hashtags=PYTHON'), {self.ids['#Django #python'], self.ids['#python']})
+        self.assertEqual(self.search('hashtags=python,rust'), set(self.ids.values()))
+        self.assertEqual(self.search('hashtags=python,django&match=all'), {self.ids['#Django #python']})
+        self.assertEqual(self.search('hashtags=python,nope&match=all'), set())
+        self.assertEqual(self.search('hashtags=nope'), set())
+
+    def test_update_reindexes(self):
+        discussion_id = self.ids['#python']
+        response = self.client.patch(f'/api/v1/discussions/{discussion_id}/', {'hashtags': '#rust'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.search('hashtags=rust'), {discussion_id, self.ids['#rust,#go']})
+        self.assertNotIn(discussion_id, self.search('hashtags=python'))
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        texts = {
+            'quick': 'the quick brown fox jumps over the lazy dog',
+            'brown': 'brown fox brown fox brown fox',
+            'reversed': 'fox brown and a dog',
+            'other': 'nothing to see here',
+        }
+        cls.ids = {}
+        for name, text in texts.items():
+            hashtags = '' if name == 'quick' else '#animals'
+            discussion = Discussion.objects.create(user=cls.user, text=text, hashtags=hashtags)
+            index_discussion(discussion)
+            set_discussion_hashtags(discussion)
+            cls.ids[name] = discussion.id
+
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        search_module._stats['expires'] = 0
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def ranked(self, query):
+        return [discussion_id for discussion_id, score in search_module.search(query, Discussion.objects.all())]
+
+    def test_ranking(self):
+        # Three occurrences in a short document beat one in a long one.
+        self.assertEqual(self.ranked('fox'), [self.ids['brown'], self.ids['reversed'], self.ids['quick']])
+        self.assertEqual(self.ranked('dog fox'), [self.ids['reversed'], self.ids['quick']])
+        self.assertEqual(self.ranked('jump*'), [self.ids['quick']])
+        self.assertEqual(self.ranked('fox unicorn'), [])
+
+    def test_phrase(self):
+        self.assertEqual(sorted(self.ranked('"brown fox"')), sorted([self.ids['quick'], self.ids['brown']]))
+        self.assertEqual(self.ranked('"fox brown" dog'), [self.ids['reversed']])
+        with CaptureQueriesContext(connection) as queries:
+            self.ranked('brown fox')
+        self.assertFalse(any('positions' in query['sql'] for query in queries))
+
+    def test_bounded(self):
+        with mock.patch.object(search_module, 'MAX_RESULTS', 2):
+            self.assertEqual(self.ranked('fox'), [self.ids['brown'], self.ids['reversed']])
+        # fox is in three discussions; only the newest two are matched. The
+        # rarer dog is in two, all read, and narrows fox down to them.
+        with mock.patch.object(search_module, 'MAX_POSTINGS', 2):
+            self.assertEqual(self.ranked('fox'), [self.ids['brown'], self.ids['reversed']])
+            self.assertEqual(self.ranked('dog fox'), [self.ids['reversed'], self.ids['quick']])
+        with mock.patch.object(search_module, 'MAX_POSTINGS', 1):
+            self.assertEqual(self.ranked('dog fox'), [self.ids['reversed']])
+
+    def test_pagination(self):
+        pages = [
+            self.client.get(f'/api/v1/discussions/search?text=fox&page_size=2&page={page}').json()
+            for page in (1, 2)
+        ]
+        self.assertEqual(pages[0]['count'], 3)
+        self.assertEqual(
+            [d['id'] for page in pages for d in page['results']],
+            [self.ids['brown'], self.ids['reversed'], self.ids['quick']],
+        )
+        self.assertIsNone(pages[1]['next'])
+        # Filters narrow the ranked ids, which are cached per query and filter.
+        response = self.client.get('/api/v1/discussions/search?text=fox&hashtags=animals')
+        self.assertEqual([d['id'] for d in response.json()['results']], [self.ids['brown'], self.ids['reversed']])
+
+    def test_ranking_cached(self):
+        with mock.patch.object(search_module, 'search', wraps=search_module.search) as search:
+            self.client.get('/api/v1/discussions/search?text=fox&page_size=1&page=1')
+            self.client.get('/api/v1/discussions/search?text=fox&page_size=1&page=2')
+            self.assertEqual(search.call_count, 1)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/api/v1/discussions/', {'text': 'a fox', 'hashtags': ''})
+            response = self.client.get('/api/v1/discussions/search?text=fox&page_size=1&page=3')
+            self.assertEqual(search.call_count, 2)
+        self.assertEqual(response.json()['count'], 4)
+
+
+class FeedTests(TestCase):
+    def setUp(self):
+        self.author, self.pulled, self.reader, self.other = [
+            User.objects.create_user(email=f'user{i}@example.com', password='pw', name=f'User {i}', mobile='1')
+            for i in range(4)
+        ]
+        self.client = APIClient()
+        follows = [
+            (self.reader, self.author), (self.other, self.author),
+            (self.reader, self.pulled), (self.other, self.pulled), (self.author, self.pulled),
+        ]
+        for follower, following in follows:
+            self.client.force_authenticate(follower)
+            self.client.post('/api/v1/follows/', {'following_id': following.id})
+
+    def post(self, user, text):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/v1/discussions/', {'text': text, 'hashtags': ''}).json()['id']
+
+    def feed(self, user):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        self.client.force_authenticate(user)
+        return [d['id'] for d in self.client.get('/api/v1/feed').json()['results']]
+
+    def test_fan_out_after_commit(self):
+        with mock.patch.object(feed.fan_out_worker, 'add') as add:
+            discussion_id = self.post(self.author, 'hello')
+        add.assert_called_once_with(discussion_id)
+        # Only the author's own timeline is written by the request.
+        self.assertEqual(list(TimelineEntry.objects.values_list('user_id', flat=True)), [self.author.id])
+        self.assertTrue(feed.run_chunk(discussion_id, chunk_size=1))
+        first = Follow.objects.get(follower=self.reader, following=self.author)
+        self.assertEqual(FanOutJob.objects.get().last_follow_id, first.pk)
+        self.assertTrue(feed.run_job(discussion_id, chunk_size=1))
+        self.assertFalse(FanOutJob.objects.exists())
+        timelines = set(TimelineEntry.objects.values_list('user_id', flat=True))
+        self.assertEqual(timelines, {self.author.id, self.reader.id, self.other.id})
+        self.assertEqual(self.feed(self.other), [discussion_id])
+
+    def test_deleted_discussion_dropped(self):
+        with mock.patch.object(feed.fan_out_worker, 'add'):
+            discussion_id = self.post(self.author, 'hello')
+        Discussion.objects.filter(pk=discussion_id).update(deleted_on=timezone.now())
+        self.assertFalse(feed.run_chunk(discussion_id))
+        self.assertFalse(FanOutJob.objects.exists())
+        self.assertEqual(TimelineEntry.objects.count(), 1)
+
+    def test_fan_out_limit(self):
+        # The author has two followers, the pulled author three.
+        with mock.patch.object(feed, 'FANOUT_LIMIT', 2), mock.patch.object(feed.fan_out_worker, 'add') as add:
+            pulled = self.post(self.pulled, 'pulled')
+            fanned = self.post(self.author, 'fanned out')
+            feed.run_job(fanned)
+            # Merged in at read time, in order.
+            self.assertEqual(self.feed(self.reader), [fanned, pulled])
+            self.assertEqual(add.call_count, 1)
+        self.assertFalse(TimelineEntry.objects.filter(discussion_id=pulled).exclude(user=self.pulled).exists())
+
+
+class FollowGraphTests(TestCase):
+    def setUp(self):
+        caches[follow_graph.CACHE_ALIAS].clear()
+        self.users = [
+            User.objects.create_user(email=f'user{i}@example.com', password='pw', name=f'User {i}', mobile='1')
+            for i in range(3)
+        ]
+        self.client = APIClient()
+        self.follow(0, 1)
+        self.follow(1, 0)
+
+    def follow(self, follower, following, method='post'):
+        self.client.force_authenticate(self.users[follower])
+        with self.captureOnCommitCallbacks(execute=True):
+            if method == 'post':
+                return self.client.post('/api/v1/follows/', {'following_id': self.users[following].id})
+            return self.client.delete(f'/api/v1/follows/{self.users[following].id}/')
+
+    def get(self, url):
+        return self.client.get(url).json()
+
+    def test_cached(self):
+        a, b, c = (user.id for user in self.users)
+        with self.assertNumQueries(3):
+            follow_graph.follow_counts(a)
+            follow_graph.following_ids(a)
+            follow_graph.mutual_ids(a)
+        with self.assertNumQueries(0):
+            self.assertEqual(follow_graph.follow_counts(a), {'followers': 1, 'following': 1})
+            self.assertTrue(follow_graph.is_following(a, b))
+            self.assertFalse(follow_graph.is_following(a, c))
+            self.assertEqual(follow_graph.mutual_ids(a), [b])
+        self.assertIsNone(follow_graph.follow_counts(999999))
+
+    def test_follows_invalidate(self):
+        a, b, c = (user.id for user in self.users)
+        self.assertEqual(self.get(f'/api/v1/users/follow-counts/{c}'), {'id': c, 'followers': 0, 'following': 0})
+        self.assertEqual(self.get(f'/api/v1/users/mutuals/{a}')['results'], [{'id': b, 'name': 'User 1'}])
+        self.follow(0, 2)
+        self.follow(2, 0)
+        self.assertEqual(self.get(f'/api/v1/users/follow-counts/{c}'), {'id': c, 'followers': 1, 'following': 1})
+        self.assertEqual([user['id'] for user in self.get(f'/api/v1/users/mutuals/{a}')['results']], [b, c])
+        self.assertEqual(
+            self.get(f'/api/v1/users/is-following/{a}/{c}'),
+            {'follower': a, 'following': c, 'is_following': True, 'is_followed_by': True},
+        )
+        self.follow(0, 2, method='delete')
+        self.assertFalse(self.get(f'/api/v1/users/is-following/{a}/{c}')['is_following'])
+        self.assertEqual(self.get(f'/api/v1/users/follow-counts/{a}'), {'id': a, 'followers': 2, 'following': 1})
+        self.assertEqual([user['id'] for user in self.get(f'/api/v1/users/mutuals/{a}')['results']], [b])
+
+    def test_process_local_cache_warns(self):
+        with self.assertLogs('spyne.follow_graph', 'WARNING'):
+            follow_graph.check_cache(follow_graph.CACHE_ALIAS)
+        shared = {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache'}
+        with mock.patch.dict(settings.CACHES, {'follows': shared}):
+            with mock.patch.object(follow_graph.logger, 'warning') as warning:
+                follow_graph.check_cache('follows')
+        warning.assert_not_called()
+
+
+class BatchTests(TestCase):
+    def setUp(self):
+        self.user, self.other, self.third = [
+            User.objects.create_user(email=f'user{i}@example.com', password='pw', name=f'User {i}', mobile='1')
+            for i in range(3)
+        ]
+        self.discussions = [Discussion.objects.create(user=self.other, text=f'discussion {i}') for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def like_counts(self):
+        return [Discussion.objects.get(pk=d.pk).like_count for d in self.discussions]
+
+    def test_duplicate_ids(self):
+        a, b, c = (d.id for d in self.discussions)
+        self.client.post('/api/v1/likes/', {'discussion': b})
+        response = self.client.post('/api/v1/likes/batch/', {'discussions': [a, a, b, c, 999999]}, format='json')
+        self.assertEqual(
+            [result['status'] for result in response.json()['results']],
+            ['created', 'exists', 'exists', 'created', 'not_found'],
+        )
+        self.assertEqual(self.like_counts(), [1, 1, 1])
+
+    def test_concurrent_likes(self):
+        a, b, c = (d.id for d in self.discussions)
+        # A like of b is inserted after the batch looked for existing likes.
+        Like.objects.create(user=self.user, discussion_id=b)
+        with mock.patch('spyne.batch._existing', return_value=set()):
+            results = batch.like_many(self.user, [a, b, c], Like, Discussion, 'discussion')
+        self.assertEqual([result['status'] for result in results], ['created', 'exists', 'created'])
+        self.assertEqual(self.like_counts(), [1, 0, 1])
+        self.assertEqual(Like.objects.filter(user=self.user).count(), 3)
+
+    def test_concurrent_follows(self):
+        Follow.objects.create(follower=self.user, following=self.other)
+        with mock.patch('spyne.batch._existing', return_value=set()):
+            results = batch.follow_many(self.user, [self.other.id, self.third.id, self.third.id])
+        self.assertEqual([result['status'] for result in results], ['exists', 'created', 'exists'])
+        counts = dict(User.objects.values_list('pk', 'follower_count'))
+        self.assertEqual((counts[self.other.id], counts[self.third.id]), (0, 1))
+        self.assertEqual(User.objects.get(pk=self.user.pk).following_count, 1)
+
+    def test_follow_many_backfills_in_bulk(self):
+        authors = [
+            User.objects.create_user(email=f'author{i}@example.com', password='pw', name=f'Author {i}', mobile='1')
+            for i in range(6)
+        ]
+        for author in authors:
+            for i in range(3):
+                Discussion.objects.create(user=author, text=f'{author.name} {i}')
+        newest = Discussion.objects.order_by('-created_on', '-id')
+        latest = {author.id: set(newest.filter(user=author).values_list('id', flat=True)[:2]) for author in authors}
+
+        def follow(authors):
+            TimelineEntry.objects.filter(user=self.user).delete()
+            Follow.objects.filter(follower=self.user).delete()
+            with mock.patch('spyne.feed.BACKFILL_SIZE', 2), CaptureQueriesContext(connection) as queries:
+                batch.follow_many(self.user, [author.id for author in authors])
+            for author in authors:
+                entries = TimelineEntry.objects.filter(user=self.user, author=author)
+                self.assertEqual(set(entries.values_list('discussion_id', flat=True)), latest[author.id])
+            return len(queries)
+
+        self.assertEqual(follow(authors[:2]), follow(authors))
+        with mock.patch.object(connection.features, 'supports_over_clause', False):
+            follow(authors)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        self.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.discussion_id = self.client.post(
+                '/api/v1/discussions/', {'text': 'cached story', 'hashtags': '#news'},
+            ).json()['id']
+
+    def write(self, method, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 300)
+        return response
+
+    def test_engagement_invalidates_lists(self):
+        urls = ['/api/v1/discussions/search?text=story', '/api/v1/discussions/search?hashtags=news']
+        for url in urls:
+            self.assertEqual(self.client.get(url).json()['results'][0]['likes'], 0)
+        self.write('post', '/api/v1/likes/', {'discussion': self.discussion_id})
+        comment_id = self.write('post', '/api/v1/comments/', {'discussion': self.discussion_id, 'text': 'c'}).json()['id']
+        for url in urls:
+            with self.subTest(url=url):
+                discussion = self.client.get(url).json()['results'][0]
+                self.assertEqual(discussion['likes'], 1)
+                self.assertEqual([comment['id'] for comment in discussion['comments']], [comment_id])
+
+    def test_unrelated_writes_keep_lists(self):
+        url = '/api/v1/discussions/search?text=story'
+        etag = self.client.get(url)['ETag']
+        other = Discussion.objects.create(user=self.user, text='other')
+        self.write('post', '/api/v1/likes/', {'discussion': other.id})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_rename_invalidates_expanded_users(self):
+        url = f'/api/v1/discussions/{self.discussion_id}/?expand=user'
+        self.assertEqual(self.client.get(url).json()['user']['name'], 'User')
+        self.write('patch', f'/api/v1/users/update/{self.user.id}', {'name': 'Renamed'})
+        self.assertEqual(self.client.get(url).json()['user']['name'], 'Renamed')
+
+    @override_settings(ALLOWED_HOSTS=['a.example.com', 'b.example.com'])
+    def test_keyed_on_host(self):
+        Discussion.objects.filter(pk=self.discussion_id).update(image='images/a.png')
+        url = f'/api/v1/discussions/{self.discussion_id}/'
+        for host in ['a.example.com', 'b.example.com']:
+            with self.subTest(host=host):
+                image = self.client.get(url, HTTP_HOST=host).json()['image']
+                self.assertTrue(image.startswith(f'http://{host}/'), image)
+
+
+class ThreadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        cls.discussion = Discussion.objects.create(user=cls.user, text='discussion')
+        cls.replies = {}
+        for i, count in enumerate([0, 1, 4, 25]):
+            comment = Comment.objects.create(user=cls.user, discussion=cls.discussion, text=f'comment {i}')
+            cls.replies[comment.id] = [
+                Reply.objects.create(user=cls.user, comment=comment, text=f'reply {j}').id for j in range(count)
+            ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def first_replies(self, query=''):
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        response = self.client.get(f'/api/v1/discussions/{self.discussion.id}/thread{query}')
+        comments = response.json()['results']
+        return {comment['id']: [reply['id'] for reply in comment['first_replies']] for comment in comments}
+
+    def test_reply_limits(self):
+        for over_clause in [True, False]:
+            features = mock.patch.object(connection.features, 'supports_over_clause', over_clause)
+            with self.subTest(over_clause=over_clause), features:
+                for query, limit in [('', 3), ('?replies=2', 2), ('?replies=0', 0), ('?replies=50', 20)]:
+                    expected = {pk: replies[:limit] for pk, replies in self.replies.items()}
+                    self.assertEqual(self.first_replies(query), expected)
+
+    def test_one_query(self):
+        comments = list(Comment.objects.filter(discussion=self.discussion))
+        with self.assertNumQueries(1):
+            attach_first_replies(comments, 3)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        Discussion.objects.create(user=self.user, text='discussion')
+
+    def test_serializer_time(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        serializer = DiscussionSerializer(Discussion.objects.all(), many=True, context={'request': Request(request)})
+        recorded = metrics.RequestMetrics()
+        token = metrics._current.set(recorded)
+        start = time.perf_counter()
+        try:
+            serializer.data
+        finally:
+            metrics._current.reset(token)
+        elapsed = time.perf_counter() - start
+        # The nested comments serializer isn't timed again.
+        self.assertTrue(0 < recorded.serializer_seconds <= elapsed)
+
+    def test_metrics_restricted(self):
+        self.client.get('/api/v1/users/search?name=user')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'spyne_request_serializer_seconds_bucket', response.content)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+        with override_settings(METRICS_TOKEN='secret'):
+            for authorization, status_code in [('Bearer nope', 403), ('Bearer secret', 200)]:
+                response = self.client.get('/metrics', REMOTE_ADDR='10.0.0.1', HTTP_AUTHORIZATION=authorization)
+                self.assertEqual(response.status_code, status_code)
+
+
+class GenerateDatasetTests(TestCase):
+    SCALE = dict(users=20, follows_per_user=3, discussions=30, comments=40, replies=40, likes=60, comment_likes=40)
+
+    def generate(self, **options):
+        call_command('generate_dataset', batch_size=7, password='pw', stdout=io.StringIO(), **self.SCALE, **options)
+
+    def test_rows_and_counters(self):
+        self.generate()
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Discussion.objects.count(), 30)
+        self.assertEqual(Comment.objects.count(), 40)
+        self.assertEqual(Reply.objects.count(), 40)
+        # Repeated (user, target) pairs are dropped, so there may be fewer likes.
+        self.assertTrue(0 < Like.objects.count() <= 60)
+        self.assertTrue(0 < CommentLike.objects.count() <= 40)
+        self.assertFalse(Follow.objects.filter(follower_id=F('following_id')).exists())
+        for user in User.objects.all():
+            self.assertEqual(user.follower_count, Follow.objects.filter(following=user).count())
+            self.assertEqual(user.following_count, Follow.objects.filter(follower=user).count())
+        for discussion in Discussion.objects.all():
+            self.assertEqual(discussion.like_count, Like.objects.filter(discussion=discussion).count())
+            self.assertEqual(discussion.comment_count, Comment.objects.filter(discussion=discussion).count())
+        # Every author sees their own discussions in their feed.
+        self.assertEqual(TimelineEntry.objects.filter(user_id=F('author_id')).count(), 30)
+        self.assertTrue(DiscussionHashtag.objects.exists())
+
+    def test_skip_indexes(self):
+        self.generate(skip_indexes=True)
+        self.assertEqual(Discussion.objects.count(), 30)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertFalse(DiscussionHashtag.objects.exists())
+
+    def test_reproducible(self):
+        def snapshot():
+            return (
+                list(User.objects.order_by('id').values_list('email', 'name')),
+                list(Follow.objects.order_by('id').values_list('follower__email', 'following__email')),
+                list(Discussion.objects.order_by('id').values_list('user__email', 'text', 'hashtags')),
+            )
+
+        self.generate(seed=5, skip_indexes=True)
+        first = snapshot()
+        User.objects.all().delete()
+        self.generate(seed=5, skip_indexes=True)
+        self.assertEqual(snapshot(), first)
+        User.objects.all().delete()
+        self.generate(seed=6, skip_indexes=True)
+        self.assertNotEqual(snapshot(), first)
+
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_benchmark_cases_succeed(self):
+        # benchmark raises when a case gets an error response instead of timing it.
+        self.generate()
+        with tempfile.TemporaryDirectory() as directory:
+            stderr = io.StringIO()
+            call_command(
+                'benchmark', iterations=2, password='pw', output=f'{directory}/benchmark.json',
+                stdout=io.StringIO(), stderr=stderr,
+            )
+            with open(f'{directory}/benchmark.json') as f:
+                results = json.load(f)['results']
+        self.assertNotIn('FAILED', stderr.getvalue())
+        self.assertFalse([label for label, result in results.items() if result['status'] == 'skip'])
+
+
+class TrendingTests(TestCase):
+    HOUR = trending.WINDOWS['hour']
+    WEEK = trending.WINDOWS['week']
+
+    def setUp(self):
+        # Events are counted as soon as they're created, but in test_grace.
+        grace = mock.patch.object(trending, 'GRACE', 0)
+        grace.start()
+        self.addCleanup(grace.stop)
+        self.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        self.now = timezone.now()
+        self.hashtag = Hashtag.objects.create(name='python')
+        self.discussions = []
+        for i in range(2):
+            discussion = Discussion.objects.create(user=self.user, text=f'discussion {i}')
+            DiscussionHashtag.objects.create(discussion=discussion, hashtag=self.hashtag)
+            self.discussions.append(discussion)
+
+    def like(self, discussion, seconds_ago, **fields):
+        email = f'{uuid.uuid4().hex}@example.com'
+        user = User.objects.create_user(email=email, password='pw', name='Liker', mobile='1')
+        like = Like.objects.create(user=user, discussion=discussion, **fields)
+        Like.objects.filter(pk=like.pk).update(created_on=self.now - timedelta(seconds=seconds_ago))
+
+    def scores(self, kind='discussion', window='hour'):
+        return dict(TrendingSnapshot.objects.filter(kind=kind, window=window).values_list('object_id', 'score'))
+
+    def test_decay(self):
+        first, second = self.discussions
+        self.like(first, 0)
+        self.like(second, self.HOUR)
+        Comment.objects.create(user=self.user, discussion=second, text='comment')
+        Comment.objects.filter(discussion=second).update(created_on=self.now)
+        ViewDelta.objects.create(discussion=first, views=3, created_on=self.now)
+        trending.compute(self.now)
+
+        like, comment, view = trending.WEIGHTS['like'], trending.WEIGHTS['comment'], trending.WEIGHTS['view']
+        scores = self.scores()
+        self.assertAlmostEqual(scores[first.id], like + 3 * view, places=3)
+        self.assertAlmostEqual(scores[second.id], like / 2 + comment, places=3)
+        self.assertEqual(list(TrendingSnapshot.objects.filter(kind='discussion', window='hour')
+                              .order_by('rank').values_list('object_id', flat=True)), [second.id, first.id])
+        self.assertAlmostEqual(self.scores('hashtag')[self.hashtag.id], sum(scores.values()), places=3)
+        self.assertFalse(ViewDelta.objects.exists())
+
+    def test_runs_fold_in_new_events_only(self):
+        discussion = self.discussions[0]
+        self.like(discussion, 0)
+        trending.compute(self.now)
+        self.now += timedelta(seconds=self.HOUR)
+        self.like(discussion, 0)
+        trending.compute(self.now)
+        like = trending.WEIGHTS['like']
+        self.assertAlmostEqual(self.scores()[discussion.id], like / 2 + like, places=3)
+
+    def test_events_beyond_horizon_are_ignored(self):
+        self.like(self.discussions[0], self.WEEK * trending.HORIZON_HALF_LIVES + 60)
+        trending.compute(self.now)
+        self.assertFalse(TrendingScore.objects.exists())
+
+    def test_epoch_rebase(self):
+        discussion = self.discussions[0]
+        self.like(discussion, 0)
+        trending.compute(self.now)
+        epoch = TrendingState.objects.get(key='epoch').value
+
+        elapsed = self.HOUR * (trending.REBASE_HALF_LIVES + 1)
+        self.now += timedelta(seconds=elapsed)
+        trending.compute(self.now)
+        self.assertEqual(TrendingState.objects.get(key='epoch').value, int(self.now.timestamp()))
+        # Decayed below PRUNE_BELOW in the hour window, rescaled to the new epoch in the week one.
+        self.assertFalse(TrendingScore.objects.filter(window='hour').exists())
+        stored = TrendingScore.objects.get(kind='discussion', window='week', object_id=discussion.id).score
+        decayed = trending.WEIGHTS['like'] * 2 ** (-(int(self.now.timestamp()) - epoch) / self.WEEK)
+        self.assertAlmostEqual(stored, decayed, places=3)
+        self.assertAlmostEqual(self.scores(window='week')[discussion.id], decayed, places=3)
+
+        # Events after the rebase are scored against the new epoch.
+        self.like(discussion, 0)
+        trending.compute(self.now)
+        self.assertAlmostEqual(self.scores()[discussion.id], trending.WEIGHTS['like'], places=3)
+        self.assertAlmostEqual(self.scores(window='week')[discussion.id], decayed + trending.WEIGHTS['like'], places=3)
+
+    def test_grace(self):
+        discussion = self.discussions[0]
+        like = trending.WEIGHTS['like']
+        self.like(discussion, 0, id=100)
+        with mock.patch.object(trending, 'GRACE', 60):
+            trending.compute(self.now)
+            self.assertFalse(self.scores())
+            # Committed after the like above, with a lower id.
+            self.like(discussion, 30, id=50)
+            self.now += timedelta(seconds=60)
+            trending.compute(self.now)
+        expected = like * 2 ** (-60 / self.HOUR) + like * 2 ** (-90 / self.HOUR)
+        self.assertAlmostEqual(self.scores()[discussion.id], expected, places=3)
+        self.assertEqual(TrendingState.objects.get(key='like').value, 100)
+
+
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        caches[typeahead.CACHE_ALIAS].clear()
+
+    def create(self, name, followers=0):
+        with self.captureOnCommitCallbacks(execute=True):
+            email = f'{uuid.uuid4().hex}@example.com'
+            user = User.objects.create_user(email=email, password='pw', name=name, mobile='1')
+            User.objects.filter(pk=user.pk).update(follower_count=followers)
+            typeahead.index_users([user])
+        return user
+
+    def test_ranked_candidates(self):
+        users = [self.create(f'Anna {name}', followers) for followers, name in enumerate('abcde')]
+        # All keys are candidates: most followed first.
+        self.assertEqual([user['id'] for user in typeahead.suggest('ann', 2)], [users[-1].id, users[-2].id])
+        exact = self.create('Ann')
+        caches[typeahead.CACHE_ALIAS].clear()
+        # The first candidates in key order, exact matches first; the rank isn't
+        # computed by the database.
+        with mock.patch.object(typeahead, 'CANDIDATES', 3), CaptureQueriesContext(connection) as queries:
+            results = typeahead.suggest('ann', 3)
+        self.assertEqual([user['id'] for user in results], [exact.id, users[1].id, users[0].id])
+        self.assertNotIn('CASE', queries[0]['sql'])
+
+    def test_changes_evict_affected_prefixes_only(self):
+        user = self.create('Bob Stone')
+        self.create('Zed Hill')
+        self.assertEqual(len(typeahead.suggest('bo')), 1)
+        self.assertEqual(len(typeahead.suggest('zed')), 1)
+
+        user.name = 'Rob Stone'
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+            typeahead.index_users([user])
+        cache = caches[typeahead.CACHE_ALIAS]
+        for prefix in ['b', 'bo', 'r', 'ro', 's', 'stone']:
+            self.assertIsNone(cache.get(typeahead._cache_key(prefix)), prefix)
+        self.assertIsNotNone(cache.get(typeahead._cache_key('zed')))
+        self.assertEqual(typeahead.suggest('bo'), [])
+        self.assertEqual(typeahead.suggest('ro'), [{'id': user.id, 'name': 'Rob Stone'}])
+
+        self.assertEqual(len(typeahead.suggest('sto')), 1)
+        with mock.patch('spyne.purge.IN_PROCESS', False), self.captureOnCommitCallbacks(execute=True):
+            purge.soft_delete(user)
+        self.assertEqual(typeahead.suggest('sto'), [])
+        self.assertIsNotNone(cache.get(typeahead._cache_key('zed')))
+
+
+@mock.patch('spyne.purge.IN_PROCESS', False)
+class SoftDeleteTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(email='author@example.com', password='pw', name='Author', mobile='1')
+        self.other = User.objects.create_user(email='other@example.com', password='pw', name='Other', mobile='1')
+        self.discussion = Discussion.objects.create(user=self.author, text='purged words #gone', hashtags='#gone')
+        self.kept = Discussion.objects.create(user=self.other, text='kept words')
+        for discussion in [self.discussion, self.kept]:
+            index_discussion(discussion)
+            set_discussion_hashtags(discussion)
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+    def populate(self):
+        # A row for every stage of a user purge.
+        author, other = self.author, self.other
+        on_own = Comment.objects.create(user=other, discussion=self.discussion, text='on own')
+        Reply.objects.create(user=other, comment=on_own, text='reply')
+        CommentLike.objects.create(user=other, comment=on_own)
+        Like.objects.create(user=other, discussion=self.discussion)
+        TimelineEntry.objects.create(user=other, discussion=self.discussion, author=author, created_on=timezone.now())
+        TimelineEntry.objects.create(user=author, discussion=self.kept, author=other, created_on=timezone.now())
+        on_other = Comment.objects.create(user=author, discussion=self.kept, text='on other')
+        Reply.objects.create(user=other, comment=on_other, text='received')
+        CommentLike.objects.create(user=other, comment=on_other)
+        comment = Comment.objects.create(user=other, discussion=self.kept, text='comment')
+        Reply.objects.create(user=author, comment=comment, text='reply')
+        CommentLike.objects.create(user=author, comment=comment)
+        Like.objects.create(user=author, discussion=self.kept)
+        Follow.objects.create(follower=author, following=other)
+        Follow.objects.create(follower=other, following=author)
+        typeahead.index_users([author])
+        FollowSuggestion.objects.create(user=other, candidate=author, rank=1, mutuals=1, score=1)
+        call_command('reconcile_counters', stdout=io.StringIO())
+        return comment
+
+    def delete(self, path):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(path)
+        self.assertEqual(response.status_code, 204)
+        return PurgeJob.objects.get()
+
+    def test_deleted_discussion_hidden(self):
+        job = self.delete(f'/api/v1/discussions/{self.discussion.id}/')
+        self.assertEqual((job.kind, job.object_id, job.finished_on), ('discussion', self.discussion.id, None))
+        self.assertIsNotNone(Discussion.all_objects.get(pk=self.discussion.id).deleted_on)
+        self.assertEqual(self.client.get(f'/api/v1/discussions/{self.discussion.id}/').status_code, 404)
+        listed = [row['id'] for row in self.client.get('/api/v1/discussions/').json()['results']]
+        self.assertEqual(listed, [self.kept.id])
+        found = self.client.get('/api/v1/discussions/search?text=words').json()['results']
+        self.assertEqual([row['id'] for row in found], [self.kept.id])
+
+    def test_deleted_user_hidden(self):
+        job = self.delete(f'/api/v1/users/{self.author.id}/')
+        self.assertEqual((job.kind, job.object_id), ('user', self.author.id))
+        self.assertIsNotNone(User.all_objects.get(pk=self.author.id).deleted_on)
+        self.assertFalse(Discussion.objects.filter(user_id=self.author.id).exists())
+        self.assertEqual(Discussion.all_objects.filter(user_id=self.author.id).count(), 1)
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(f'/api/v1/users/{self.author.id}/').status_code, 404)
+        self.assertEqual([row['id'] for row in self.client.get('/api/v1/users/').json()], [self.other.id])
+        self.assertEqual(self.client.get('/api/v1/users/typeahead?q=auth').json(), [])
+
+    def test_user_purge_stages(self):
+        comment = self.populate()
+        job = self.delete(f'/api/v1/users/{self.author.id}/')
+        stages = []
+        while purge.run_chunk(job.pk, chunk_size=1):
+            job.refresh_from_db()
+            stages.append(job.stage)
+        self.assertEqual(list(dict.fromkeys(stages)), [stage.name for stage in purge.STAGES['user']])
+        job.refresh_from_db()
+        self.assertIsNotNone(job.finished_on)
+        self.assertEqual(job.deleted, len(stages))
+        self.assertFalse(purge.run_chunk(job.pk))
+
+        self.assertFalse(User.all_objects.filter(pk=self.author.id).exists())
+        self.assertFalse(Discussion.all_objects.filter(user_id=self.author.id).exists())
+        for model in [TimelineEntry, CommentLike, Like, Follow, UserSearchKey, FollowSuggestion]:
+            self.assertFalse(model.objects.exists(), model.__name__)
+        self.assertEqual(list(Comment.objects.all()), [comment])
+        self.assertFalse(Reply.objects.exists())
+        self.assertEqual(search_module.search('purged', Discussion.all_objects.all()), [])
+        # Counters on what's left no longer count the purged rows.
+        other = User.objects.get(pk=self.other.id)
+        self.assertEqual((other.follower_count, other.following_count), (0, 0))
+        kept = Discussion.objects.get(pk=self.kept.id)
+        self.assertEqual((kept.like_count, kept.comment_count), (0, 1))
+        comment.refresh_from_db()
+        self.assertEqual((comment.like_count, comment.reply_count), (0, 0))
+
+    def test_discussion_purge_stages(self):
+        self.populate()
+        job = self.delete(f'/api/v1/discussions/{self.discussion.id}/')
+        self.assertTrue(purge.run_job(job.pk, chunk_size=1))
+        job.refresh_from_db()
+        self.assertIsNotNone(job.finished_on)
+        self.assertEqual(job.stage, purge.STAGES['discussion'][-1].name)
+        self.assertFalse(Discussion.all_objects.filter(pk=self.discussion.id).exists())
+        self.assertFalse(Comment.objects.filter(discussion_id=self.discussion.id).exists())
+        self.assertFalse(TimelineEntry.objects.filter(discussion_id=self.discussion.id).exists())
+        self.assertFalse(DiscussionHashtag.objects.filter(discussion_id=self.discussion.id).exists())
+        self.assertTrue(User.objects.filter(pk=self.author.id).exists())
+        self.assertEqual(Discussion.objects.get(pk=self.kept.id).comment_count, 2)
+
+    def test_failed_job_resumes(self):
+        self.populate()
+        job = self.delete(f'/api/v1/users/{self.author.id}/')
+        self.assertTrue(purge.run_chunk(job.pk, chunk_size=1))
+        stage = purge.STAGES['user'][5]
+        with mock.patch.object(stage, 'delete', side_effect=DatabaseError('boom')), self.assertLogs('spyne.purge'):
+            self.assertFalse(purge.run_job(job.pk, chunk_size=1))
+        job.refresh_from_db()
+        self.assertEqual((job.error, job.finished_on), ('boom', None))
+        self.assertEqual(job.stage, purge.STAGES['user'][4].name)
+
+        self.assertTrue(purge.run_job(job.pk))
+        job.refresh_from_db()
+        self.assertEqual(job.error, '')
+        self.assertIsNotNone(job.finished_on)
+        self.assertFalse(User.all_objects.filter(pk=self.author.id).exists())
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pw', name='Admin', mobile='1',
+                                             is_staff=True)
+        cls.user = User.objects.create_user(email='user@example.com', password='pw', name='User', mobile='1')
+        start = timezone.make_aware(dt.datetime(2024, 1, 1))
+        cls.discussions = [
+            Discussion.objects.create(user=cls.user, text=f'discussion {i} \u00e9', created_on=start + timedelta(i))
+            for i in range(5)
+        ]
+        Follow.objects.create(follower=cls.user, following=cls.admin)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def lines(self, path):
+        return [json.loads(line) for line in self.export(path).decode('utf-8').splitlines()]
+
+    def test_admin_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/v1/export/discussions').status_code, 403)
+
+    def test_ndjson(self):
+        response = self.client.get('/api/v1/export/discussions')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="discussions.ndjson"')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual([row['id'] for row in rows], [discussion.id for discussion in self.discussions])
+        self.assertEqual(set(rows[0]), set(export.EXPORTS['discussions'][2]))
+        self.assertEqual(rows[0]['text'], 'discussion 0 \u00e9')
+        self.assertEqual(export.parse_time(rows[0]['created_on']), self.discussions[0].created_on)
+        follows = self.lines('/api/v1/export/follows')
+        self.assertEqual([(row['follower_id'], row['following_id']) for row in follows],
+                         [(self.user.id, self.admin.id)])
+
+    def test_filters(self):
+        ids = [discussion.id for discussion in self.discussions]
+        for query, expected in [
+            ('since=2024-01-02&until=2024-01-04', ids[1:3]),
+            (f'after={ids[2]}', ids[3:]),
+            (f'since=2024-01-02&after={ids[3]}', ids[4:]),
+            ('since=2024-01-02T00:00:00Z&until=2024-01-02T00:00:00Z', []),
+        ]:
+            rows = self.lines(f'/api/v1/export/discussions?{query}')
+            self.assertEqual([row['id'] for row in rows], expected, query)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/v1/export/users').status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/export/discussions?since=yesterday').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/export/discussions?after=last').status_code, 400)
+
+    def test_gzip(self):
+        response = self.client.get('/api/v1/export/discussions?gzip=1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="discussions.ndjson.gz"')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)),
+                         self.export('/api/v1/export/discussions'))
+
+    def test_chunks(self):
+        with self.assertNumQueries(3):
+            rows = list(export.rows('discussions', chunk_size=2))
+        self.assertEqual([row['id'] for row in rows], [discussion.id for discussion in self.discussions])
+        blocks = list(export.ndjson(rows, chunk_size=2))
+        self.assertEqual([block.count(b'\n') for block in blocks], [2, 2, 1])
+
+    @mock.patch('spyne.purge.IN_PROCESS', False)
+    def test_deleted_rows_excluded(self):
+        purge.soft_delete(self.discussions[0])
+        ids = [row['id'] for row in self.lines('/api/v1/export/discussions')]
+        self.assertEqual(ids, [discussion.id for discussion in self.discussions[1:]])
+
+
+class SuggestionTests(TestCase):
+    def setUp(self):
+        self.users = {
+            name: User.objects.create_user(email=f'{name}@example.com', password='pw', name=name.title(), mobile='1')
+            for name in 'abcdef'
+        }
+        for follower, following in ['ab', 'ac', 'bd', 'be', 'cd', 'ef']:
+            Follow.objects.create(follower=self.users[follower], following=self.users[following])
+        call_command('reconcile_counters', stdout=io.StringIO())
+        for alias in settings.CACHES:
+            caches[alias].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users['a'])
+
+    def stored(self, name):
+        rows = FollowSuggestion.objects.filter(user=self.users[name]).order_by('rank')
+        return [(row.candidate_id, row.mutuals) for row in rows]
+
+    def suggested(self, query=''):
+        response = self.client.get(f'/api/v1/users/{self.users["a"].id}/suggestions{query}')
+        self.assertEqual(response.status_code, 200)
+        return [(row['id'], row['mutuals']) for row in response.json()]
+
+    def test_friends_of_friends(self):
+        call_command('compute_suggestions', full=True, processes=1, stdout=io.StringIO())
+        users = self.users
+        # d is followed by both users a follows, e by one; f only fills the list up.
+        self.assertEqual(self.stored('a'), [(users['d'].id, 2), (users['e'].id, 1), (users['f'].id, 0)])
+        score = FollowSuggestion.objects.get(user=users['a'], rank=1).score
+        self.assertAlmostEqual(score, 2 + suggestions.POPULARITY_WEIGHT * math.log2(3))
+        self.assertEqual(self.suggested(), self.stored('a'))
+        self.assertEqual(self.suggested('?limit=1'), self.stored('a')[:1])
+
+    def test_incremental_refresh(self):
+        suggestions.refresh(full=True, processes=1)
+        self.assertFalse(SuggestionRefresh.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/follows/', {'following_id': self.users['d'].id})
+        self.assertEqual(response.status_code, 201)
+        # Followed since the last run: left out until then.
+        self.assertEqual(self.suggested(), self.stored('a')[1:])
+
+        before = {name: self.stored(name) for name in 'bcdef'}
+        self.assertEqual(suggestions.refresh(processes=1), 1)
+        self.assertFalse(SuggestionRefresh.objects.exists())
+        self.assertEqual({name: self.stored(name) for name in 'bcdef'}, before)
+        incremental = self.stored('a')
+        self.assertEqual(incremental, [(self.users['e'].id, 1), (self.users['f'].id, 0)])
+        suggestions.refresh(full=True, processes=1)
+        self.assertEqual(self.stored('a'), incremental)
+        self.assertEqual(suggestions.refresh(processes=1), 0)
+
+    @mock.patch('spyne.purge.IN_PROCESS', False)
+    def test_deleted_candidates_hidden(self):
+        suggestions.refresh(full=True, processes=1)
+        purge.soft_delete(self.users['d'])
+        self.assertEqual(self.suggested(), self.stored('a')[1:])
@@ -0,0 +1,56 @@
+from collections import defaultdict
+
+from django.db import connections, router
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .models import Reply
+
+
+def _ranked(comment_ids, limit):
+    # One query on servers with window functions (MySQL 8.0.2+, MariaDB 10.2+,
+    # SQLite 3.25+).
+    ranked = Reply.objects.filter(comment_id__in=comment_ids).annotate(
+        reply_rank=Window(
+            expression=RowNumber(),
+            partition_by=[F('comment_id')],
+            order_by=[F('created_on').asc(), F('id').asc()],
+        )
+    )
+    sql, params = ranked.query.sql_with_params()
+    rows = Reply.objects.raw(f'SELECT * FROM ({sql}) ranked_replies WHERE reply_rank <= %s', (*params, limit))
+    return sorted(rows, key=lambda reply: (reply.comment_id, reply.reply_rank))
+
+
+def _first(comment_ids, limit, features):
+    # Servers without window functions: a UNION ALL of each comment's first
+    # replies where the backend can slice its parts (MySQL), else a query per
+    # comment.
+    first = [
+        Reply.objects.filter(comment_id=comment_id).order_by('created_on', 'id')[:limit] for comment_id in comment_ids
+    ]
+    if features.supports_slicing_ordering_in_compound and len(first) > 1:
+        first = [first[0].union(*first[1:], all=True)]
+    rows = [reply for queryset in first for reply in queryset]
+    return sorted(rows, key=lambda reply: (reply.comment_id, reply.created_on, reply.id))
+
+
+def attach_first_replies(comments, limit):
+    # Sets comment.first_replies to each comment's oldest `limit` replies, loaded
+    # for the whole page in one query by ranking replies per comment with a
+    # window function, or a union where the server has none. (Sliced Prefetch
+    # querysets, which do the same, need Django 4.2.)
+    comments = list(comments)
+    replies = defaultdict(list)
+    if comments and limit > 0:
+        comment_ids = [comment.id for comment in comments]
+        features = connections[router.db_for_read(Reply)].features
+        if features.supports_over_clause:
+            rows = _ranked(comment_ids, limit)
+        else:
+            rows = _first(comment_ids, limit, features)
+        for reply in rows:
+            replies[reply.comment_id].append(reply)
+    for comment in comments:
+        comment.first_replies = replies[comment.id]
+    return comments
@@ -0,0 +1,178 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import (
+    Comment, Discussion, DiscussionHashtag, Like, TrendingScore, TrendingSnapshot, TrendingState, ViewDelta,
+)
+from .response_cache import invalidate
+
+# Each window ranks by activity decayed with its half-life in seconds.
+WINDOWS = getattr(settings, 'TRENDING_WINDOWS', {'hour': 3600, 'day': 6 * 3600, 'week': 2 * 86400})
+WEIGHTS = getattr(settings, 'TRENDING_WEIGHTS', {'view': 1, 'like': 5, 'comment': 10})
+SIZE = getattr(settings, 'TRENDING_SIZE', 100)
+# Likes and comments are consumed in id order past a watermark, which only
+# moves past events older than this many seconds: ids are allocated before
+# commit, so a newer event may already be visible while an older one, with a
+# lower id, isn't yet. Transactions open for longer lose their events.
+GRACE = getattr(settings, 'TRENDING_GRACE_SECONDS', 60)
+
+KINDS = ('discussion', 'hashtag')
+
+# (event source, model) of the watermarked sources; view deltas are deleted
+# as they're consumed.
+SOURCES = [
+    ('like', Like),
+    ('comment', Comment),
+]
+
+# Scores are stored as sum(weight * 2 ** ((event time - epoch) / half-life)).
+# Rather than decaying every score on each run, newer events are added with a
+# larger weight, so a run only rewrites rows with new activity and the stored
+# order is already the decayed order. Once the exponent passes REBASE_HALF_LIVES
+# the epoch moves forward, rescaling every score and dropping those that have
+# decayed below PRUNE_BELOW.
+REBASE_HALF_LIVES = 32
+PRUNE_BELOW = 0.01
+
+# Events older than this many of the longest half-life are ignored.
+HORIZON_HALF_LIVES = 10
+
+CHUNK_SIZE = 1000
+
+
+def record_views(counts):
+    # Called with the {discussion_id: views} of each view count flush.
+    if WINDOWS:
+        ViewDelta.objects.bulk_create([ViewDelta(discussion_id=pk, views=n) for pk, n in counts.items()])
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _rebase(old_epoch, new_epoch):
+    TrendingScore.objects.exclude(window__in=list(WINDOWS)).delete()
+    for window, half_life in WINDOWS.items():
+        scores = TrendingScore.objects.filter(window=window)
+        scores.update(score=F('score') * 2 ** (-(new_epoch - old_epoch) / half_life))
+        scores.filter(score__lt=PRUNE_BELOW).delete()
+
+
+def _consume(state, epoch, cutoff, settled):
+    # Returns {window: {discussion_id: score increment}} for the events added
+    # since the last run, advances the watermarks past those created before
+    # `settled` and deletes the view deltas read.
+    increments = {window: defaultdict(float) for window in WINDOWS}
+
+    def add(source, discussion_id, created_on, count=1):
+        if created_on >= cutoff:
+            for window, half_life in WINDOWS.items():
+                amount = WEIGHTS[source] * count * 2 ** ((created_on.timestamp() - epoch) / half_life)
+                increments[window][discussion_id] += amount
+
+    for source, model in SOURCES:
+        events = model.objects.filter(id__gt=state[source].value).order_by('id').values_list(
+            'id', 'discussion_id', 'created_on',
+        )
+        for pk, discussion_id, created_on in events.iterator(chunk_size=CHUNK_SIZE):
+            if created_on > settled:
+                break
+            add(source, discussion_id, created_on)
+            state[source].value = pk
+
+    consumed = []
+    deltas = ViewDelta.objects.order_by('id').values_list('id', 'discussion_id', 'created_on', 'views')
+    for pk, discussion_id, created_on, views in deltas.iterator(chunk_size=CHUNK_SIZE):
+        add('view', discussion_id, created_on, views)
+        consumed.append(pk)
+    for chunk in _chunks(consumed):
+        ViewDelta.objects.filter(id__in=chunk).delete()
+    return increments
+
+
+def _hashtag_increments(increments):
+    hashtags = defaultdict(list)
+    discussion_ids = set().union(*(scores.keys() for scores in increments.values()))
+    for chunk in _chunks(discussion_ids):
+        links = DiscussionHashtag.objects.filter(discussion_id__in=chunk).values_list('discussion_id', 'hashtag_id')
+        for discussion_id, hashtag_id in links:
+            hashtags[discussion_id].append(hashtag_id)
+
+    result = {window: defaultdict(float) for window in increments}
+    for window, scores in increments.items():
+        for discussion_id, amount in scores.items():
+            for hashtag_id in hashtags[discussion_id]:
+                result[window][hashtag_id] += amount
+    return result
+
+
+def _apply(kind, window, increments):
+    for chunk in _chunks(increments):
+        existing = {
+            row.object_id: row
+            for row in TrendingScore.objects.filter(kind=kind, window=window, object_id__in=chunk)
+        }
+        created = []
+        for object_id in chunk:
+            row = existing.get(object_id)
+            if row is None:
+                created.append(TrendingScore(kind=kind, window=window, object_id=object_id,
+                                             score=increments[object_id]))
+            else:
+                row.score += increments[object_id]
+        TrendingScore.objects.bulk_update(existing.values(), ['score'])
+        TrendingScore.objects.bulk_create(created)
+
+
+def _snapshot(now, epoch):
+    rows = []
+    for kind in KINDS:
+        for window, half_life in WINDOWS.items():
+            decay = 2 ** (-(now.timestamp() - epoch) / half_life)
+            top = TrendingScore.objects.filter(kind=kind, window=window)
+            if kind == 'discussion':
+                top = top.filter(object_id__in=Discussion.objects.values('id'))
+            top = top.order_by('-score').values_list('object_id', 'score')[:SIZE]
+            rows += [
+                TrendingSnapshot(kind=kind, window=window, rank=rank, object_id=object_id,
+                                 score=score * decay, computed_on=now)
+                for rank, (object_id, score) in enumerate(top, 1)
+            ]
+    TrendingSnapshot.objects.all().delete()
+    TrendingSnapshot.objects.bulk_create(rows)
+    return len(rows)
+
+
+def compute(now=None):
+    # Folds the likes, comments and views recorded since the last run into the
+    # running scores and replaces the ranked snapshots. Runs are serialized by
+    # locking the state rows.
+    now = now or timezone.now()
+    keys = ['epoch'] + [source for source, model in SOURCES]
+    with transaction.atomic():
+        TrendingState.objects.bulk_create([TrendingState(key=key) for key in keys], ignore_conflicts=True)
+        state = {row.key: row for row in TrendingState.objects.select_for_update().filter(key__in=keys)}
+
+        epoch = state['epoch'].value or int(now.timestamp())
+        if WINDOWS and (now.timestamp() - epoch) / min(WINDOWS.values()) > REBASE_HALF_LIVES:
+            _rebase(epoch, int(now.timestamp()))
+            epoch = int(now.timestamp())
+        state['epoch'].value = epoch
+
+        cutoff = now - timedelta(seconds=max(WINDOWS.values(), default=0) * HORIZON_HALF_LIVES)
+        increments = _consume(state, epoch, cutoff, now - timedelta(seconds=GRACE))
+        for kind, kind_increments in (('discussion', increments), ('hashtag', _hashtag_increments(increments))):
+            for window, scores in kind_increments.items():
+                _apply(kind, window, scores)
+
+        TrendingState.objects.bulk_update(state.values(), ['value'])
+        snapshot_rows = _snapshot(now, epoch)
+        invalidate('trending')
+    return snapshot_rows
@@ -0,0 +1,99 @@
+import hashlib
+import unicodedata
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import UserSearchKey
+
+CACHE_ALIAS = getattr(settings, 'TYPEAHEAD_CACHE_ALIAS', 'default')
+LIMIT = getattr(settings, 'TYPEAHEAD_LIMIT', 10)
+MAX_LIMIT = getattr(settings, 'TYPEAHEAD_MAX_LIMIT', 50)
+
+# Prefix matches are read in key order, an index range scan that stops after
+# CANDIDATES keys however many share a short prefix, and ranked here. Matches
+# of the whole prefix sort first. When more keys match, the rest are never
+# ranked; the completion narrows as more is typed.
+CANDIDATES = 1000
+
+# Ties on match quality go to the user with more followers.
+KIND_ORDER = {'name': 0, 'word': 1, 'email': 2}
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())[:255]
+
+
+def user_keys(user):
+    words = normalize(user.name).split()
+    keys = {}
+    if words:
+        keys[' '.join(words)] = 'name'
+    for i in range(1, len(words)):
+        keys.setdefault(' '.join(words[i:]), 'word')
+    email = normalize(user.email)
+    if email:
+        keys.setdefault(email, 'email')
+    return keys
+
+
+def index_users(users):
+    users = list(users)
+    keys = UserSearchKey.objects.filter(user__in=users)
+    old_keys = set(keys.values_list('key', flat=True))
+    keys.delete()
+    rows = [UserSearchKey(user=user, key=key, kind=kind) for user in users for key, kind in user_keys(user).items()]
+    UserSearchKey.objects.bulk_create(rows)
+    forget_keys(old_keys | {row.key for row in rows})
+
+
+def forget_user(user):
+    # After the user was deactivated or deleted.
+    forget_keys(UserSearchKey.objects.filter(user=user).values_list('key', flat=True))
+
+
+def forget_keys(keys):
+    # Evicts every cached prefix of the keys, whose results may now be missing
+    # or include the wrong users. The cache is process-local, so other
+    # processes catch up when their entries expire; so do rankings changed by
+    # new followers.
+    cache_keys = {_cache_key(key[:i]) for key in keys for i in range(1, len(key) + 1)}
+    if cache_keys:
+        transaction.on_commit(lambda: caches[CACHE_ALIAS].delete_many(cache_keys))
+
+
+def _cache_key(prefix):
+    return 'spyne:typeahead:' + hashlib.sha1(prefix.encode('utf-8')).hexdigest()
+
+
+def _successor(prefix):
+    # The smallest string greater than every string starting with prefix, so a
+    # prefix match is a plain range scan on the key index under any collation.
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def suggest(prefix, limit=LIMIT):
+    prefix = normalize(prefix)
+    if not prefix:
+        return []
+    cache = caches[CACHE_ALIAS]
+    cache_key = _cache_key(prefix)
+    results = cache.get(cache_key)
+    if results is None:
+        rows = (
+            UserSearchKey.objects.filter(key__gte=prefix, key__lt=_successor(prefix),
+                                         user__is_active=True, user__deleted_on__isnull=True)
+            .order_by('key', 'id')
+            .values_list('key', 'kind', 'user_id', 'user__name', 'user__follower_count')[:CANDIDATES]
+        )
+        best = {}
+        for key, kind, user_id, name, follower_count in rows:
+            rank = (key != prefix, KIND_ORDER[kind], -follower_count, name.lower(), user_id)
+            if user_id not in best or rank < best[user_id][0]:
+                best[user_id] = (rank, {'id': user_id, 'name': name})
+        results = [user for rank, user in sorted(best.values(), key=lambda item: item[0])][:MAX_LIMIT]
+        cache.set(cache_key, results)
+    return results[:limit]
@@ -16,11 +16,21 @@ urlpatterns = [
     path('', include(router.urls)),
     path('token/', CustomTokenObtainView.as_view(), name='token_obtain_pair'),
     path('users/search', UserSearchView.as_view(), name='user_search'),
+    path('users/typeahead', UserTypeaheadView.as_view(), name='user_typeahead'),
     path('users/update/<int:pk>', UserUpdateView.as_view(), name='user_update'),
     path('users/delete/<int:pk>', UserDeleteView.as_view(), name='user_delete'),
     path('discussions/update/<int:pk>', DiscussionUpdateView.as_view(), name='discussion_update'),
     path('discussions/delete/<int:pk>', DiscussionDeleteView.as_view(), name='discussion_delete'),
     path('discussions/search', DiscussionListView.as_view(), name='discussion_search'),
+    path('discussions/trending', TrendingDiscussionsView.as_view(), name='discussion_trending'),
+    path('hashtags/trending', TrendingHashtagsView.as_view(), name='hashtag_trending'),
+    path('discussions/<int:pk>/thread', DiscussionThreadView.as_view(), name='discussion_thread'),
     path('users/followers/<int:user_id>', FollowersListView.as_view({'get': 'list'}), name='user-followers'),
     path('users/following/<int:user_id>', FollowingListView.as_view({'get': 'list'}), name='user-following'),
+    path('users/follow-counts/<int:user_id>', FollowCountsView.as_view(), name='user-follow-counts'),
+    path('users/is-following/<int:user_id>/<int:other_id>', IsFollowingView.as_view(), name='user-is-following'),
+    path('users/mutuals/<int:user_id>', MutualFollowsView.as_view(), name='user-mutuals'),
+    path('users/<int:user_id>/suggestions', UserSuggestionsView.as_view(), name='user-suggestions'),
+    path('feed', FeedView.as_view(), name='feed'),
+    path('export/<str:kind>', ExportView.as_view(), name='export'),
 ]
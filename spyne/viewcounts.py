@@ -0,0 +1,85 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .counters import adjust_counters
+from .models import Discussion
+from .trending import record_views
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCountBuffer:
+    # Accumulates discussion view increments in memory and writes them back as
+    # UPDATE ... SET views = views + n, batched by n, instead of a read-modify-write
+    # of the whole row on every GET. Counts are at most flush_interval seconds
+    # stale (or max_pending distinct discussions, whichever comes first). A
+    # flush_interval of 0 writes every view through immediately. What is still
+    # buffered when the process exits is flushed then, once a view has started
+    # the flusher thread.
+
+    def __init__(self, flush_interval=5, max_pending=1000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = Counter()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+
+    def add(self, discussion_id, n=1):
+        with self.lock:
+            self.pending[discussion_id] += n
+            full = self.flush_interval <= 0 or len(self.pending) >= self.max_pending
+        self.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, Counter()
+            if not pending:
+                return 0
+
+            try:
+                with transaction.atomic():
+                    adjust_counters(Discussion, 'views', pending)
+                    record_views(pending)
+            except Exception:
+                logger.exception('Failed to flush %d buffered discussion views', sum(pending.values()))
+                with self.lock:
+                    self.pending.update(pending)
+                return 0
+            return len(pending)
+
+    def clear(self):
+        # Drops the buffered views without writing them, e.g. those counted
+        # against a test database that is about to be destroyed.
+        with self.lock:
+            self.pending.clear()
+
+    def start(self):
+        if self.thread is not None or self.flush_interval <= 0:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='view-count-flusher', daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            close_old_connections()
+            self.flush()
+
+
+view_counts = ViewCountBuffer(
+    flush_interval=getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 5),
+    max_pending=getattr(settings, 'VIEW_COUNT_MAX_PENDING', 1000),
+)
@@ -1,11 +1,62 @@
+from django.db import IntegrityError, router, transaction
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets, generics, status, permissions
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.serializers import ListSerializer
 from rest_framework.views import APIView
-from .models import User, Discussion, Follow, Comment, Like, CommentLike, Reply
-from .serializers import CustomTokenObtainSerializer, UserSerializer, DiscussionSerializer, FollowSerializer, CommentSerializer, LikeSerializer, CommentLikeSerializer, ReplySerializer
+from .models import User, Discussion, Follow, Comment, Like, CommentLike, Reply, Hashtag, TrendingSnapshot, FollowSuggestion
+from .serializers import CustomTokenObtainSerializer, UserSerializer, DiscussionSerializer, FollowSerializer, CommentSerializer, LikeSerializer, CommentLikeSerializer, ReplySerializer, ThreadCommentSerializer
 from .permissions import IsOwner
 from .filters import HashtagAndTextFilter
+from .pagination import KeysetPagination, FollowKeysetPagination, FeedPagination, SearchPagination
+from .search import ranked_ids
+from .counters import adjust_counter
+from .viewcounts import view_counts
+from .feed import fan_out, backfill, prune, timeline_querysets
+from . import follow_graph
+from .batch import parse_ids, like_many, follow_many
+from .response_cache import cache_response, discussion_tags, invalidate
+from .purge import soft_delete
+from .threads import attach_first_replies
+from . import trending
+from . import typeahead
+from . import fastpath
+from . import renderers
+from . import export
+from . import suggestions
+
+class FastListMixin:
+    # Renders list responses from .values() rows when the serializer, with the
+    # requested fields, compiles to a plan (see spyne/fastpath.py).
+    def list(self, request, *args, **kwargs):
+        plan = fastpath.compile(self.get_serializer())
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+        keys = []
+        if isinstance(self.paginator, KeysetPagination):
+            keys = [self.paginator.ordering_field, self.paginator.tiebreak_field]
+        queryset = plan.values(self.filter_queryset(self.get_queryset()), *keys)
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(plan.render(queryset))
+        return self.get_paginated_response(plan.render(page))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # After the response cache, which keeps the data rather than the body.
+        return renderers.streamed(super().finalize_response(request, response, *args, **kwargs))
+
+    def render_pks(self, pks):
+        # Data for the listed pks that still exist, in the order given.
+        serializer = self.get_serializer()
+        plan = fastpath.compile(serializer)
+        if plan is not None:
+            return list(plan.fetch(self.get_queryset(), pks).values())
+        nested = [field.source for field in serializer.fields.values() if isinstance(field, ListSerializer)]
+        instances = self.get_queryset().prefetch_related(*nested).in_bulk(pks)
+        return self.get_serializer([instances[pk] for pk in dict.fromkeys(pks) if pk in instances], many=True).data
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
@@ -18,11 +69,22 @@ class CustomTokenObtainView(APIView):
         serializer.is_valid(raise_exception=True)
         return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(FastListMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
-class UserSearchView(generics.ListAPIView):
+    def perform_create(self, serializer):
+        serializer.save()
+        invalidate('users')
+
+    def perform_update(self, serializer):
+        serializer.save()
+        invalidate('users')
+
+    def perform_destroy(self, instance):
+        soft_delete(instance)
+
+class UserSearchView(FastListMixin, generics.ListAPIView):
     serializer_class = UserSerializer
 
     def get_queryset(self):
@@ -32,21 +94,44 @@ class UserSearchView(generics.ListAPIView):
             queryset = queryset.filter(name__icontains=name)
         return queryset
 
+    @cache_response(lambda view, request, *args, **kwargs: ['users'])
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+class UserTypeaheadView(APIView):
+    # Ranked name/email prefix matches for search-as-you-type, served from an
+    # index and an in-process cache of recent prefixes.
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = int(request.query_params.get('limit', typeahead.LIMIT))
+        except ValueError:
+            limit = typeahead.LIMIT
+        limit = max(1, min(limit, typeahead.MAX_LIMIT))
+        return Response(typeahead.suggest(request.query_params.get('q', ''), limit))
+
 class UserUpdateView(generics.UpdateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def perform_update(self, serializer):
+        serializer.save()
+        invalidate('users')
+
 class UserDeleteView(generics.DestroyAPIView):
     queryset = User.objects.all()
     permission_classes = [permissions.IsAuthenticated]
+
+    def perform_destroy(self, instance):
+        soft_delete(instance)
+
     def delete(self, request, *args, **kwargs):
         instance = self.get_object()
         instance_id = instance.id
         self.perform_destroy(instance)
         return Response({'id': instance_id, 'message': 'User deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
 
-class FollowViewSet(viewsets.ModelViewSet):
+class FollowViewSet(FastListMixin, viewsets.ModelViewSet):
     queryset = Follow.objects.all()
     serializer_class = FollowSerializer
     permission_classes = [IsAuthenticated]
@@ -56,7 +141,15 @@ class FollowViewSet(viewsets.ModelViewSet):
             return Response({'error': 'following_id is required'}, status=status.HTTP_400_BAD_REQUEST)
 
         following_user = User.objects.get(id=following_id)
-        follow, created = Follow.objects.get_or_create(follower=request.user, following=following_user)
+        with transaction.atomic():
+            follow, created = Follow.objects.get_or_create(follower=request.user, following=following_user)
+            if created:
+                adjust_counter(User, following_user.id, 'follower_count', 1)
+                adjust_counter(User, request.user.id, 'following_count', 1)
+                backfill(request.user, following_user)
+                follow_graph.invalidate(request.user.id, following_user.id)
+                suggestions.mark_stale([request.user.id])
+                invalidate(f'followers:{following_user.id}', f'following:{request.user.id}')
 
         if not created:
             return Response({'error': 'You are already following this user'}, status=status.HTTP_400_BAD_REQUEST)
@@ -70,45 +163,124 @@ class FollowViewSet(viewsets.ModelViewSet):
         follow = Follow.objects.get(following_id=following_id, follower_id=follower_id)
         if follow.follower != request.user:
             return Response({'error': 'You cannot unfollow this user'}, status=status.HTTP_403_FORBIDDEN)
-        self.perform_destroy(follow)
+        with transaction.atomic():
+            self.perform_destroy(follow)
+            adjust_counter(User, follow.following_id, 'follower_count', -1)
+            adjust_counter(User, follow.follower_id, 'following_count', -1)
+            prune(request.user, follow.following_id)
+            follow_graph.invalidate(follow.follower_id, follow.following_id)
+            suggestions.mark_stale([follow.follower_id])
+            invalidate(f'followers:{follow.following_id}', f'following:{follow.follower_id}')
         return Response({'id': following_id, 'message': 'User unfollowed successfully'}, status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        try:
+            ids = parse_ids(request.data.get('following_ids'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'results': follow_many(request.user, ids)}, status=status.HTTP_200_OK)
+
 class FollowersListView(viewsets.ReadOnlyModelViewSet):
     serializer_class = FollowSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = FollowKeysetPagination
 
+    @cache_response(lambda view, request, *args, **kwargs: ['users', f"followers:{view.kwargs['user_id']}"])
     def list(self, request, *args, **kwargs):
         user_id = self.kwargs['user_id']
-        followers = Follow.objects.filter(following_id=user_id)
+        followers = self.paginate_queryset(
+            Follow.objects.filter(following_id=user_id, follower__deleted_on__isnull=True)
+            .values('id', 'created_at', 'follower_id', 'follower__name')
+        )
         follower_users = [
             {
-                'id': follow.following.id,
-                'name': User.objects.filter(id=user_id).first().name
+                'id': follow['follower_id'],
+                'name': follow['follower__name']
             }
             for follow in followers
         ]
-        return Response(follower_users, status=status.HTTP_200_OK)
+        return self.get_paginated_response(follower_users)
 
 class FollowingListView(viewsets.ReadOnlyModelViewSet):
     serializer_class = FollowSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = FollowKeysetPagination
 
+    @cache_response(lambda view, request, *args, **kwargs: ['users', f"following:{view.kwargs['user_id']}"])
     def list(self, request, *args, **kwargs):
         user_id = self.kwargs['user_id']
-        following = Follow.objects.filter(follower_id=user_id)
+        following = self.paginate_queryset(
+            Follow.objects.filter(follower_id=user_id, following__deleted_on__isnull=True)
+            .values('id', 'created_at', 'following_id', 'following__name')
+        )
         following_users = [
             {
-                'id': follow.follower.id,
-                'name': User.objects.filter(id=user_id).first().name
+                'id': follow['following_id'],
+                'name': follow['following__name']
             }
             for follow in following
         ]
-        return Response(following_users, status=status.HTTP_200_OK)
+        return self.get_paginated_response(following_users)
+
+class FollowCountsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, user_id):
+        counts = follow_graph.follow_counts(user_id)
+        if counts is None:
+            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'id': user_id, **counts}, status=status.HTTP_200_OK)
+
+class IsFollowingView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, user_id, other_id):
+        return Response({
+            'follower': user_id,
+            'following': other_id,
+            'is_following': follow_graph.is_following(user_id, other_id),
+            'is_followed_by': follow_graph.is_following(other_id, user_id),
+        }, status=status.HTTP_200_OK)
+
+class MutualFollowsView(generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    pagination_class = SearchPagination
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(follow_graph.mutual_ids(self.kwargs['user_id']))
+        names = dict(User.objects.filter(id__in=page).values_list('id', 'name'))
+        mutual_users = [{'id': user_id, 'name': names[user_id]} for user_id in page if user_id in names]
+        return self.get_paginated_response(mutual_users)
+
+class UserSuggestionsView(APIView):
+    # Who to follow, from the lists precomputed by compute_suggestions. Users
+    # followed since the last run are left out.
+    permission_classes = [IsAuthenticated]
+    default_limit = 20
+
+    def get(self, request, user_id):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        limit = max(1, min(limit, suggestions.SIZE))
+        followed = follow_graph.following_ids(user_id)
+        rows = (
+            FollowSuggestion.objects.filter(user_id=user_id, candidate__deleted_on__isnull=True)
+            .order_by('rank').values('candidate_id', 'candidate__name', 'mutuals')
+        )
+        results = [
+            {'id': row['candidate_id'], 'name': row['candidate__name'], 'mutuals': row['mutuals']}
+            for row in rows if row['candidate_id'] not in followed
+        ]
+        return Response(results[:limit])
 
-class DiscussionViewSet(viewsets.ModelViewSet):
+class DiscussionViewSet(FastListMixin, viewsets.ModelViewSet):
     queryset = Discussion.objects.all()
     serializer_class = DiscussionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -117,23 +289,54 @@ class DiscussionViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            discussion = serializer.save()
+            fan_out(discussion)
+            invalidate('discussions')
+
+    def perform_update(self, serializer):
+        discussion = serializer.save()
+        invalidate('discussions', f'discussion:{discussion.id}')
+
+    def list(self, request, *args, **kwargs):
+        ids = request.query_params.get('ids', None)
+        if ids is None:
+            return super().list(request, *args, **kwargs)
+        try:
+            ids = parse_ids(ids)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.render_pks(ids))
+
     def retrieve(self, request, pk=None):
+        response = self.retrieve_cached(request, pk=pk)
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            view_counts.add(int(pk))
+        return response
+
+    @cache_response(lambda view, request, pk=None: [f'discussion:{pk}'])
+    def retrieve_cached(self, request, pk=None):
         try:
             discussion = Discussion.objects.get(pk=pk)
-            discussion.views += 1
-            discussion.save()
-            serializer = DiscussionSerializer(discussion)
+            serializer = self.get_serializer(discussion)
             return Response(serializer.data)
         except Discussion.DoesNotExist:
             return Response({'error': 'Discussion not found'}, status=404)
 
-        return 0
+    def perform_destroy(self, instance):
+        soft_delete(instance)
 
 
 class DiscussionUpdateView(generics.UpdateAPIView):
     queryset = Discussion.objects.all()
     serializer_class = DiscussionSerializer
     permission_classes = [IsOwner]
+
+    def perform_update(self, serializer):
+        discussion = serializer.save()
+        invalidate('discussions', f'discussion:{discussion.id}')
+
     def put(self, request, *args, **kwargs):
         response = super().put(request, *args, **kwargs)
         updated_data = response.data
@@ -142,21 +345,138 @@ class DiscussionUpdateView(generics.UpdateAPIView):
 class DiscussionDeleteView(generics.DestroyAPIView):
     queryset = Discussion.objects.all()
     permission_classes = [IsOwner]
+
+    def perform_destroy(self, instance):
+        soft_delete(instance)
+
     def delete(self, request, *args, **kwargs):
         instance = self.get_object()
         instance_id = instance.id
         self.perform_destroy(instance)
         return Response({'id': instance_id, 'message': 'Discussion deleted successfully'}, status=status.HTTP_204_NO_CONTENT)
 
-class DiscussionListView(generics.ListAPIView):
+class DiscussionListView(FastListMixin, generics.ListAPIView):
     queryset = Discussion.objects.all()
     serializer_class = DiscussionSerializer
     filter_backends = [HashtagAndTextFilter]
+    pagination_class = KeysetPagination
+
+    @cache_response(lambda view, request, *args, **kwargs: ['discussions'])
+    def list(self, request, *args, **kwargs):
+        text = request.query_params.get('text', None)
+        if not text:
+            response = super().list(request, *args, **kwargs)
+            self.response_tags = discussion_tags(self.paginator.page)
+            return response
+
+        ranked = ranked_ids(text, self.filter_queryset(self.get_queryset()))
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(ranked, request, view=self)
+        self.response_tags = discussion_tags(page)
+        return paginator.get_paginated_response(self.render_pks(page))
+
+class DiscussionThreadView(generics.ListAPIView):
+    serializer_class = ThreadCommentSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    default_replies = 3
+    max_replies = 20
 
-class CommentViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        return Comment.objects.filter(discussion_id=self.kwargs['pk'])
+
+    def get_reply_limit(self):
+        try:
+            limit = int(self.request.query_params.get('replies', self.default_replies))
+        except ValueError:
+            return self.default_replies
+        return max(0, min(limit, self.max_replies))
+
+    @cache_response(lambda view, request, *args, **kwargs: [f"discussion:{view.kwargs['pk']}"])
+    def list(self, request, *args, **kwargs):
+        if not Discussion.objects.filter(pk=self.kwargs['pk']).exists():
+            return Response({'error': 'Discussion not found'}, status=status.HTTP_404_NOT_FOUND)
+        page = attach_first_replies(self.paginate_queryset(self.get_queryset()), self.get_reply_limit())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+class TrendingView(APIView):
+    # Serves the ranked snapshot written by compute_trending for one window.
+    permission_classes = [IsAuthenticated]
+    kind = None
+    default_limit = 20
+
+    def get_snapshot(self, request):
+        window = request.query_params.get('window', 'day')
+        if window not in trending.WINDOWS:
+            raise ValidationError({'error': f"window must be one of: {', '.join(trending.WINDOWS)}"})
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            limit = self.default_limit
+        limit = max(1, min(limit, trending.SIZE))
+        return window, list(TrendingSnapshot.objects.filter(kind=self.kind, window=window).order_by('rank')[:limit])
+
+    def get(self, request, *args, **kwargs):
+        window, snapshot = self.get_snapshot(request)
+        return Response({
+            'window': window,
+            'computed_on': snapshot[0].computed_on if snapshot else None,
+            'results': self.get_results(request, snapshot),
+        })
+
+class TrendingDiscussionsView(TrendingView):
+    kind = 'discussion'
+
+    @cache_response(lambda view, request, *args, **kwargs: ['trending', 'discussions'])
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_results(self, request, snapshot):
+        self.response_tags = discussion_tags(row.object_id for row in snapshot)
+        serializer = DiscussionSerializer(context={'request': request})
+        plan = fastpath.compile(serializer)
+        if plan is not None:
+            discussions = plan.fetch(Discussion.objects.all(), [row.object_id for row in snapshot])
+        else:
+            instances = Discussion.objects.prefetch_related('comments').in_bulk([row.object_id for row in snapshot])
+            discussions = dict(zip(instances, DiscussionSerializer(
+                list(instances.values()), many=True, context={'request': request}
+            ).data))
+        return [
+            {'rank': row.rank, 'score': row.score, 'discussion': discussions[row.object_id]}
+            for row in snapshot if row.object_id in discussions
+        ]
+
+class TrendingHashtagsView(TrendingView):
+    kind = 'hashtag'
+
+    @cache_response(lambda view, request, *args, **kwargs: ['trending'])
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_results(self, request, snapshot):
+        names = dict(Hashtag.objects.filter(id__in=[row.object_id for row in snapshot]).values_list('id', 'name'))
+        return [
+            {'rank': row.rank, 'name': names[row.object_id], 'score': row.score}
+            for row in snapshot if row.object_id in names
+        ]
+
+class FeedView(FastListMixin, generics.ListAPIView):
+    queryset = Discussion.objects.all()
+    serializer_class = DiscussionSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = FeedPagination
+
+    def list(self, request, *args, **kwargs):
+        rows = self.paginator.paginate_querysets(timeline_querysets(request.user), request, view=self)
+        return self.paginator.get_paginated_response(self.render_pks([row['discussion_id'] for row in rows]))
+
+class CommentViewSet(FastListMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrReadOnly]
+    pagination_class = KeysetPagination
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -165,6 +485,23 @@ class CommentViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            comment = serializer.save()
+            adjust_counter(Discussion, comment.discussion_id, 'comment_count', 1)
+            invalidate(f'discussion:{comment.discussion_id}')
+
+    def perform_update(self, serializer):
+        comment = serializer.save()
+        invalidate(f'discussion:{comment.discussion_id}')
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            discussion_id = instance.discussion_id
+            instance.delete()
+            adjust_counter(Discussion, discussion_id, 'comment_count', -1)
+            invalidate(f'discussion:{discussion_id}')
+
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
@@ -183,7 +520,7 @@ class CommentViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_204_NO_CONTENT)
 
 
-class LikeViewSet(viewsets.ModelViewSet):
+class LikeViewSet(FastListMixin, viewsets.ModelViewSet):
     queryset = Like.objects.all()
     serializer_class = LikeSerializer
     permission_classes = [IsAuthenticated]
@@ -203,21 +540,40 @@ class LikeViewSet(viewsets.ModelViewSet):
         if Like.objects.filter(discussion=discussion, user=user).exists():
             return Response({'error': 'You have already liked this discussion'}, status=status.HTTP_400_BAD_REQUEST)
 
-        like = Like(discussion=discussion, user=user)
-        like.save()
+        try:
+            with transaction.atomic():
+                like = Like(discussion=discussion, user=user)
+                like.save()
+                adjust_counter(Discussion, discussion.id, 'like_count', 1)
+                invalidate(f'discussion:{discussion.id}')
+        except IntegrityError:
+            # Lost a race with a concurrent like from the same user.
+            return Response({'error': 'You have already liked this discussion'}, status=status.HTTP_400_BAD_REQUEST)
         serializer = LikeSerializer(like)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def destroy(self, request, pk=None):
         user = request.user
         try:
-            like = Like.objects.get(discussion_id=pk, user=user)
-            like.delete()
+            with transaction.atomic():
+                like = Like.objects.get(discussion_id=pk, user=user)
+                like.delete()
+                adjust_counter(Discussion, like.discussion_id, 'like_count', -1)
+                invalidate(f'discussion:{like.discussion_id}')
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Like.DoesNotExist:
             return Response({'error': 'Like not found'}, status=status.HTTP_404_NOT_FOUND)
 
-class CommentLikeViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        try:
+            ids = parse_ids(request.data.get('discussions'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        results = like_many(request.user, ids, Like, Discussion, 'discussion')
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+class CommentLikeViewSet(FastListMixin, viewsets.ModelViewSet):
     queryset = CommentLike.objects.all()
     serializer_class = CommentLikeSerializer
     permission_classes = [IsAuthenticated]
@@ -229,10 +585,36 @@ class CommentLikeViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-class ReplyViewSet(viewsets.ModelViewSet):
+    def perform_create(self, serializer):
+        try:
+            with transaction.atomic():
+                comment_like = serializer.save()
+                adjust_counter(Comment, comment_like.comment_id, 'like_count', 1)
+                invalidate(f'discussion:{comment_like.comment.discussion_id}')
+        except IntegrityError:
+            raise ValidationError({'error': 'You have already liked this comment'})
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            comment_id = instance.comment_id
+            instance.delete()
+            adjust_counter(Comment, comment_id, 'like_count', -1)
+            invalidate(f'discussion:{instance.comment.discussion_id}')
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        try:
+            ids = parse_ids(request.data.get('comments'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        results = like_many(request.user, ids, CommentLike, Comment, 'comment')
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+class ReplyViewSet(FastListMixin, viewsets.ModelViewSet):
     queryset = Reply.objects.all()
     serializer_class = ReplySerializer
     permission_classes = [IsAuthenticated, IsOwnerOrReadOnly]
+    pagination_class = KeysetPagination
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -241,6 +623,23 @@ class ReplyViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            reply = serializer.save()
+            adjust_counter(Comment, reply.comment_id, 'reply_count', 1)
+            invalidate(f'discussion:{reply.comment.discussion_id}')
+
+    def perform_update(self, serializer):
+        reply = serializer.save()
+        invalidate(f'discussion:{reply.comment.discussion_id}')
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            comment_id = instance.comment_id
+            instance.delete()
+            adjust_counter(Comment, comment_id, 'reply_count', -1)
+            invalidate(f'discussion:{instance.comment.discussion_id}')
+
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
@@ -257,3 +656,35 @@ class ReplyViewSet(viewsets.ModelViewSet):
         self.perform_destroy(instance)
         return Response({'id': instance_id, 'message': 'Reply deleted successfully'},
                         status=status.HTTP_204_NO_CONTENT)
+
+class ExportView(APIView):
+    # Streams a whole table as NDJSON, one row per line in id order. An
+    # interrupted export resumes by passing the last id received as `after`.
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, kind):
+        if kind not in export.EXPORTS:
+            return Response({'error': f"kind must be one of: {', '.join(export.EXPORTS)}"},
+                            status=status.HTTP_404_NOT_FOUND)
+        params = request.query_params
+        try:
+            since = export.parse_time(params['since']) if params.get('since') else None
+            until = export.parse_time(params['until']) if params.get('until') else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            after = int(params.get('after') or 0)
+        except ValueError:
+            return Response({'error': 'after must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The rows are read while the response streams, after the middleware
+        # has finished with the request, so the database is chosen up front.
+        using = router.db_for_read(export.EXPORTS[kind][0].model)
+        blocks = export.ndjson(export.rows(kind, since, until, after, using=using))
+        if params.get('gzip') in ('1', 'true'):
+            response = StreamingHttpResponse(export.gzipped(blocks), content_type='application/gzip')
+            response['Content-Disposition'] = f'attachment; filename="{kind}.ndjson.gz"'
+        else:
+            response = StreamingHttpResponse(blocks, content_type='application/x-ndjson')
+            response['Content-Disposition'] = f'attachment; filename="{kind}.ndjson"'
+        return response